@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import multiprocessing
+
+# Benchmark every stage of the analysis on a synthetic corpus (see synthetic_corpus.py), without any of the
+# real data or external installs: tokenize, tag, count, align (with the numpy aligner in ibm2.py instead of
+# Moses or fast_align), score, bin/bootstrap and plot. Every stage runs in its own process, so that its peak
+# memory is its own, and its output goes to a log file in the data directory. The stages that use more than
+# one process are run with every number of processes in --procs, to see how they scale.
+#
+# $ python run_benchmarks.py --lines 50000 --procs 1 2 4 --save_baseline baseline.json
+#
+# and later, on the same machine, to find the stages that got slower (or use more memory) than that:
+# $ python run_benchmarks.py --lines 50000 --procs 1 2 4 --baseline baseline.json
+#
+# which exits with status 1 if any stage is more than --tolerance slower (or bigger) than in the baseline.
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for d in ('create-alignments', 'tagging-scripts', 'compare-mt', 'robustness-measure'):
+  sys.path.insert(0, os.path.join(repo_dir, d))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+score_types = ('sentbleu', 'chrf')
+
+def read_lines(fname):
+  with open(fname, 'r') as f:
+    return [line.rstrip('\n') for line in f]
+
+def systems(files):
+  return sorted(name for name in files if name.startswith('sys'))
+
+# The modules of the stages are only imported in the processes that run them, so that the memory that they
+# take up is not counted in every stage
+
+def stage_tokenize(files, work_dir, num_proc):
+  """do_tokenize.py with --tokenizer_only if the spacy models are installed, or else the rule-based
+  tokenizer of a blank spacy model (which is what --tokenizer_only runs), in the same way"""
+  import re
+  import shutil
+  import spacy
+  import subprocess
+  models = {'en': 'en_core_web_sm', 'fr': 'fr_core_news_sm'}
+  lines = 0
+  note = 'do_tokenize.py'
+  for lang in ('fr', 'en'):
+    fname = files[f'test.{lang}']
+    out = os.path.join(work_dir, f'bench.{lang}')
+    if spacy.util.is_package(models[lang]):
+      # do_tokenize.py writes FILE.tok, which must not replace the tokenized files of the corpus
+      shutil.copyfile(fname, out)
+      subprocess.run([sys.executable, os.path.join(repo_dir, 'create-alignments', 'do_tokenize.py'), lang,
+                      '--tokenizer_only', '--n_process', str(num_proc), out], check=True)
+    else:
+      note = 'blank spacy tokenizer (no spacy model installed)'
+      tokenizer = spacy.blank(lang).tokenizer
+      space_re = re.compile(r'  +')
+      with open(fname, 'r') as ins, open(f'{out}.tok', 'w', buffering=1<<20) as outs:
+        for line in ins:
+          doc = tokenizer(space_re.sub(' ', line.strip()))
+          outs.write(' '.join([tok.text for tok in doc if tok.text.strip() != '']) + '\n')
+    lines += sum(1 for _ in open(fname, 'rb'))
+  return lines, note
+
+def stage_tag(files, work_dir, num_proc):
+  from tag_files import tag_files
+  jobs = [(files['test.fr.tok'], 'fr', ['emoji', 'prn']), (files['test.en.tok'], 'en', ['emoji', 'prn'])]
+  jobs += [(files[s], 'en', ['emoji', 'prn']) for s in systems(files)]
+  tag_files(jobs, num_proc, store=True)
+  return sum(len(read_lines(f)) for f, _, _ in jobs), ''
+
+def stage_count(files, work_dir, num_proc):
+  from word_counts import count_files, save_counts
+  fnames = [files['train.fr.tok'], files['train.en.tok']]
+  for fname, counts in count_files(fnames, num_proc).items():
+    save_counts(counts, os.path.join(work_dir, os.path.basename(fname) + '.cnt.npz'))
+  return sum(len(read_lines(f)) for f in fnames), ''
+
+def stage_align(files, work_dir, num_proc):
+  import ibm2
+  from make_alignments import build_corpus
+  prefix = os.path.join(work_dir, f'align{num_proc}')
+  os.makedirs(prefix, exist_ok=True)
+  build_corpus([files['test.fr.tok']], [files['test.en.tok']], f'{prefix}/all.manifest', fe_out=f'{prefix}/all.fr-en')
+  ibm2.align_file(f'{prefix}/all.fr-en', f'{prefix}/all.align.fr-en', num_proc=num_proc, work_dir=prefix)
+  return len(read_lines(files['test.fr.tok'])), 'ibm2.py (instead of fast_align)'
+
+def stage_score(files, work_dir, num_proc):
+  import numpy as np
+  from sentence_scores import multi_system_scores
+  refs = read_lines(files['test.en.tok'])
+  outs = [read_lines(files[s]) for s in systems(files)]
+  for score_type in score_types:
+    np.save(os.path.join(work_dir, f'scores.{score_type}.npy'), multi_system_scores(outs, refs, score_type, num_proc))
+  return len(refs) * len(outs) * len(score_types), ''
+
+def stage_bin(files, work_dir, num_proc):
+  import numpy as np
+  from plot_score_vs_dist import bin_percentiles, paired_bootstrap
+  dists = np.load(files['test.fr.normed_nll.npy'])
+  for score_type in score_types:
+    scores = np.load(os.path.join(work_dir, f'scores.{score_type}.npy'))
+    bin_percentiles(dists, scores[0], 20, np.arange(0, 101, 10), bs_resampling=(1000, 100), seed=0)
+    paired_bootstrap(scores, 1000, seed=0)
+  return len(dists) * len(score_types), ''
+
+def stage_plot(files, work_dir, num_proc):
+  import numpy as np
+  from plot_score_vs_dist import render_figure
+  dists = np.load(files['test.fr.normed_nll.npy'])
+  origin = np.zeros(len(dists), dtype=int)
+  jobs = []
+  for score_type in score_types:
+    scores = np.load(os.path.join(work_dir, f'scores.{score_type}.npy'))
+    for k, s in enumerate(systems(files)):
+      jobs.append((dists, scores[k], origin, ['test'], score_type, os.path.join(work_dir, f'{s}.{score_type}.png'),
+                   None, 0, False))
+  # The same as plot_score_vs_dist.py --manifest
+  with multiprocessing.Pool(num_proc) as pool:
+    pool.map(render_figure, jobs)
+  return len(dists) * len(jobs), ''
+
+class Stage:
+  """A stage to benchmark: func(files, work_dir, num_proc) does the work and returns the number of lines
+  that it handled (and a note on how it was done). Stages that scale are run with every number of processes,
+  and the ones in requires have to run first."""
+
+  def __init__(self, name, func, scales=True, requires=()):
+    self.name = name
+    self.func = func
+    self.scales = scales
+    self.requires = requires
+
+stages = [
+  Stage('tokenize', stage_tokenize, scales=False),
+  Stage('tag', stage_tag),
+  Stage('count', stage_count),
+  Stage('align', stage_align),
+  Stage('score', stage_score),
+  Stage('bin', stage_bin, scales=False, requires=('score',)),
+  Stage('plot', stage_plot, requires=('score',)),
+]
+
+def _run_child(stage, files, work_dir, num_proc, log_file, conn):
+  """Run a stage with its output going to log_file, and send its timings and peak memory back"""
+  fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+  os.dup2(fd, 1)
+  os.dup2(fd, 2)
+  try:
+    start, cpu = time.perf_counter(), os.times()
+    lines, note = stage.func(files, work_dir, num_proc)
+    elapsed = time.perf_counter() - start
+    end_cpu = os.times()
+    cpu_time = sum(end_cpu[:4]) - sum(cpu[:4])
+    # ru_maxrss is in kilobytes on linux (and bytes on macos). The processes of the stage's pools have all
+    # been waited for by now, so they count as children.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+    conn.send({'seconds': elapsed, 'cpu_seconds': cpu_time, 'lines': lines, 'peak_rss_mb': rss / (1<<20), 'note': note})
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+def run_stage(stage, files, work_dir, num_proc):
+  """Run a stage in a new process and return its measurements"""
+  log_file = os.path.join(work_dir, f'{stage.name}.{num_proc}.log')
+  ctx = multiprocessing.get_context('fork')
+  recv, send = ctx.Pipe(False)
+  # Or the child would print what is still buffered once more
+  sys.stdout.flush()
+  proc = ctx.Process(target=_run_child, args=(stage, files, work_dir, num_proc, log_file, send))
+  proc.start()
+  send.close()
+  try:
+    result = recv.recv()
+  except EOFError:
+    result = None
+  proc.join()
+  if proc.exitcode != 0 or result is None:
+    raise RuntimeError(f'Stage {stage.name} failed with {num_proc} processes, see {log_file}')
+  result['lines_per_sec'] = result['lines'] / result['seconds']
+  return result
+
+def run_benchmarks(files, work_dir, names, procs, repeat=1):
+  """Run the stages in names, each with every number of processes in procs (if it scales) and repeat
+  times, and return {STAGE@PROCS: measurements} with the fastest time and the highest peak memory"""
+  results = {}
+  done = set()
+  for stage in stages:
+    if stage.name not in names:
+      continue
+    for required in stage.requires:
+      if required not in done:
+        print(f'running {required} (needed by {stage.name})')
+        run_stage(next(s for s in stages if s.name == required), files, work_dir, 1)
+        done.add(required)
+    for num_proc in (procs if stage.scales else [1]):
+      runs = [run_stage(stage, files, work_dir, num_proc) for _ in range(repeat)]
+      best = min(runs, key=lambda r: r['seconds'])
+      best['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+      results[f'{stage.name}@{num_proc}'] = best
+      print(f'{stage.name} with {num_proc} processes: {best["lines_per_sec"]:.0f} lines/sec, '
+            f'{best["peak_rss_mb"]:.0f}MB')
+    done.add(stage.name)
+  return results
+
+def report(results):
+  """A table of the results, with the speedup of every stage over its run with one process"""
+  rows = [('stage', 'procs', 'seconds', 'cpu sec', 'lines/sec', 'speedup', 'peak MB', 'note')]
+  for key, r in results.items():
+    name, num_proc = key.split('@')
+    one = results.get(f'{name}@1')
+    speedup = f'{r["lines_per_sec"] / one["lines_per_sec"]:.2f}x' if one else ''
+    rows.append((name, num_proc, f'{r["seconds"]:.2f}', f'{r["cpu_seconds"]:.2f}', f'{r["lines_per_sec"]:.0f}',
+                 speedup, f'{r["peak_rss_mb"]:.0f}', r['note']))
+  widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+  return '\n'.join('  '.join(x.ljust(w) for x, w in zip(row, widths)).rstrip() for row in rows)
+
+def compare_baseline(results, baseline, tolerance):
+  """The (stage, message) regressions of the results compared to a baseline"""
+  regressions = []
+  for key, r in results.items():
+    base = baseline['results'].get(key)
+    if base is None:
+      continue
+    if r['lines_per_sec'] < (1 - tolerance) * base['lines_per_sec']:
+      regressions.append((key, f'{r["lines_per_sec"]:.0f} lines/sec, was {base["lines_per_sec"]:.0f}'))
+    if r['peak_rss_mb'] > (1 + tolerance) * base['peak_rss_mb']:
+      regressions.append((key, f'peak memory {r["peak_rss_mb"]:.0f}MB, was {base["peak_rss_mb"]:.0f}MB'))
+  return regressions
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Benchmark the stages of the analysis on a synthetic corpus""")
+  p.add_argument("--lines", help="number of sentences in the synthetic corpus", type=int, default=20000)
+  p.add_argument("--seed", help="random seed of the synthetic corpus", type=int, default=0)
+  p.add_argument("--emoji", help="probability of (each more) emoji in a sentence", type=float, default=0.05)
+  p.add_argument("--casing", help="probability that a word is cased oddly", type=float, default=0.1)
+  p.add_argument("--pronouns", help="probability that a word is a pronoun", type=float, default=0.2)
+  p.add_argument("--data_dir", help="directory to write the corpus and the outputs of the stages to (default bench-data/LINES-SEED)", type=str, default=None)
+  p.add_argument("--stages", help="stages to run", type=str, nargs='+', choices=[s.name for s in stages], default=[s.name for s in stages])
+  p.add_argument("--procs", help="numbers of processes to run the stages that use a pool with", type=int, nargs='+', default=[1])
+  p.add_argument("--repeat", help="run every stage this many times and keep the fastest", type=int, default=1)
+  p.add_argument("--save_baseline", help="write the results to this JSON file", type=str, default=None)
+  p.add_argument("--baseline", help="compare the results to those in this JSON file", type=str, default=None)
+  p.add_argument("--tolerance", help="how much slower (or bigger) than the baseline a stage can be", type=float, default=0.2)
+  args = p.parse_args()
+
+  from synthetic_corpus import write_corpus
+  config = {'lines': args.lines, 'seed': args.seed, 'emoji': args.emoji, 'casing': args.casing, 'pronouns': args.pronouns}
+  data_dir = args.data_dir or f'bench-data/{args.lines}-{args.seed}'
+  # The corpus is only made again when it was made with other settings
+  config_file = os.path.join(data_dir, 'config.json')
+  files = None
+  if os.path.isfile(config_file):
+    with open(config_file, 'r') as f:
+      saved = json.load(f)
+    if saved['config'] == config:
+      files = saved['files']
+  if files is None:
+    start = time.time()
+    files = write_corpus(data_dir, args.lines, args.seed, args.emoji, args.casing, args.pronouns)
+    print(f'wrote the corpus to {data_dir} in {time.time() - start:.1f}s')
+    with open(config_file, 'w') as f:
+      json.dump({'config': config, 'files': files}, f)
+
+  results = run_benchmarks(files, data_dir, args.stages, args.procs, args.repeat)
+  print(report(results))
+
+  machine = {'cpus': os.cpu_count(), 'python': platform.python_version(), 'platform': platform.platform()}
+  if args.save_baseline:
+    with open(args.save_baseline, 'w') as f:
+      json.dump({'config': config, 'machine': machine, 'results': results}, f, indent=1)
+    print(f'saved the baseline to {args.save_baseline}')
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+    if baseline['config'] != config:
+      raise ValueError(f'{args.baseline} was made with other corpus settings: {baseline["config"]}')
+    if baseline['machine'] != machine:
+      print(f'warning: {args.baseline} was made on another machine: {baseline["machine"]}')
+    regressions = compare_baseline(results, baseline, args.tolerance)
+    for key, msg in regressions:
+      print(f'REGRESSION {key}: {msg}')
+    if regressions:
+      sys.exit(1)
+    print(f'no regressions compared to {args.baseline}')
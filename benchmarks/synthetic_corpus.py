@@ -0,0 +1,147 @@
+import os
+import random
+import argparse
+import numpy as np
+
+# Make a synthetic noisy parallel corpus that looks enough like MTNT (reddit comments with emoji, odd
+# casing, lots of first and second person pronouns) to benchmark the scripts on, without any of the real
+# data. The French side is a made-up word-by-word "translation" of the English side (with some local
+# reordering), so that the aligners have something to learn. For fr-en, DIR gets:
+#
+#  test.fr, test.en              raw source and reference, with punctuation attached to the words
+#  test.fr.tok, test.en.tok      the same, tokenized (one space between tokens)
+#  sysN.en.tok                   the reference with some words dropped or changed, as system outputs
+#  test.fr.normed_nll.npy        a distance per sentence that grows with its noise
+#  train.fr.tok, train.en.tok    clean training data, for the word counts
+#
+# $ python synthetic_corpus.py DIR --lines 100000 --emoji 0.05 --casing 0.1 --pronouns 0.2
+
+pronouns = {
+  'i': ['je'], 'me': ['moi', 'me'], 'my': ['mon', 'ma'], 'you': ['tu', 'vous', 'toi'], 'your': ['ton', 'votre'],
+  'he': ['il'], 'she': ['elle'], 'we': ['nous', 'on'], 'they': ['ils', 'elles'], 'us': ['nous'],
+}
+emojis = ['😂', '😀', '🙄', '😭', '👍', '❤️', '🔥', '🤔', '🎉', '😍', '👌', '💯']
+punctuation = [',', '.', '!', '?', '...', '!!', ':)', ';)']
+syllables = 'ba be bi bo bu ca ce co da de di do fa fe fi fo ga ge la le li lo ma me mi mo na ne ni no ' \
+            'pa pe pi po ra re ri ro sa se si so ta te ti to va ve vi vo'.split()
+
+def make_vocab(rng, size):
+  """English-ish words and their made-up French translations, with a Zipfian frequency"""
+  words, seen = [], set(pronouns)
+  while len(words) < size:
+    w = ''.join(rng.choice(syllables) for _ in range(rng.randint(1, 3)))
+    if w not in seen:
+      seen.add(w)
+      words.append(w)
+  translations = {w: ''.join(reversed(w)) + rng.choice(['', 'e', 'ment', 'ion']) for w in words}
+  weights = [1.0 / (rank + 1) for rank in range(size)]
+  return words, translations, weights
+
+def noisy_case(rng, word, casing):
+  if rng.random() >= casing:
+    return word
+  return rng.choice([word.upper(), word.title(), word[:1] + word[1:].upper()])
+
+def sentence_pair(rng, vocab, translations, weights, emoji, casing, pronoun_rate):
+  """(English tokens, French tokens, noise) of one random sentence, where noise counts the noisy tokens"""
+  n = min(int(rng.expovariate(1 / 14)) + 1, 120)
+  en, fr, noise = [], [], 0
+  for w in rng.choices(vocab, weights, k=n):
+    if rng.random() < pronoun_rate:
+      p = rng.choice(list(pronouns))
+      en.append(p)
+      fr.append(rng.choice(pronouns[p]))
+    else:
+      en.append(w)
+      fr.append(translations[w])
+  # Adjacent words are sometimes swapped in French
+  for i in range(len(fr) - 1):
+    if rng.random() < 0.1:
+      fr[i], fr[i+1] = fr[i+1], fr[i]
+  for toks in (en, fr):
+    toks[0] = toks[0].title()
+  for i in range(len(en)):
+    e, f = noisy_case(rng, en[i], casing), noisy_case(rng, fr[i], casing)
+    noise += (e != en[i]) + (f != fr[i])
+    en[i], fr[i] = e, f
+  if rng.random() < 0.7:
+    p = rng.choice(punctuation)
+    en.append(p)
+    fr.append(p)
+  while rng.random() < emoji:
+    e = rng.choice(emojis)
+    at = rng.randint(0, len(en))
+    en.insert(at, e)
+    fr.insert(min(at, len(fr)), e)
+    noise += 2
+  return en, fr, noise
+
+def detokenize(toks):
+  """Attach punctuation to the word before it, the way people write (and tokenizers have to undo)"""
+  out = []
+  for t in toks:
+    if out and t in punctuation[:6]:
+      out[-1] += t
+    else:
+      out.append(t)
+  return ' '.join(out)
+
+def system_output(rng, toks, vocab, error_rate):
+  """A "translation" of a sentence that drops, repeats or changes some of its words"""
+  out = []
+  for t in toks:
+    r = rng.random()
+    if r < error_rate / 3:
+      continue
+    elif r < 2 * error_rate / 3:
+      out.append(rng.choice(vocab))
+    elif r < error_rate:
+      out += [t, t]
+    else:
+      out.append(t)
+  return out or toks[:1]
+
+def write_corpus(out_dir, lines, seed=0, emoji=0.05, casing=0.1, pronoun_rate=0.2, num_systems=3, vocab_size=20000):
+  """Write the test and training files of a synthetic fr-en corpus to out_dir, and return their names"""
+  os.makedirs(out_dir, exist_ok=True)
+  rng = random.Random(seed)
+  vocab, translations, weights = make_vocab(rng, vocab_size)
+  files = {name: os.path.join(out_dir, name) for name in
+           ['test.fr', 'test.en', 'test.fr.tok', 'test.en.tok', 'train.fr.tok', 'train.en.tok'] +
+           [f'sys{k}.en.tok' for k in range(1, num_systems + 1)]}
+  outs = {name: open(fname, 'w', buffering=1<<20) for name, fname in files.items()}
+  dists = np.empty(lines)
+  try:
+    for i in range(lines):
+      en, fr, noise = sentence_pair(rng, vocab, translations, weights, emoji, casing, pronoun_rate)
+      dists[i] = 3 + noise / (len(en) + len(fr)) * 10 + rng.gauss(0, 0.5)
+      outs['test.fr'].write(detokenize(fr) + '\n')
+      outs['test.en'].write(detokenize(en) + '\n')
+      outs['test.fr.tok'].write(' '.join(fr) + '\n')
+      outs['test.en.tok'].write(' '.join(en) + '\n')
+      for k in range(1, num_systems + 1):
+        outs[f'sys{k}.en.tok'].write(' '.join(system_output(rng, en, vocab, 0.1 * k)) + '\n')
+      # The training data is clean
+      en, fr, _ = sentence_pair(rng, vocab, translations, weights, 0, 0, pronoun_rate / 2)
+      outs['train.fr.tok'].write(' '.join(fr) + '\n')
+      outs['train.en.tok'].write(' '.join(en) + '\n')
+  finally:
+    for out in outs.values():
+      out.close()
+  files['test.fr.normed_nll.npy'] = os.path.join(out_dir, 'test.fr.normed_nll.npy')
+  np.save(files['test.fr.normed_nll.npy'], dists)
+  return files
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Write a synthetic noisy fr-en corpus for benchmarking""")
+  p.add_argument("out_dir", help="directory to write the corpus to", type=str)
+  p.add_argument("--lines", help="number of test (and training) sentences", type=int, default=100000)
+  p.add_argument("--seed", help="random seed", type=int, default=0)
+  p.add_argument("--emoji", help="probability of (each more) emoji in a sentence", type=float, default=0.05)
+  p.add_argument("--casing", help="probability that a word is cased oddly", type=float, default=0.1)
+  p.add_argument("--pronouns", help="probability that a word is a pronoun", type=float, default=0.2)
+  p.add_argument("--systems", help="number of system outputs", type=int, default=3)
+  args = p.parse_args()
+
+  files = write_corpus(args.out_dir, args.lines, args.seed, args.emoji, args.casing, args.pronouns, args.systems)
+  print(f'wrote {" ".join(sorted(files.values()))}')
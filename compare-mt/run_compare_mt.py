@@ -4,102 +4,147 @@ import argparse
 
 ### Analysis script for the WMT 2019 robustness shared task
 
-p = argparse.ArgumentParser(description="""
-  Perform analysis using compare-mt for the wmt robustness task data
+def run_cmd(cmd):
+  """Run a shell command (recording it in the trace), and fail if it fails"""
+  instrument.tracer.run_cmd(cmd)
 
-  Run this script, and the results should be written so you can see them in compare/compare-{langpair}/index.html  
-""")
-p.add_argument("langpair", help="what language pair to use (e.g. fr-en)", type=str)
-p.add_argument("--aligner", help="what aligner to use (giza or fa)", type=str, default='giza')
-p.add_argument("--cmtdir", help="top directory of compare-mt", type=str, default='/home/gneubig/work/compare-mt')
-p.add_argument("--jsaltdir", help="top directory of JSALT scripts", type=str, default='/home/gneubig/work/jsalt2019-informal')
-args = p.parse_args()
+# The tagging below uses a process pool, so this only runs when the script is run directly
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""
+    Perform analysis using compare-mt for the wmt robustness task data
 
-# Get the language pair and component parts
-langpair = args.langpair
-src, trg = langpair.split('-')
-jafr = src if src != 'en' else trg
+    Run this script, and the results should be written so you can see them in compare/compare-{langpair}/index.html  
+  """)
+  p.add_argument("langpair", help="what language pair to use (e.g. fr-en)", type=str)
+  p.add_argument("--aligner", help="what aligner to use (giza, fa or ibm2)", type=str, default='giza')
+  p.add_argument("--cmtdir", help="top directory of compare-mt (no longer needed, as the word counts are made by word_counts.py)", type=str, default='/home/gneubig/work/compare-mt')
+  p.add_argument("--jsaltdir", help="top directory of JSALT scripts", type=str, default='/home/gneubig/work/jsalt2019-informal')
+  p.add_argument("--num_proc", help="number of processes to count words, tag files and run compare-mt with", type=int, default=4)
+  p.add_argument("--tag_cache", help="directory to cache label files in, which can be shared between language pairs (empty to only tag files without labels)", type=str, default='tag-cache')
+  p.add_argument("--tag_cache_size", help="maximum size of the label cache in MB", type=int, default=2000)
+  p.add_argument("--trace", help="file to append a JSON record of the time, memory and data of every step to", type=str, default='compare/trace.jsonl')
+  p.add_argument("--profile", help="directory to write cProfile profiles of the python steps to", type=str, default=None)
+  p.add_argument("--no_store", help="do not use the label stores of the files, and only tag files whose label files are missing (or all of them with --tag_cache)", action='store_true')
+  args = p.parse_args()
 
-sd = 'wmt2019-system-data'
-# Get the data if it doesn't exist
-if not os.path.isdir(sd):
-  run_cmd('wget http://phontron.com/data/wmt2019-aligned-data.tar.gz')
-  run_cmd('tar -xzf wmt2019-aligned-data.tar.gz')
+  sys.path.insert(0, f'{args.jsaltdir}/tagging-scripts')
+  sys.path.insert(0, f'{args.jsaltdir}/create-alignments')
+  import instrument
+  tracer = instrument.configure(args.trace, args.profile)
+  from tag_files import tag_files, stored_labels
+  from label_store import LabelStore, label_file, align_file
+  from word_counts import build_count_files
+  from sharded_report import run_report_jobs
 
+  # Get the language pair and component parts
+  langpair = args.langpair
+  src, trg = langpair.split('-')
+  jafr = src if src != 'en' else trg
 
-def run_cmd(cmd):
-  print(f'running: {cmd}')
-  os.system(cmd)
+  sd = 'wmt2019-system-data'
+  # Get the data if it doesn't exist
+  if not os.path.isdir(sd):
+    run_cmd('wget http://phontron.com/data/wmt2019-aligned-data.tar.gz')
+    run_cmd('tar -xzf wmt2019-aligned-data.tar.gz')
 
-# Cache the counts from the corpora if they don't already exist
-for l in (src, trg):
-  for f in (f'{sd}/mtnt/mtnt-train.{langpair}.{l}.tok', f'{sd}/extra/{jafr}/train.{l}.tok'):
-    if not os.path.isfile(f):
-      raise ValueError(f'File {f} not found')
-    if not os.path.isfile(f'{f}.cnt'):
-      run_cmd(f'python {args.cmtdir}/scripts/count.py < {f} > {f}.cnt')
+  # Cache the counts from the corpora if they don't already exist (all of them at the same time)
+  cnt_files = []
+  for l in (src, trg):
+    for f in (f'{sd}/mtnt/mtnt-train.{langpair}.{l}.tok', f'{sd}/extra/{jafr}/train.{l}.tok'):
+      if not os.path.isfile(f):
+        raise ValueError(f'File {f} not found')
+      if not os.path.isfile(f'{f}.cnt'):
+        cnt_files.append(f)
+  if cnt_files:
+    with tracer.stage('word_counts', inputs=cnt_files, outputs=[f'{f}.cnt' for f in cnt_files]):
+      build_count_files(cnt_files, args.num_proc)
 
-systems = {
-  'fr-en': 'bdosu cuni nle'.split(),
-  'en-fr': 'bdosu cuni nle'.split(),
-  'ja-en': 'ntt nle'.split(),
-  'en-ja': 'ntt nle'.split()
-}
+  systems = {
+    'fr-en': 'bdosu cuni nle'.split(),
+    'en-fr': 'bdosu cuni nle'.split(),
+    'ja-en': 'ntt nle'.split(),
+    'en-ja': 'ntt nle'.split()
+  }
 
-# Find all the system files that we want to use
-syss = systems[langpair]
-sys_len = len(syss)
-sys_str = ' '.join([x.upper() for x in syss])
-out_toks = [f'{sd}/outputs/{langpair}/{s}.{trg}.tok' for s in syss]
-out_tok_str = ' '.join(out_toks)
-src_tok = f'{sd}/mtnt/mtnt-test2019.{langpair}.{src}.tok'
-trg_tok = f'{sd}/mtnt/mtnt-test2019.{langpair}.{trg}.tok'
-refout_str = (f'ref_XXX='+
-             trg_tok.replace(f'.tok', f'.YYY')+
-             ',out_XXX="'+
-             ';'.join([f.replace(f'.tok',f'.YYY') for f in out_toks])+
-             '"')
-align_str = f'ref_align_file={sd}/mtnt/mtnt-test2019.{langpair}.{langpair}-{args.aligner}align'
-emoji_str = refout_str.replace('XXX', 'labels').replace('YYY', f'emoji')
-prn_str = refout_str.replace('XXX', 'labels').replace('YYY', f'prn')
-all_toks = out_toks + [trg_tok] + [src_tok]
-all_langs = [trg for _ in all_toks]
-all_langs[-1] = src
+  # Find all the system files that we want to use
+  syss = systems[langpair]
+  sys_len = len(syss)
+  sys_str = ' '.join([x.upper() for x in syss])
+  out_toks = [f'{sd}/outputs/{langpair}/{s}.{trg}.tok' for s in syss]
+  out_tok_str = ' '.join(out_toks)
+  src_tok = f'{sd}/mtnt/mtnt-test2019.{langpair}.{src}.tok'
+  trg_tok = f'{sd}/mtnt/mtnt-test2019.{langpair}.{trg}.tok'
+  refout_str = (f'ref_XXX='+
+               trg_tok.replace(f'.tok', f'.YYY')+
+               ',out_XXX="'+
+               ';'.join([f.replace(f'.tok',f'.YYY') for f in out_toks])+
+               '"')
+  align_name = f'{langpair}-{args.aligner}align'
+  # make_alignments.py keeps the alignments in the label store of the non-English side
+  align_store = f'{sd}/mtnt/mtnt-test2019.{langpair}.{jafr}.tok'
+  align_str = f'ref_align_file={align_file(align_store, align_name)}'
+  emoji_str = refout_str.replace('XXX', 'labels').replace('YYY', f'emoji')
+  prn_str = refout_str.replace('XXX', 'labels').replace('YYY', f'prn')
+  all_toks = out_toks + [trg_tok] + [src_tok]
+  all_langs = [trg for _ in all_toks]
+  all_langs[-1] = src
 
-# Do any necessary extra tagging on the target
-# NOTE: If you want to add extra analysis, this would be a good place to add it by writing a tagging script and applying it here
-for fin, lang in zip(all_toks, all_langs):
-  fout = fin.replace('.tok', '.emoji')
-  assert(fout != fin)
-  if not os.path.isfile(fout):
-    run_cmd(f'python {args.jsaltdir}/tagging-scripts/tag_emojis.py < {fin} > {fout}')
-  fout = fin.replace('.tok', '.prn')
-  assert(fout != fin)
-  if not os.path.isfile(fout):
-    run_cmd(f'python {args.jsaltdir}/tagging-scripts/tag_pronouns.py {lang} < {fin} > {fout}')
+  # Do any necessary extra tagging on the target
+  # NOTE: If you want to add extra analysis, this would be a good place to add it by registering a tagger in
+  #       tagging-scripts/tag_files.py and adding its label here. All label files of a file are written in
+  #       one pass over it, and the files are tagged in parallel.
+  # The labels are kept in the label store of every file, which knows what version of the file and which
+  # taggers they were made from, so only labels that are not in there (or are out of date) are made again,
+  # and label files that are missing are exported from the store for compare-mt. Without the store, label
+  # files are always checked against the cache (if there is one), so they are remade when the tokenization
+  # or a tagger has changed, and copied from the cache otherwise.
+  labels = ('emoji', 'prn')
+  tag_jobs = []
+  for fin, lang in zip(all_toks, all_langs):
+    if args.no_store:
+      todo = [label for label in labels if args.tag_cache or not os.path.isfile(label_file(fin, label))]
+    else:
+      stored = stored_labels(fin, lang, labels)
+      todo = [label for label in labels if label not in stored]
+      for label in stored:
+        if not os.path.isfile(label_file(fin, label)):
+          LabelStore(fin).export_labels(label, label_file(fin, label))
+          print(f'exported {label_file(fin, label)} from the label store')
+    if todo:
+      tag_jobs.append((fin, lang, todo))
+  if tag_jobs:
+    with tracer.stage('tag_files', inputs=[f for f, _, _ in tag_jobs],
+                      outputs=[label_file(f, label) for f, _, todo in tag_jobs for label in todo]):
+      tag_files(tag_jobs, args.num_proc, cache_dir=args.tag_cache or None, cache_size=args.tag_cache_size << 20,
+                store=not args.no_store)
+  align_out = align_file(align_store, align_name)
+  if not args.no_store and not os.path.isfile(align_out) and align_name in LabelStore(align_store).alignments():
+    LabelStore(align_store).export_alignments(align_name, align_out)
+    print(f'exported {align_out} from the label store')
 
 
-dirs = []
-for i in range(len(syss)-1):
-  for j in range(i+1,len(syss)):
-    dirs.append(f'{i}-{j}')
-dirs = ';'.join(dirs)
-run_cmd(
-  f'compare-mt {trg_tok} {out_tok_str} --src_file {src_tok}'
-  +f'  --sys_names {sys_str} --output_directory compare/compare-{langpair}'
-  +f'  --compare_word_accuracies'
-  +f'    title=trg_general_freq,bucket_type=freq,freq_count_file={sd}/extra/{jafr}/train.{trg}.tok.cnt'
-  +f'    title=trg_mtnt_freq,bucket_type=freq,freq_count_file={sd}/mtnt/mtnt-train.{langpair}.{trg}.tok.cnt'
-  +f'    title=trg_case,bucket_type=case'
-  +f'    title=trg_emoji,bucket_type=label,{emoji_str},label_set=emoji' 
-  +f'    title=trg_pronouns,bucket_type=label,{prn_str},label_set=1+2+3' 
-  +f'  --compare_src_word_accuracies'
-  +f'    title=src_general_freq,{align_str},bucket_type=freq,freq_count_file={sd}/extra/{jafr}/train.{src}.tok.cnt'
-  +f'    title=src_mtnt_freq,{align_str},bucket_type=freq,freq_count_file={sd}/mtnt/mtnt-train.{langpair}.{src}.tok.cnt'
-  +f'    title=src_case,{align_str},bucket_type=case'
-  +f'    title=src_emoji,{align_str},bucket_type=label,src_labels='+src_tok.replace('.tok','.emoji')+',label_set=emoji' 
-  +f'    title=src_pronouns,{align_str},bucket_type=label,src_labels='+src_tok.replace('.tok','.prn')+',label_set=1+2+3' 
-  +f'  --compare_ngrams'
-  +f'    compare_type=match,compare_directions=\"{dirs}\"'
-  +f'  --compare_sentence_examples'
-  +f'    score_type=sentbleu,compare_directions=\"{dirs}\"')
+  dirs = []
+  for i in range(len(syss)-1):
+    for j in range(i+1,len(syss)):
+      dirs.append(f'{i}-{j}')
+  dirs = ';'.join(dirs)
+  # Every analysis (and every pair of systems for the analyses that compare two systems) is a separate
+  # compare-mt run, and all of them are put together in compare/compare-{langpair}/index.html
+  analyses = {
+    '--compare_word_accuracies': [
+      f'title=trg_general_freq,bucket_type=freq,freq_count_file={sd}/extra/{jafr}/train.{trg}.tok.cnt',
+      f'title=trg_mtnt_freq,bucket_type=freq,freq_count_file={sd}/mtnt/mtnt-train.{langpair}.{trg}.tok.cnt',
+      f'title=trg_case,bucket_type=case',
+      f'title=trg_emoji,bucket_type=label,{emoji_str},label_set=emoji',
+      f'title=trg_pronouns,bucket_type=label,{prn_str},label_set=1+2+3'],
+    '--compare_src_word_accuracies': [
+      f'title=src_general_freq,{align_str},bucket_type=freq,freq_count_file={sd}/extra/{jafr}/train.{src}.tok.cnt',
+      f'title=src_mtnt_freq,{align_str},bucket_type=freq,freq_count_file={sd}/mtnt/mtnt-train.{langpair}.{src}.tok.cnt',
+      f'title=src_case,{align_str},bucket_type=case',
+      f'title=src_emoji,{align_str},bucket_type=label,src_labels='+src_tok.replace('.tok','.emoji')+',label_set=emoji',
+      f'title=src_pronouns,{align_str},bucket_type=label,src_labels='+src_tok.replace('.tok','.prn')+',label_set=1+2+3'],
+    '--compare_ngrams': [f'compare_type=match,compare_directions=\"{dirs}\"'],
+    '--compare_sentence_examples': [f'score_type=sentbleu,compare_directions=\"{dirs}\"'],
+  }
+  base_cmd = f'compare-mt {trg_tok} {out_tok_str} --src_file {src_tok} --sys_names {sys_str}'
+  run_report_jobs(base_cmd, analyses, sys_len, f'compare/compare-{langpair}', args.num_proc, tracer=tracer)
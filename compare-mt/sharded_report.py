@@ -0,0 +1,100 @@
+import os
+import re
+import shutil
+import subprocess
+import multiprocessing.pool
+
+# Make a compare-mt report as many small compare-mt runs that each do one analysis (for one pair of systems
+# where the analysis compares two systems), which can run at the same time, and assemble their reports into
+# a single index.html. Each run writes its report to PARTS_DIR/NAME under the output directory, and the
+# assembled report links to the figures and example pages in there.
+
+# The options of compare-mt that select analyses, in the order in which compare-mt puts them in its report
+analysis_flags = ['--compare_scores', '--compare_word_accuracies', '--compare_src_word_accuracies',
+                  '--compare_sentence_buckets', '--compare_ngrams', '--compare_sentence_examples']
+
+# What compare-mt does when the option is not given at all
+default_analyses = {
+  '--compare_scores': ['score_type=bleu', 'score_type=length'],
+  '--compare_sentence_buckets': ['bucket_type=length,statistic_type=score,score_measure=bleu',
+                                 'bucket_type=lengthdiff',
+                                 'bucket_type=score,score_measure=sentbleu'],
+}
+
+def analysis_jobs(analyses, num_sys):
+  """Split {flag: [profile, ...]} into (name, flag, profile) jobs of a single analysis each. Analyses
+  with compare_directions are split further into one job for each pair of systems."""
+  jobs = []
+  for flag in analysis_flags:
+    for i, profile in enumerate(analyses.get(flag, default_analyses.get(flag, []))):
+      name = f'{flag[len("--compare_"):]}-{i}'
+      dirs = re.search(r'compare_directions="?([^",]*)"?', profile)
+      if flag in ('--compare_ngrams', '--compare_sentence_examples') and num_sys > 1:
+        pairs = dirs.group(1).split(';') if dirs else ['0-1']
+        rest = profile.replace(dirs.group(0), '').strip(',') if dirs else profile
+        for pair in pairs:
+          jobs.append((f'{name}-{pair}', flag, ','.join([x for x in (rest, f'compare_directions={pair}') if x])))
+      else:
+        jobs.append((name, flag, profile))
+  return jobs
+
+def job_cmd(base_cmd, flag, profile, out_dir):
+  """The compare-mt command that only does the analysis given by flag and profile"""
+  others = ' '.join(f for f in analysis_flags if f != flag)
+  return f'{base_cmd} {others} {flag} {profile} --output_directory {out_dir}'
+
+def run_report_jobs(base_cmd, analyses, num_sys, output_directory, num_proc, parts_dir='parts', tracer=None):
+  """Run every analysis as its own compare-mt command, num_proc at the same time, and assemble the reports
+  into output_directory/index.html. base_cmd is the compare-mt command without any analyses. With a tracer
+  (see create-alignments/instrument.py), every command is recorded in its trace."""
+  jobs = analysis_jobs(analyses, num_sys)
+  os.makedirs(os.path.join(output_directory, parts_dir), exist_ok=True)
+  def run(job):
+    name, flag, profile = job
+    out_dir = os.path.join(output_directory, parts_dir, name)
+    cmd = job_cmd(base_cmd, flag, profile, out_dir)
+    # Some analyses write files before compare-mt makes the output directory
+    os.makedirs(out_dir, exist_ok=True)
+    print(f'running: {cmd}')
+    with open(f'{out_dir}.log', 'w') as log:
+      if tracer:
+        return tracer.start_cmd(cmd, name=f'compare-mt {name}', stdout=log, stderr=subprocess.STDOUT).wait()
+      return subprocess.call(cmd, shell=True, stdout=log, stderr=subprocess.STDOUT)
+  # Each job is a separate compare-mt process, so threads are enough to keep num_proc of them running
+  with multiprocessing.pool.ThreadPool(num_proc) as pool:
+    codes = pool.map(run, jobs)
+  failed = [name for (name, _, _), code in zip(jobs, codes) if code != 0]
+  if failed:
+    raise RuntimeError(f'compare-mt failed for {", ".join(failed)}, see the logs in {output_directory}/{parts_dir}')
+  assemble_report([name for name, _, _ in jobs], output_directory, parts_dir)
+
+section_re = re.compile(r'<h2>(.*?)</h2>')
+link_re = re.compile(r'(src|href)="(?!#|/|[a-z]+:)([^"]*)"')
+id_re = re.compile(r'(id="|showhide\(\')([^"\']*)')
+
+def part_sections(name, output_directory, parts_dir):
+  """The (title, html) sections of the report of one part, with its links pointing into its directory
+  and its element ids made unique"""
+  with open(os.path.join(output_directory, parts_dir, name, 'index.html'), 'r') as f:
+    html = f.read()
+  body = html[html.index('</h1>') + len('</h1>'):html.rindex('</body>')]
+  body = link_re.sub(lambda m: f'{m.group(1)}="{parts_dir}/{name}/{m.group(2)}"', body)
+  body = id_re.sub(lambda m: f'{m.group(1)}{name}-{m.group(2)}', body)
+  pieces = section_re.split(body)
+  return [(title, content) for title, content in zip(pieces[1::2], pieces[2::2]) if content.strip()]
+
+def assemble_report(names, output_directory, parts_dir='parts', report_title='compare-mt Analysis Report'):
+  """Put the sections of the reports of all parts into one index.html, grouped by analysis"""
+  sections = {}
+  for name in names:
+    for title, content in part_sections(name, output_directory, parts_dir):
+      sections.setdefault(title, []).append(content)
+  first = os.path.join(output_directory, parts_dir, names[0])
+  with open(os.path.join(first, 'index.html'), 'r') as f:
+    html = f.read()
+  # Keep the head (style sheet and scripts) of compare-mt's own report
+  head = html[:html.index('<h1>')]
+  shutil.copyfile(os.path.join(first, 'compare_mt.css'), os.path.join(output_directory, 'compare_mt.css'))
+  content = '\n'.join(f'<h2>{title}</h2>\n' + '\n'.join(parts) for title, parts in sections.items())
+  with open(os.path.join(output_directory, 'index.html'), 'w') as f:
+    f.write(f'{head}<h1>{report_title}</h1>\n {content} \n</body>\n</html>')
@@ -0,0 +1,111 @@
+import os
+import argparse
+import collections
+import multiprocessing
+import numpy as np
+
+# Count the words of tokenized corpora, for the frequency buckets of compare-mt. Every file is split into
+# pieces at line boundaries, and the pieces of all of the files are counted at the same time by a pool of
+# processes. The counts of every FILE are written to FILE.cnt in the same format as scripts/count.py of
+# compare-mt (one "word<TAB>count" per line, most frequent first), and also to FILE.cnt.npz, which is much
+# faster to load again:
+# $ python word_counts.py --num_proc 8 train.en.tok train.fr.tok
+#
+# From python:
+#  counts = count_files(['train.en.tok', 'train.fr.tok'], num_proc=8)
+
+def split_points(fname, num_pieces):
+  """Byte offsets that split a file into num_pieces ranges of about the same size, at line boundaries"""
+  size = os.path.getsize(fname)
+  points = [0]
+  with open(fname, 'rb') as ins:
+    for i in range(1, num_pieces):
+      ins.seek(max(size * i // num_pieces, points[-1]))
+      if ins.tell() > 0:
+        ins.seek(ins.tell() - 1)
+        ins.readline()
+      points.append(min(ins.tell(), size))
+  points.append(size)
+  return points
+
+def count_range(job):
+  """Count the words in the byte range [begin, end) of a file, reading it in large chunks"""
+  fname, begin, end, chunk_size = job
+  counts = collections.Counter()
+  with open(fname, 'rb') as ins:
+    ins.seek(begin)
+    left = end - begin
+    while left > 0:
+      chunk = ins.read(min(left, chunk_size))
+      # Always finish the last line so that no word is split across chunks
+      if not chunk.endswith(b'\n') and len(chunk) < left:
+        chunk += ins.readline()
+      left -= len(chunk)
+      counts.update(chunk.decode('utf-8').split())
+  return counts
+
+def count_files(fnames, num_proc=1, chunk_size=1<<24):
+  """A Counter of the words of every file, in the order in which the words first occur in the file"""
+  jobs, owners = [], []
+  for fname in fnames:
+    # Enough pieces to keep all of the processes busy, but not so many that merging takes long
+    pieces = max(1, min(num_proc, os.path.getsize(fname) // chunk_size + 1))
+    points = split_points(fname, pieces)
+    for begin, end in zip(points, points[1:]):
+      jobs.append((fname, begin, end, chunk_size))
+      owners.append(fname)
+  counts = {fname: collections.Counter() for fname in fnames}
+  with multiprocessing.Pool(num_proc) as pool:
+    # imap keeps the order of the pieces, so that ties are broken by first occurrence as in count.py
+    for fname, piece in zip(owners, pool.imap(count_range, jobs)):
+      counts[fname].update(piece)
+  return counts
+
+def sorted_counts(counts):
+  """The (word, count) pairs from most to least frequent (which is stable, as in count.py)"""
+  return sorted(counts.items(), key=lambda x: -x[1])
+
+def write_counts_text(counts, fname):
+  """Write the counts in the format of compare-mt's count.py"""
+  with open(fname, 'w', buffering=1<<20) as out:
+    for word, count in sorted_counts(counts):
+      out.write(f'{word}\t{count}\n')
+
+def save_counts(counts, fname):
+  """Save the counts as an array of counts and the vocabulary as one newline-separated string"""
+  pairs = sorted_counts(counts)
+  vocab = '\n'.join([w for w, _ in pairs]).encode('utf-8')
+  with open(fname, 'wb') as out:
+    np.savez(out, vocab=np.frombuffer(vocab, dtype=np.uint8), counts=np.array([c for _, c in pairs], dtype=np.int64))
+
+def load_counts(fname):
+  """Load counts saved by save_counts() as a Counter (from most to least frequent)"""
+  with np.load(fname) as data:
+    vocab = data['vocab'].tobytes().decode('utf-8')
+    counts = data['counts'].tolist()
+  return collections.Counter(dict(zip(vocab.split('\n') if counts else [], counts)))
+
+def build_count_files(fnames, num_proc=1):
+  """Write FILE.cnt and FILE.cnt.npz for all of the files. Text files that are only missing are exported
+  from the binary ones, and the rest are counted again."""
+  to_count = []
+  for fname in fnames:
+    npz = f'{fname}.cnt.npz'
+    if os.path.isfile(npz) and os.path.getmtime(npz) >= os.path.getmtime(fname):
+      print(f'word_counts: exporting {npz} to {fname}.cnt')
+      write_counts_text(load_counts(npz), f'{fname}.cnt')
+    else:
+      to_count.append(fname)
+  if to_count:
+    for fname, counts in count_files(to_count, num_proc).items():
+      print(f'word_counts: {len(counts)} words in {fname}')
+      save_counts(counts, f'{fname}.cnt.npz')
+      write_counts_text(counts, f'{fname}.cnt')
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Count the words of tokenized files, writing FILE.cnt and FILE.cnt.npz""")
+  p.add_argument("files", help="tokenized files to count", type=str, nargs='+')
+  p.add_argument("--num_proc", help="number of processes to count with", type=int, default=multiprocessing.cpu_count())
+  args = p.parse_args()
+
+  build_count_files(args.files, args.num_proc)
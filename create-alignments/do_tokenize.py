@@ -1,6 +1,11 @@
 import spacy
 import re
 import sys
+import argparse
+import hashlib
+import sqlite3
+import collections
+import multiprocessing
 
 # First install spacy and download models
 # $ pip install spacy
@@ -10,18 +15,178 @@ import sys
 # Then run by doing the following for English or French respectively:
 # $ python do_tokenize.py en < in.txt > out.txt
 # $ python do_tokenize.py fr < in.txt > out.txt
+#
+# Many files can also be tokenized in one call, in which case each FILE is written to FILE.tok.
+# The model is loaded once per worker process and the output stays in the original line order:
+# $ python do_tokenize.py en --n_process 4 --batch_size 1000 a.en b.en c.en
+#
+# If you only need the tokens, --tokenizer_only skips building the rest of the spacy pipeline,
+# and --cache keeps tokenized lines on disk so that lines seen in earlier runs are not tokenized again:
+# $ python do_tokenize.py en --tokenizer_only --cache tok-cache.en.db a.en b.en c.en
+#
+# With --tokenizer_only, --n_process workers each tokenize --batch_size lines at a time.
+
+p = argparse.ArgumentParser(description="""Tokenize text with spacy""")
+p.add_argument("lang", help="what language to use (en or fr)", type=str)
+p.add_argument("files", help="files to tokenize, each written to FILE.tok (read stdin if none are given)", type=str, nargs='*')
+p.add_argument("--batch_size", help="number of lines that are passed to spacy at once", type=int, default=1000)
+p.add_argument("--n_process", help="number of worker processes to tokenize with", type=int, default=1)
+p.add_argument("--tokenizer_only", help="only run the rule-based tokenizer of the model", action='store_true')
+p.add_argument("--cache", help="sqlite file in which to cache tokenized lines across runs", type=str, default=None)
+args = p.parse_intermixed_args()
 
 space_re = re.compile(r'  +')
 
-lang = sys.argv[1]
 models = {
   'en': 'en_core_web_sm',
   'fr': 'fr_core_news_sm',
 }
 
-nlp = spacy.load(models[lang], disable=["parser", "tagger", "ner"])
-for line in sys.stdin:
-  line = re.sub(space_re, ' ', line.strip())
-  doc = nlp(line)
-  doc = [tok.text for tok in doc if tok.text.strip() != '']
-  print(' '.join(doc))
+class TokenCache:
+  """On-disk map from the hash of a normalized line to its tokenized form"""
+
+  def __init__(self, fname, model, flush_every=10000):
+    self.db = sqlite3.connect(fname)
+    self.db.execute('CREATE TABLE IF NOT EXISTS tokens (key BLOB PRIMARY KEY, toks TEXT)')
+    # The tokens depend on the model and spacy version, so they are part of the key
+    self.prefix = f'{model}\t{spacy.__version__}\t'.encode('utf-8')
+    self.flush_every = flush_every
+    self.pending = []
+    self.hits, self.misses = 0, 0
+
+  def key(self, line):
+    return hashlib.blake2b(self.prefix + line.encode('utf-8'), digest_size=16).digest()
+
+  def get(self, key):
+    row = self.db.execute('SELECT toks FROM tokens WHERE key = ?', (key,)).fetchone()
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return row[0]
+
+  def put(self, key, toks):
+    self.pending.append((key, toks))
+    if len(self.pending) >= self.flush_every:
+      self.flush()
+
+  def flush(self):
+    self.db.executemany('INSERT OR REPLACE INTO tokens VALUES (?, ?)', self.pending)
+    self.db.commit()
+    self.pending = []
+
+  def close(self):
+    self.flush()
+    self.db.close()
+
+  def report(self):
+    total = max(self.hits + self.misses, 1)
+    return f'token cache: {self.hits} hits, {self.misses} misses ({100.0*self.hits/total:.1f}% hit rate)'
+
+def read_lines(files):
+  """Yield (line, file index) for every line in the input, in order"""
+  if not files:
+    for line in sys.stdin:
+      yield re.sub(space_re, ' ', line.strip()), 0
+  for i, fname in enumerate(files):
+    with open(fname, 'r') as fin:
+      for line in fin:
+        yield re.sub(space_re, ' ', line.strip()), i
+
+def output_streams(files):
+  """Yield the output stream for each of the input files in turn"""
+  if not files:
+    yield sys.stdout
+  for fname in files:
+    with open(f'{fname}.tok', 'w') as fout:
+      yield fout
+
+def tokenize_lines(lines):
+  """The tokenized form of each of lines, with the tokenizer only"""
+  return [' '.join([tok.text for tok in doc if tok.text.strip() != '']) for doc in nlp.tokenizer.pipe(lines, batch_size=args.batch_size)]
+
+def batches(items, size):
+  """Yield (lines, contexts) of every size items in turn"""
+  lines, contexts = [], []
+  for line, context in items:
+    lines.append(line)
+    contexts.append(context)
+    if len(lines) >= size:
+      yield lines, contexts
+      lines, contexts = [], []
+  if lines:
+    yield lines, contexts
+
+def pooled_tokenize_lines(items):
+  """Yield (tokenized line, context) for every (line, context) in items, in order, with the tokenizer
+  only, on a pool of args.n_process workers"""
+  # The workers are forked, so they share the model that is already loaded. The items are read (and the
+  # cache is looked up) in this process, and only a few batches are in flight at any time.
+  with multiprocessing.get_context('fork').Pool(args.n_process) as pool:
+    pending = collections.deque()
+    for lines, contexts in batches(items, args.batch_size):
+      pending.append((pool.apply_async(tokenize_lines, (lines,)), contexts))
+      if len(pending) > 2 * args.n_process:
+        result, contexts = pending.popleft()
+        yield from zip(result.get(), contexts)
+    while pending:
+      result, contexts = pending.popleft()
+      yield from zip(result.get(), contexts)
+
+def tokenize(nlp, items):
+  """Yield (tokenized line, context) for every (line, context) in items, in order"""
+  if args.tokenizer_only and args.n_process > 1:
+    yield from pooled_tokenize_lines(items)
+    return
+  if args.tokenizer_only:
+    for lines, contexts in batches(items, args.batch_size):
+      yield from zip(tokenize_lines(lines), contexts)
+    return
+  docs = nlp.pipe(items, as_tuples=True, batch_size=args.batch_size, n_process=args.n_process)
+  for doc, context in docs:
+    yield ' '.join([tok.text for tok in doc if tok.text.strip() != '']), context
+
+def cached_tokenize(nlp, items, cache):
+  """The same as tokenize(), but lines found in the cache never reach the tokenizer"""
+  def misses():
+    # Cache hits ride along with the context of the next miss so that the output order is kept,
+    # and long runs of hits are pushed through with an empty line
+    hits = []
+    for line, context in items:
+      key = cache.key(line)
+      toks = cache.get(key)
+      if toks is None:
+        yield line, (hits, key, context)
+        hits = []
+      else:
+        hits.append((toks, context))
+        if len(hits) >= args.batch_size:
+          yield '', (hits, None, None)
+          hits = []
+    if hits:
+      yield '', (hits, None, None)
+  for toks, (hits, key, context) in tokenize(nlp, misses()):
+    yield from hits
+    if key is not None:
+      cache.put(key, toks)
+      yield toks, context
+
+nlp = spacy.load(models[args.lang], disable=["parser", "tagger", "ner"])
+cache = TokenCache(args.cache, models[args.lang]) if args.cache else None
+if cache:
+  toks_stream = cached_tokenize(nlp, read_lines(args.files), cache)
+else:
+  toks_stream = tokenize(nlp, read_lines(args.files))
+outs = output_streams(args.files)
+out, out_id = next(outs), 0
+for toks, file_id in toks_stream:
+  # Move on to the next output (possibly skipping over empty inputs)
+  while out_id < file_id:
+    out, out_id = next(outs), out_id + 1
+  print(toks, file=out)
+# Make sure that trailing empty inputs still get an output, and the last output is closed
+for out in outs:
+  pass
+if cache:
+  cache.close()
+  print(cache.report(), file=sys.stderr)
@@ -0,0 +1,349 @@
+import sys
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import array
+import numpy as np
+from multiprocessing import Pool
+
+# A pure python/numpy implementation of the reparameterized IBM Model 2 of fast_align
+#   Chris Dyer, Victor Chahuneau, and Noah A. Smith. 2013.
+#   A Simple, Fast, and Effective Reparameterization of IBM Model 2.
+# using the same settings as `fast_align -d -o -v`, along with grow-diag-final-and symmetrization.
+# It does not need anything other than numpy, so it can be used where fast_align is not installed.
+#
+# The input is a file of "f ||| e" sentence pairs, and the output is the symmetrized alignment
+# (optionally along with the forward and reverse alignments) in "i-j" format:
+# $ python ibm2.py -i all.fr-en -o all.align.fr-en --fwd all.foralign.fr-en --rev all.backalign.fr-en --num_proc 4
+#
+# The E-steps over batches of sentences are spread across --num_proc processes, and the throughput of
+# every iteration is written to stderr, so that it can be compared against fast_align itself.
+
+NULL = 0
+
+def read_corpus(fname):
+  """Read a file of "f ||| e" pairs into integer-encoded (tokens, offsets, vocabulary size) for
+  each side. Word ids start at 1 on both sides so that 0 can stand for NULL."""
+  vocabs = ({'<NULL>': NULL}, {'<NULL>': NULL})
+  toks = (array.array('i'), array.array('i'))
+  lens = (array.array('l'), array.array('l'))
+  with open(fname, 'r') as ins:
+    for line_num, line in enumerate(ins, 1):
+      sides = line.rstrip('\n').split(' ||| ')
+      if len(sides) != 2:
+        raise ValueError(f'Line {line_num} of {fname} is not a "f ||| e" pair')
+      for side, vocab, tok, ln in zip(sides, vocabs, toks, lens):
+        words = side.split()
+        tok.extend([vocab.setdefault(w, len(vocab)) for w in words])
+        ln.append(len(words))
+  return [(np.frombuffer(tok, dtype=np.int32), np.concatenate([[0], np.cumsum(ln, dtype=np.int64)]), len(vocab))
+          for tok, ln, vocab in zip(toks, lens, vocabs)]
+
+def digamma(x):
+  """Vectorized digamma function, with the same asymptotic expansion as fast_align. Every value is
+  shifted up by 7 with the recurrence digamma(x) = digamma(x+1) - 1/x, which avoids masking."""
+  x = np.array(x, dtype=np.float64)
+  result = np.zeros_like(x)
+  for k in range(7):
+    result -= 1 / (x + k)
+  x = x + 7 - 0.5
+  xx = 1 / x
+  xx2 = xx * xx
+  xx4 = xx2 * xx2
+  result += np.log(x) + (1./24.)*xx2 - (7.0/960.0)*xx4 + (31.0/8064.0)*xx4*xx2 - (127.0/30720.0)*xx4*xx4
+  return result
+
+class ArrayStore:
+  """Numpy arrays saved to a scratch directory and memory-mapped, so that the worker processes can
+  share them (including the lexical table, which is updated in place) without copying"""
+
+  def __init__(self, work_dir=None):
+    self.dir = tempfile.mkdtemp(prefix='ibm2-', dir=work_dir)
+    self.paths = {}
+
+  def put(self, name, arr):
+    path = os.path.join(self.dir, f'{name}.npy')
+    np.save(path, arr)
+    self.paths[name] = path
+    return np.load(path, mmap_mode='r+')
+
+  def close(self):
+    shutil.rmtree(self.dir)
+
+_mapped = {}
+def _load(paths):
+  """Memory-map the arrays in paths, reusing the maps that this process already has"""
+  for path in paths.values():
+    if path not in _mapped:
+      _mapped[path] = np.load(path, mmap_mode='r')
+  return {name: _mapped[path] for name, path in paths.items()}
+
+def _links(a, start, end):
+  """Every (target token, source position) link of the sentences [start, end), where source
+  position 0 is NULL. Links are grouped by target token ("rows"), in corpus order."""
+  src_off, trg_off = a['src_off'], a['trg_off']
+  n = np.diff(src_off[start:end+1])
+  m = np.diff(trg_off[start:end+1])
+  # Rows: one for every target token
+  row_sent = np.repeat(np.arange(end - start), m)
+  row_j = np.arange(trg_off[start], trg_off[end]) - trg_off[start:end][row_sent]
+  row_n, row_m = n[row_sent], m[row_sent]
+  # Links: one for every row and source position from 0 to n
+  link_row = np.repeat(np.arange(len(row_sent)), row_n + 1)
+  link_i = np.arange(len(link_row)) - np.repeat(np.cumsum(row_n + 1) - (row_n + 1), row_n + 1)
+  is_null = link_i == 0
+  src_pos = src_off[start:end][row_sent[link_row]] + np.maximum(link_i - 1, 0)
+  src_word = np.where(is_null, NULL, a['src'][np.minimum(src_pos, len(a['src']) - 1)])
+  trg_word = a['trg'][trg_off[start] + link_row]
+  # The feature that the diagonal prior is based on: -|i/n - j/m|
+  feat = -np.abs(link_i / np.maximum(row_n[link_row], 1) - (row_j[link_row] + 1) / row_m[link_row])
+  feat[is_null] = 0
+  return row_sent, row_j, link_row, link_i, is_null, src_word, trg_word, feat
+
+def _unique(x):
+  """Sorted distinct values of x (sorting is faster than the hashing that np.unique uses here)"""
+  x = np.sort(x)
+  return x[np.concatenate([[True], x[1:] != x[:-1]])] if len(x) else x
+
+def _pair_keys(paths, n_trg_vocab, start, end):
+  """The distinct (source word, target word) pairs that co-occur in sentences [start, end)"""
+  a = _load(paths)
+  _, _, _, _, _, src_word, trg_word, _ = _links(a, start, end)
+  return _unique(src_word.astype(np.int64) * n_trg_vocab + trg_word)
+
+def _index_pairs(paths, n_trg_vocab, start, end):
+  """Look up where the pair of every link in sentences [start, end) is in the lexical table, and
+  save the distinct positions along with the index of every link into them. This is only done
+  once, so that the iterations of EM do not need to search the table again."""
+  a = _load(paths)
+  _, _, _, _, _, src_word, trg_word, _ = _links(a, start, end)
+  pair_idx = np.searchsorted(a['keys'], src_word.astype(np.int64) * n_trg_vocab + trg_word)
+  uniq, inv = np.unique(pair_idx, return_inverse=True)
+  prefix = os.path.join(os.path.dirname(paths['keys']), f'batch{start}')
+  np.save(f'{prefix}.uniq.npy', uniq)
+  np.save(f'{prefix}.inv.npy', inv.ravel().astype(np.int32))
+
+def _batch_pairs(paths, start):
+  prefix = os.path.join(os.path.dirname(paths['keys']), f'batch{start}')
+  pairs = _load({'uniq': f'{prefix}.uniq.npy', 'inv': f'{prefix}.inv.npy'})
+  return pairs['uniq'], pairs['inv']
+
+def _link_probs(paths, params, start, end):
+  """The unnormalized probability of every link, along with the links themselves"""
+  a = _load(paths)
+  links = _links(a, start, end)
+  _, _, link_row, _, is_null, _, _, feat = links
+  uniq, inv = _batch_pairs(paths, start)
+  diag = np.exp(params['tension'] * feat)
+  diag[is_null] = 0
+  z = np.bincount(link_row, weights=diag)
+  # Rows of sentences with an empty source side can only align to NULL
+  z[z == 0] = 1
+  prior = np.where(is_null, params['p0'], (1 - params['p0']) * diag / z[link_row])
+  return links, inv, prior * a['t'][uniq][inv]
+
+def _expect(paths, params, start, end):
+  """E-step over sentences [start, end): the expected counts of the distinct pairs in the batch,
+  the log likelihood, and the expected value of the diagonal feature"""
+  (_, _, link_row, _, _, _, _, feat), inv, prob = _link_probs(paths, params, start, end)
+  total = np.bincount(link_row, weights=prob)
+  post = prob / total[link_row]
+  counts = np.bincount(inv, weights=post)
+  return counts, np.log(total).sum(), (post * feat).sum(), len(total)
+
+def _viterbi(paths, params, start, end):
+  """The most probable source position for every target token in sentences [start, end), as
+  (sentence, source position, target position) arrays of the tokens that are not aligned to NULL"""
+  (row_sent, row_j, link_row, link_i, is_null, _, _, _), _, prob = _link_probs(paths, params, start, end)
+  # Every row starts with its NULL link
+  row_max = np.maximum.reduceat(prob, np.flatnonzero(is_null)) if len(prob) else prob
+  # Take the first position with the highest probability in each row, like fast_align
+  best = np.flatnonzero(prob == row_max[link_row])
+  best = best[np.unique(link_row[best], return_index=True)[1]]
+  aligned = link_i[best] > 0
+  rows = link_row[best][aligned]
+  return row_sent[rows] + start, link_i[best][aligned] - 1, row_j[rows]
+
+class DiagonalModel2:
+  """fast_align's reparameterization of IBM Model 2, where every target word is generated by a
+  source word (or NULL) chosen with a prior that favors alignments close to the diagonal, and the
+  lexical translation table is estimated with variational Bayes"""
+
+  def __init__(self, src, src_off, trg, trg_off, n_trg_vocab, pool=None, work_dir=None,
+               link_batch=2000000, p0=0.08, tension=4.0, alpha=0.01, optimize_tension=True):
+    self.store = ArrayStore(work_dir)
+    self.pool = pool
+    self.alpha = alpha
+    self.optimize_tension = optimize_tension
+    self.params = {'n_trg_vocab': n_trg_vocab, 'p0': p0, 'tension': tension}
+    for name, arr in (('src', src), ('src_off', src_off), ('trg', trg), ('trg_off', trg_off)):
+      self.store.put(name, arr)
+    # Split the corpus into batches of roughly link_batch links each
+    n, m = np.diff(src_off), np.diff(trg_off)
+    self.num_sents, self.num_toks = len(n), int(m.sum())
+    cum_links = np.cumsum(m * (n + 1))
+    bounds = np.searchsorted(cum_links, np.arange(link_batch, cum_links[-1] if len(cum_links) else 0, link_batch))
+    bounds = np.unique(np.concatenate([[0], bounds + 1, [self.num_sents]]).clip(0, self.num_sents))
+    self.batches = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    # Sentence length pairs, for the expected value of the diagonal feature under the prior
+    self.size_feat, self.size_group, self.size_weight = self._size_features(n, m)
+    # The lexical table holds all co-occurring pairs, initialized to be uniform
+    keys = _unique(np.concatenate([np.zeros(0, dtype=np.int64)] + self._map(_pair_keys, self.params['n_trg_vocab'])))
+    self.keys = self.store.put('keys', keys)
+    self.t = self.store.put('t', np.full(len(keys), 1.0 / n_trg_vocab))
+    self._map(_index_pairs, self.params['n_trg_vocab'])
+
+  def _map(self, func, *fargs):
+    jobs = [(self.store.paths, *fargs, start, end) for start, end in self.batches]
+    if self.pool is None:
+      return [func(*job) for job in jobs]
+    return self.pool.starmap(func, jobs)
+
+  @staticmethod
+  def _size_features(n, m):
+    """The diagonal feature of every (target position, source position) of every distinct
+    (source length, target length), grouped by target position and weighted by frequency"""
+    sizes, counts = np.unique(np.stack([n, m], axis=1), axis=0, return_counts=True)
+    feats, groups, weights = [], [], []
+    num_groups = 0
+    for (sn, sm), count in zip(sizes.tolist(), counts.tolist()):
+      if sn == 0 or sm == 0:
+        continue
+      j, i = np.meshgrid(np.arange(1, sm + 1), np.arange(1, sn + 1), indexing='ij')
+      feats.append(-np.abs(i / sn - j / sm).ravel())
+      groups.append(np.repeat(np.arange(sm), sn) + num_groups)
+      weights.append(np.full(sm, count))
+      num_groups += sm
+    if not feats:
+      return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(feats), np.concatenate(groups), np.concatenate(weights)
+
+  def _update_tension(self, emp_feat):
+    """Move the tension towards making the expected diagonal feature under the prior match the
+    empirical one, with the same gradient steps as fast_align"""
+    for _ in range(8):
+      diag = np.exp(self.params['tension'] * self.size_feat)
+      z = np.bincount(self.size_group, weights=diag)
+      dlogz = np.bincount(self.size_group, weights=self.size_feat * diag) / z
+      mod_feat = (self.size_weight * dlogz).sum() / self.num_toks
+      self.params['tension'] = min(max(self.params['tension'] + (emp_feat - mod_feat) * 20.0, 0.1), 14.0)
+
+  def train(self, iterations=5, log=sys.stderr):
+    """Run iterations-1 rounds of EM, as fast_align uses its last iteration to output alignments"""
+    for it in range(iterations - 1):
+      start_time = time.time()
+      counts = np.zeros(len(self.keys))
+      loglik, emp_feat, toks = 0.0, 0.0, 0
+      for (start, _), (cnt, ll, ef, nt) in zip(self.batches, self._map(_expect, self.params)):
+        counts[_batch_pairs(self.store.paths, start)[0]] += cnt
+        loglik += ll
+        emp_feat += ef
+        toks += nt
+      emp_feat /= max(toks, 1)
+      if self.optimize_tension and it > 0:
+        self._update_tension(emp_feat)
+      # Variational Bayes M-step with a symmetric Dirichlet prior on every row of the table
+      rows = self.keys // self.params['n_trg_vocab']
+      totals = np.bincount(rows, weights=counts + self.alpha)
+      self.t[:] = np.exp(digamma(counts + self.alpha) - digamma(totals[rows]))
+      elapsed = time.time() - start_time
+      print(f'iteration {it+1}: log_e likelihood={loglik:.2f}, cross entropy={-loglik/max(toks, 1)/np.log(2):.4f},'
+            f' tension={self.params["tension"]:.4f}, {toks/elapsed:.0f} words/sec', file=log)
+
+  def viterbi(self):
+    """The best alignment of every sentence as (sentence, source position, target position) arrays"""
+    results = self._map(_viterbi, self.params)
+    return tuple(np.concatenate([r[k] for r in results]) if results else np.zeros(0, dtype=np.int64) for k in range(3))
+
+  def close(self):
+    self.store.close()
+
+neighbors = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def grow_diag_final_and(fwd, rev):
+  """Symmetrize two sets of (i, j) links with the grow-diag-final-and heuristic"""
+  alignment = fwd & rev
+  union = fwd | rev
+  aligned_i = {i for i, _ in alignment}
+  aligned_j = {j for _, j in alignment}
+  # grow-diag: add neighbouring links from the union that align a word that is not aligned yet
+  added = True
+  while added:
+    added = False
+    for i, j in sorted(alignment):
+      for di, dj in neighbors:
+        p = (i + di, j + dj)
+        if p in union and p not in alignment and (p[0] not in aligned_i or p[1] not in aligned_j):
+          alignment.add(p)
+          aligned_i.add(p[0])
+          aligned_j.add(p[1])
+          added = True
+  # final-and: add the remaining links where both words are still unaligned
+  for links in (fwd, rev):
+    for i, j in sorted(links):
+      if i not in aligned_i and j not in aligned_j:
+        alignment.add((i, j))
+        aligned_i.add(i)
+        aligned_j.add(j)
+  return alignment
+
+def _split_links(links, num_sents):
+  """Group (sentence, i, j) link arrays into a list with a set of (i, j) links for each sentence"""
+  sent, i, j = links
+  out = [set() for _ in range(num_sents)]
+  for s, ii, jj in zip(sent.tolist(), i.tolist(), j.tolist()):
+    out[s].add((ii, jj))
+  return out
+
+def _symmetrize(fwd, rev):
+  return [grow_diag_final_and(f, r) for f, r in zip(fwd, rev)]
+
+def write_links(sents, fname):
+  with open(fname, 'w', buffering=1<<20) as outs:
+    for links in sents:
+      outs.write(' '.join([f'{i}-{j}' for i, j in sorted(links)]) + '\n')
+
+def align_file(joint_file, out_file, fwd_file=None, rev_file=None, iterations=5, num_proc=1, work_dir=None, log=sys.stderr):
+  """Align a file of "f ||| e" pairs in both directions and write the symmetrized alignments"""
+  (f_toks, f_off, f_vocab), (e_toks, e_off, e_vocab) = read_corpus(joint_file)
+  num_sents = len(f_off) - 1
+  pool = Pool(num_proc) if num_proc > 1 else None
+  try:
+    sents = []
+    for name, src, trg, n_trg_vocab, out in (('forward', (f_toks, f_off), (e_toks, e_off), e_vocab, fwd_file),
+                                             ('reverse', (e_toks, e_off), (f_toks, f_off), f_vocab, rev_file)):
+      print(f'training {name} model', file=log)
+      model = DiagonalModel2(*src, *trg, n_trg_vocab, pool=pool, work_dir=work_dir)
+      try:
+        model.train(iterations, log=log)
+        sent, src_pos, trg_pos = model.viterbi()
+      finally:
+        model.close()
+      # Always keep the links in f-e order
+      links = _split_links((sent, src_pos, trg_pos) if name == 'forward' else (sent, trg_pos, src_pos), num_sents)
+      if out:
+        write_links(links, out)
+      sents.append(links)
+    chunk = max(1, num_sents // (num_proc * 4) + 1)
+    chunks = [(sents[0][k:k+chunk], sents[1][k:k+chunk]) for k in range(0, num_sents, chunk)]
+    sym = pool.starmap(_symmetrize, chunks) if pool else [_symmetrize(*c) for c in chunks]
+    write_links([links for part in sym for links in part], out_file)
+  finally:
+    if pool:
+      pool.close()
+      pool.join()
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Align a file of "f ||| e" pairs with a numpy version of fast_align""")
+  p.add_argument("-i", "--input", help="file of 'f ||| e' sentence pairs", type=str, required=True)
+  p.add_argument("-o", "--output", help="where to write the grow-diag-final-and alignments", type=str, required=True)
+  p.add_argument("--fwd", help="where to write the forward alignments", type=str, default=None)
+  p.add_argument("--rev", help="where to write the reverse alignments", type=str, default=None)
+  p.add_argument("--iterations", help="number of iterations (the last one outputs alignments)", type=int, default=5)
+  p.add_argument("--num_proc", help="number of processes to run E-steps in", type=int, default=1)
+  p.add_argument("--work_dir", help="directory for the memory-mapped arrays shared by processes", type=str, default=None)
+  args = p.parse_args()
+  align_file(args.input, args.output, fwd_file=args.fwd, rev_file=args.rev, iterations=args.iterations,
+             num_proc=args.num_proc, work_dir=args.work_dir)
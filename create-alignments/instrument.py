@@ -0,0 +1,288 @@
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import atexit
+import cProfile
+import resource
+import subprocess
+
+# Measure every stage of a run, whether it is python code in this process or a shell command, and write one
+# JSON record per stage to a trace file:
+#
+#  {"run": ..., "name": "fast_align", "kind": "cmd", "cmd": "...", "status": "ok", "exit_code": 0,
+#   "start": 1560000000.0, "wall_sec": 12.3, "user_sec": 11.9, "sys_sec": 0.3, "peak_rss_mb": 812.0,
+#   "inputs": [{"path": "all.fr-en", "bytes": 123456, "lines": 1000}], "outputs": [...], "pid": 1234}
+#
+# Python code is measured with a context manager, and commands are run through the tracer:
+#
+#  tracer = instrument.configure('trace.jsonl', profile_dir='profiles')
+#  with tracer.stage('build_corpus', inputs=f_all + e_all, outputs=[joint_file]):
+#    build_corpus(...)
+#  tracer.run_cmd(f'{fadir}/build/fast_align -i {joint_file} -d > out')
+#
+# A command that fails raises an error instead of letting the run go on. The files that a command reads and
+# writes are found from its arguments (those that are files before it runs are inputs, and those that it
+# creates or changes, including its redirects, are outputs). The settings are passed on to child processes
+# through the environment, so all of the processes of a run write to the same trace with the same run id,
+# and print_summary() prints a table of where the time went in all of them.
+#
+# With a profile directory, the python stages are profiled with cProfile (into DIR/NAME.PID.prof), and with a
+# sample command, every command is run under it, e.g. --sample_cmd 'py-spy record -o {name}.svg --'.
+
+# Files larger than this are not read to count their lines
+max_count_bytes = 1<<30
+
+def file_stats(paths):
+  """The size and number of lines of every file in paths that exists"""
+  stats = []
+  for path in paths:
+    if not os.path.isfile(path):
+      continue
+    size = os.path.getsize(path)
+    lines = None
+    if size <= max_count_bytes:
+      with open(path, 'rb') as f:
+        lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1<<24), b''))
+    stats.append({'path': path, 'bytes': size, 'lines': lines})
+  return stats
+
+redirect_re = re.compile(r'^(?:[0-9]?>>?|&>|<)')
+
+def cmd_files(cmd):
+  """The words of a shell command that may be files, including redirect targets like >out"""
+  try:
+    words = shlex.split(cmd)
+  except ValueError:
+    words = cmd.split()
+  files = []
+  # The first word is the program
+  for w in words[1:]:
+    w = redirect_re.sub('', w)
+    if '=' in w:
+      w = w.split('=', 1)[1]
+    if w and not w.startswith('-'):
+      files.append(w)
+  return files
+
+def _mtimes(paths):
+  return {p: os.path.getmtime(p) for p in paths if os.path.isfile(p)}
+
+def _peak_rss():
+  """The peak resident memory of this process in bytes since it was last reset"""
+  try:
+    with open('/proc/self/status', 'r') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+  # ru_maxrss is in kilobytes on linux and in bytes on macos, and can not be reset
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+def _reset_peak_rss():
+  """Start measuring the peak memory again from the current memory use (only possible on linux)"""
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+  except OSError:
+    pass
+
+class TracedCmd:
+  """A running command, which records itself in the trace when it has finished"""
+
+  def __init__(self, tracer, cmd, name=None, inputs=(), outputs=(), **popen_args):
+    self.tracer = tracer
+    self.cmd = cmd
+    self.name = name or (os.path.basename(cmd.split()[0]) if cmd.split() else 'cmd')
+    self.files = cmd_files(cmd)
+    self.inputs = list(inputs)
+    self.outputs = list(outputs)
+    self.before = _mtimes(self.files + self.outputs)
+    if tracer.sample_cmd:
+      cmd = tracer.sample_cmd.format(name=self.name, profile_dir=tracer.profile_dir or '.') + ' ' + cmd
+    self.start = time.time()
+    self.proc = subprocess.Popen(cmd, shell=True, **popen_args)
+    self.code = None
+
+  def _finish(self, status, usage):
+    self.code = os.waitstatus_to_exitcode(status)
+    # Popen does not know that the process was waited for
+    self.proc.returncode = self.code
+    after = _mtimes(self.files + self.outputs)
+    changed = [p for p in after if self.before.get(p) != after[p]]
+    inputs = self.inputs + [p for p in self.before if p not in changed and p not in self.inputs]
+    outputs = self.outputs + [p for p in changed if p not in self.outputs]
+    self.tracer.record({
+      'name': self.name, 'kind': 'cmd', 'cmd': self.cmd, 'status': 'ok' if self.code == 0 else 'failed',
+      'exit_code': self.code, 'start': self.start, 'wall_sec': time.time() - self.start,
+      'user_sec': usage.ru_utime, 'sys_sec': usage.ru_stime,
+      'peak_rss_mb': usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024) / (1<<20),
+      'inputs': file_stats(inputs), 'outputs': file_stats(outputs), 'pid': self.proc.pid})
+    return self.code
+
+  def poll(self):
+    """The exit code of the command, or None if it is still running"""
+    if self.code is None:
+      pid, status, usage = os.wait4(self.proc.pid, os.WNOHANG)
+      if pid:
+        self._finish(status, usage)
+    return self.code
+
+  def wait(self):
+    if self.code is None:
+      _, status, usage = os.wait4(self.proc.pid, 0)
+      self._finish(status, usage)
+    return self.code
+
+  def kill(self):
+    self.proc.kill()
+
+class Tracer:
+  """Measures stages and commands, and writes them to the trace file (if there is one)"""
+
+  def __init__(self, trace_file=None, profile_dir=None, sample_cmd=None, run_id=None):
+    self.trace_file = trace_file
+    self.profile_dir = profile_dir
+    self.sample_cmd = sample_cmd
+    self.run_id = run_id or f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}'
+    self.records = []
+    # The peak memory of every open stage, as nested stages reset it
+    self.peaks = []
+    self.profiling = False
+
+  def record(self, rec):
+    rec = dict(rec, run=self.run_id)
+    self.records.append(rec)
+    if self.trace_file:
+      # Every record is a single write to a file opened for appending, so records of different processes
+      # do not get mixed up
+      with open(self.trace_file, 'a') as f:
+        f.write(json.dumps(rec) + '\n')
+
+  def stage(self, name, inputs=(), outputs=()):
+    """Context manager that measures the python code in it as a stage"""
+    return _Stage(self, name, inputs, outputs)
+
+  def start_cmd(self, cmd, name=None, inputs=(), outputs=(), **popen_args):
+    """Start a shell command, which is recorded once it has been waited for"""
+    return TracedCmd(self, cmd, name, inputs, outputs, **popen_args)
+
+  def run_cmd(self, cmd, name=None, inputs=(), outputs=(), check=True, **popen_args):
+    """Run a shell command, and fail if it fails (unless check is False). Returns its exit code."""
+    print(f'running: {cmd}')
+    sys.stdout.flush()
+    code = self.start_cmd(cmd, name, inputs, outputs, **popen_args).wait()
+    if check and code != 0:
+      raise RuntimeError(f'Command failed with exit code {code}: {cmd}')
+    return code
+
+  def run_records(self):
+    """The records of this run by all of its processes (or only this one without a trace file)"""
+    if not self.trace_file or not os.path.isfile(self.trace_file):
+      return self.records
+    with open(self.trace_file, 'r') as f:
+      return [rec for rec in map(json.loads, f) if rec['run'] == self.run_id]
+
+  def summary(self):
+    """A table of the time, memory and data of the stages of this run, by name"""
+    by_name = {}
+    for rec in self.run_records():
+      s = by_name.setdefault(rec['name'], {'calls': 0, 'failed': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0.0,
+                                           'in': 0, 'out': 0, 'out_lines': 0})
+      s['calls'] += 1
+      s['failed'] += rec['status'] != 'ok'
+      s['wall'] += rec['wall_sec']
+      s['cpu'] += rec['user_sec'] + rec['sys_sec']
+      s['peak'] = max(s['peak'], rec['peak_rss_mb'])
+      s['in'] += sum(x['bytes'] for x in rec['inputs'])
+      s['out'] += sum(x['bytes'] for x in rec['outputs'])
+      s['out_lines'] += sum(x['lines'] or 0 for x in rec['outputs'])
+    total = sum(s['wall'] for s in by_name.values()) or 1
+    rows = [('stage', 'calls', 'failed', 'wall sec', '% wall', 'cpu sec', 'peak MB', 'in MB', 'out MB', 'out lines')]
+    for name, s in sorted(by_name.items(), key=lambda x: -x[1]['wall']):
+      rows.append((name, str(s['calls']), str(s['failed']), f'{s["wall"]:.1f}', f'{100 * s["wall"] / total:.1f}',
+                   f'{s["cpu"]:.1f}', f'{s["peak"]:.0f}', f'{s["in"] / (1<<20):.1f}', f'{s["out"] / (1<<20):.1f}',
+                   str(s['out_lines'])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    # Nested stages are counted in their own rows as well as in the stages that contain them
+    return '\n'.join('  '.join(x.ljust(w) for x, w in zip(row, widths)).rstrip() for row in rows)
+
+  def print_summary(self):
+    print(f'trace of run {self.run_id}' + (f' (in {self.trace_file})' if self.trace_file else '') + ':')
+    print(self.summary())
+
+class _Stage:
+
+  def __init__(self, tracer, name, inputs, outputs):
+    self.tracer = tracer
+    self.name = name
+    self.inputs = list(inputs)
+    self.outputs = list(outputs)
+    self.profile = None
+
+  def __enter__(self):
+    tracer = self.tracer
+    # The stages that are already open keep the peak until now, as it is reset for this one
+    peak = _peak_rss()
+    tracer.peaks = [max(p, peak) for p in tracer.peaks]
+    _reset_peak_rss()
+    tracer.peaks.append(0)
+    self.input_stats = file_stats(self.inputs)
+    self.start = time.time()
+    self.usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    # Only the outermost stage is profiled, as there can only be one profiler at a time
+    if tracer.profile_dir and not tracer.profiling:
+      tracer.profiling = True
+      self.profile = cProfile.Profile()
+      self.profile.enable()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    tracer = self.tracer
+    wall = time.time() - self.start
+    rec = {'name': self.name, 'kind': 'python', 'status': 'ok' if exc_type is None else 'failed',
+           'start': self.start, 'wall_sec': wall}
+    if exc_type is not None:
+      rec['error'] = f'{exc_type.__name__}: {exc}'
+    if self.profile:
+      self.profile.disable()
+      tracer.profiling = False
+      os.makedirs(tracer.profile_dir, exist_ok=True)
+      rec['profile'] = os.path.join(tracer.profile_dir, f'{self.name}.{os.getpid()}.prof')
+      self.profile.dump_stats(rec['profile'])
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    rec['user_sec'] = sum(after.ru_utime - before.ru_utime for before, after in zip(self.usage, usage))
+    rec['sys_sec'] = sum(after.ru_stime - before.ru_stime for before, after in zip(self.usage, usage))
+    peak = max(tracer.peaks.pop(), _peak_rss())
+    tracer.peaks = [max(p, peak) for p in tracer.peaks]
+    rec['peak_rss_mb'] = peak / (1<<20)
+    # The peak of the child processes (e.g. of a pool) is only known if it is higher than that of any earlier ones
+    if usage[1].ru_maxrss > self.usage[1].ru_maxrss:
+      rec['children_peak_rss_mb'] = usage[1].ru_maxrss * (1 if sys.platform == 'darwin' else 1024) / (1<<20)
+    rec['inputs'] = self.input_stats
+    rec['outputs'] = file_stats(self.outputs)
+    rec['pid'] = os.getpid()
+    tracer.record(rec)
+    return False
+
+def configure(trace_file=None, profile_dir=None, sample_cmd=None, summary_at_exit=True):
+  """Set up the tracer of this run, which is also used by the child processes that it starts"""
+  global tracer
+  if trace_file and os.path.dirname(trace_file):
+    os.makedirs(os.path.dirname(trace_file), exist_ok=True)
+  tracer = Tracer(trace_file, profile_dir, sample_cmd)
+  os.environ['JSALT_TRACE'] = json.dumps({'trace_file': trace_file, 'profile_dir': profile_dir,
+                                          'sample_cmd': sample_cmd, 'run_id': tracer.run_id})
+  if summary_at_exit:
+    atexit.register(tracer.print_summary)
+  return tracer
+
+def get_tracer():
+  """The tracer of this run"""
+  return tracer
+
+# Processes started by a run that was configured trace into the same run
+tracer = Tracer(**json.loads(os.environ['JSALT_TRACE'])) if 'JSALT_TRACE' in os.environ else Tracer()
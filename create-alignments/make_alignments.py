@@ -1,81 +1,392 @@
 import sys
 import os
-import subprocess
+import re
+import math
+import time
+import shutil
 import glob
 import argparse
-
-p = argparse.ArgumentParser(description="""Make alignments for wmt robustness task data""")
-p.add_argument("lang", help="what language to use (fr or ja)", type=str)
-p.add_argument("--aligner", help="what aligner to use (giza or fa)", type=str, default='giza')
-p.add_argument("--mdir", help="top directory of Moses installation", type=str, default='/home/gneubig/usr/local/mosesdecoder')
-p.add_argument("--fadir", help="top directory of FastAlign installation", type=str, default='/home/gneubig/usr/local/fast_align')
-args = p.parse_args()
+import itertools
+import collections
+import multiprocessing
+import multiprocessing.pool
+import ibm2
+import instrument
+# The label stores of the tokenized files (see tagging-scripts/label_store.py) also hold their alignments
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tagging-scripts'))
+from label_store import LabelStore, align_name
 
 def run_cmd(cmd):
-  print(f'running: {cmd}')
-  os.system(cmd)
-  
-def run_background(cmd):
-  print(f'running in background: {cmd}')
-  return subprocess.Popen([cmd], shell=True, stdin=None, stdout=None, stderr=None, close_fds=True)
-
-lang = sys.argv[1]
-
-mtnt_types = ('trainclean', 'valid', 'test', 'test2019')
-f_orig = ([f'wmt2019-system-data/mtnt/mtnt-{t}.{lang}-en.{lang}.tok' for t in mtnt_types]
-         + [f'wmt2019-system-data/mtnt/mtnt-{t}.en-{lang}.{lang}.tok' for t in mtnt_types]
-         + [f'wmt2019-system-data/extra/{lang}/trainclean.{lang}.tok'])
-e_orig = [l.replace(f'{lang}.tok', 'en.tok') for l in f_orig]
-f_ftrg = list(glob.glob(f'wmt2019-system-data/outputs/en-{lang}/*.{lang}.tok')) 
-e_ftrg = [f'wmt2019-system-data/mtnt/mtnt-test2019.en-{lang}.en.tok' for f in f_ftrg]
-e_etrg = list(glob.glob(f'wmt2019-system-data/outputs/{lang}-en/*.en.tok')) 
-f_etrg = [f'wmt2019-system-data/mtnt/mtnt-test2019.{lang}-en.{lang}.tok' for f in e_etrg]
-
-f_all = f_orig + f_ftrg + f_etrg
-e_all = e_orig + e_ftrg + e_etrg
-
-run_cmd(f'mkdir -p alignments/{lang}')
-run_cmd('cat '+' '.join(f_all)+f' | sed "s/^$/__EMPTY__/g" > alignments/{lang}/all.{lang}')
-run_cmd('cat '+' '.join(e_all)+f' | sed "s/^$/__EMPTY__/g" > alignments/{lang}/all.en')
-
-if args.aligner == 'giza':
-  run_cmd(f'{args.mdir}/scripts/training/train-model.perl -external-bin-dir {mdir}/tools -last-step 4 -root-dir alignments/{lang}/moses -corpus alignments/{lang}/all -f {lang} -e en -alignment grow-diag-final-and -cores 4 -parallel')
-elif args.aligner == 'fa':
-  run_cmd(f'mkdir -p alignments/{lang}/fa')
-  with open(f'alignments/{lang}/all.{lang}', 'r') as ffile, open(f'alignments/{lang}/all.en', 'r') as efile, open(f'alignments/{lang}/fa/all.{lang}-en', 'w') as fefile:
-    for fline, eline in zip(ffile, efile):
-      fline = fline.strip()
-      eline = eline.strip()
-      print(f'{fline} ||| {eline}', file=fefile)
-  p1 = run_background(f'{args.fadir}/build/fast_align -i alignments/{lang}/fa/all.{lang}-en -d -o -v > alignments/{lang}/fa/all.foralign.{lang}-en 2> alignments/{lang}/fa/all.foralign.log')
-  p2 = run_background(f'{args.fadir}/build/fast_align -i alignments/{lang}/fa/all.{lang}-en -d -o -v -r > alignments/{lang}/fa/all.backalign.{lang}-en 2> alignments/{lang}/fa/all.backalign.log')
-  p1.wait()
-  p2.wait()
-  run_cmd(f'{args.fadir}/build/atools -i alignments/{lang}/fa/all.foralign.{lang}-en -j alignments/{lang}/fa/all.backalign.{lang}-en -c grow-diag-final-and > alignments/{lang}/fa/all.align.{lang}-en')
-else:
-  raise ValueError(f'Illegal aligner {args.aligner}')
-
-# TODO: figure out what GIZA++ outputs
-alignfile = None if args.aligner == 'giza' else f'alignments/{lang}/fa/all.align.{lang}-en'
-  
-def assign_alignments(aligns, inf, outf, reverse=False):
-  print(f'assign_alignments(aligns, {inf}, {outf})')
-  if inf == outf:
-    raise ValueError(f'Error {inf} == {outf}')
-  with open(inf, 'r') as ins, open(outf, 'w') as outs:
-    for line in ins:
-      if not reverse:
-        print(aligns.readline().strip(), file=outs)
-      else:
-        print(' '.join([f'{trg}-{src}' for (src,trg) in [v.split('-') for v in aligns.readline().strip().split(' ')]]), file=outs)
-
-with open(alignfile, 'r') as alignstream:
-  for f in f_orig:
-    if f'en-{lang}' in f:
-      assign_alignments(alignstream, f, f.replace(f'{lang}.tok', f'en-{lang}-{args.aligner}align'), reverse=True)
+  """Run a shell command (recording it in the trace), and fail if it fails"""
+  instrument.tracer.run_cmd(cmd)
+
+def is_stale(target, sources):
+  """Whether target does not exist or is older than any of its sources"""
+  return not os.path.isfile(target) or any(os.path.getmtime(x) > os.path.getmtime(target) for x in sources)
+
+def read_fast_align_log(log_file):
+  """Get the final tension and the expected target/source length ratio from a fast_align log,
+  which are needed to force-align with the saved parameters of that run"""
+  tension, ratio = None, None
+  with open(log_file, 'r') as log:
+    for line in log:
+      # expected target length = source length * N
+      if 'expected target length' in line:
+        ratio = line.split()[-1]
+      # final tension: N
+      elif 'final tension' in line:
+        tension = line.split()[-1]
+  if tension is None or ratio is None:
+    raise ValueError(f'Could not find the tension and length ratio in {log_file}')
+  return tension, ratio
+
+def fast_align_cmd(fadir, prefix, lang, direction, save_params=False, model=None):
+  """The command that aligns the joint file {prefix}.{lang}-en with fast_align in one direction
+  (foralign or backalign). With save_params the trained parameters are kept in
+  {prefix}.{direction}.params, and if the prefix of such an earlier run is passed as model the
+  pairs are force-aligned with its parameters instead of training new ones."""
+  cmd = f'{fadir}/build/fast_align -i {prefix}.{lang}-en -d'
+  if direction == 'backalign':
+    cmd += ' -r'
+  if model:
+    tension, ratio = read_fast_align_log(f'{model}.{direction}.log')
+    cmd += f' -f {model}.{direction}.params -T {tension} -m {ratio}'
+  else:
+    cmd += ' -o -v'
+  if save_params:
+    cmd += f' -p {prefix}.{direction}.params'
+  return f'{cmd} > {prefix}.{direction}.{lang}-en 2> {prefix}.{direction}.log'
+
+def atools_cmd(fadir, prefix, lang):
+  """The command that symmetrizes the forward and backward alignments into {prefix}.align.{lang}-en"""
+  return f'{fadir}/build/atools -i {prefix}.foralign.{lang}-en -j {prefix}.backalign.{lang}-en -c grow-diag-final-and > {prefix}.align.{lang}-en'
+
+def moses_cmd(mdir, lang, num_proc):
+  """The command that aligns alignments/{lang}/all.{{lang,en}} with GIZA++ through Moses, which writes
+  the symmetrized alignments to model/aligned.grow-diag-final-and under its root directory"""
+  return f'{mdir}/scripts/training/train-model.perl -external-bin-dir {mdir}/tools -last-step 4 -root-dir alignments/{lang}/moses -corpus alignments/{lang}/all -f {lang} -e en -alignment grow-diag-final-and -cores {num_proc} -parallel'
+
+def run_fast_align(fadir, prefix, lang, save_params=False, model=None):
+  """Align {prefix}.{lang}-en in both directions at once, and symmetrize the result"""
+  run_cmds([fast_align_cmd(fadir, prefix, lang, direction, save_params=save_params, model=model)
+            for direction in ('foralign', 'backalign')], 2)
+  run_cmd(atools_cmd(fadir, prefix, lang))
+
+def shard_corpus(joint_file, prefix, lang, num_shards):
+  """Split the joint file into num_shards files {prefix}.{i}.{lang}-en of consecutive lines, so that
+  concatenating their alignments gives back the original line order. Returns the number of lines of
+  every shard and how often every word occurs on the f and e sides of it."""
+  with open(joint_file, 'rb') as ins:
+    total = sum(chunk.count(b'\n') for chunk in iter(lambda: ins.read(1<<24), b''))
+  bounds = [total * i // num_shards for i in range(num_shards + 1)]
+  stats = []
+  with open(joint_file, 'r') as ins:
+    for i, (begin, end) in enumerate(zip(bounds, bounds[1:])):
+      f_counts, e_counts = collections.Counter(), collections.Counter()
+      with open(f'{prefix}.{i}.{lang}-en', 'w', buffering=1<<20) as outs:
+        for line in itertools.islice(ins, end - begin):
+          outs.write(line)
+          f, e = line.rstrip('\n').split(' ||| ')
+          f_counts.update(f.split())
+          e_counts.update(e.split())
+      # Every sentence has one NULL word on the source side
+      f_counts['<eps>'] = e_counts['<eps>'] = end - begin
+      stats.append((end - begin, f_counts, e_counts))
+  return stats
+
+def merge_fast_align_params(shard_prefixes, stats, direction, prefix):
+  """Combine the lexical tables and the tension and length ratio of models trained on different
+  shards into {prefix}.{direction}.params and .log, which can be used to force-align with.
+  Every shard's p(t|s) is weighted by how often s occurs in that shard."""
+  probs = collections.defaultdict(float)
+  tension, ratio, lines = 0.0, 0.0, 0
+  for shard_prefix, (count, f_counts, e_counts) in zip(shard_prefixes, stats):
+    src_counts = e_counts if direction == 'backalign' else f_counts
+    with open(f'{shard_prefix}.{direction}.params', 'r') as params:
+      for line in params:
+        s, t, logprob = line.rstrip('\n').split('\t')
+        probs[s, t] += src_counts[s] * math.exp(float(logprob))
+    shard_tension, shard_ratio = read_fast_align_log(f'{shard_prefix}.{direction}.log')
+    tension += count * float(shard_tension)
+    ratio += count * float(shard_ratio)
+    lines += count
+  # Renormalize, as entries below the pruning threshold of a shard are missing from its table
+  norms = collections.defaultdict(float)
+  for (s, t), p in probs.items():
+    norms[s] += p
+  with open(f'{prefix}.{direction}.params', 'w') as params:
+    for (s, t), p in probs.items():
+      if p > 0:
+        print(f'{s}\t{t}\t{math.log(p / norms[s])}', file=params)
+  # Written in the same form as the fast_align log, so that read_fast_align_log() can read it
+  with open(f'{prefix}.{direction}.log', 'w') as log:
+    print(f'expected target length = source length * {ratio / lines}', file=log)
+    print(f'  final tension: {tension / lines}', file=log)
+
+def run_cmds(cmds, num_proc):
+  """Run shell commands with at most num_proc of them at the same time, failing if any of them fails"""
+  def call(cmd):
+    return instrument.tracer.run_cmd(cmd, check=False)
+  with multiprocessing.pool.ThreadPool(num_proc) as pool:
+    for cmd, code in zip(cmds, pool.map(call, cmds)):
+      if code != 0:
+        raise RuntimeError(f'Command failed with exit code {code}: {cmd}')
+
+def run_sharded_fast_align(fadir, joint_file, prefix, lang, num_shards, num_proc):
+  """Align joint_file in num_shards pieces at a time: train separate forward and reverse models on every
+  shard, merge them into one model, force-align every shard with the merged model, and symmetrize the
+  concatenated result into {prefix}.align.{lang}-en"""
+  shards = [f'{prefix}.{i}' for i in range(num_shards)]
+  with instrument.tracer.stage('shard_corpus', inputs=[joint_file], outputs=[f'{shard}.{lang}-en' for shard in shards]):
+    stats = shard_corpus(joint_file, prefix, lang, num_shards)
+  directions = ('foralign', 'backalign')
+  run_cmds([fast_align_cmd(fadir, shard, lang, d, save_params=True) for shard in shards for d in directions], num_proc)
+  merged = f'{prefix}.merged'
+  with instrument.tracer.stage('merge_fast_align_params', outputs=[f'{merged}.{d}.params' for d in directions]):
+    for d in directions:
+      merge_fast_align_params(shards, stats, d, merged)
+  # The training alignments of every shard are replaced by those of the merged model
+  run_cmds([fast_align_cmd(fadir, shard, lang, d, model=merged) for shard in shards for d in directions], num_proc)
+  for d in directions:
+    with open(f'{prefix}.{d}.{lang}-en', 'wb') as outs:
+      for shard in shards:
+        with open(f'{shard}.{d}.{lang}-en', 'rb') as ins:
+          shutil.copyfileobj(ins, outs, 1<<24)
+  run_cmd(atools_cmd(fadir, prefix, lang))
+
+def alignment_agreement(ref_file, hyp_file):
+  """Precision, recall and F1 of the links in hyp_file with respect to those in ref_file, and the
+  fraction of sentences that are aligned in exactly the same way"""
+  matched, n_ref, n_hyp, same, lines = 0, 0, 0, 0, 0
+  with open(ref_file, 'r') as refs, open(hyp_file, 'r') as hyps:
+    for ref, hyp in itertools.zip_longest(refs, hyps):
+      if ref is None or hyp is None:
+        raise ValueError(f'Number of lines in {ref_file} and {hyp_file} do not match')
+      ref, hyp = set(ref.split()), set(hyp.split())
+      matched += len(ref & hyp)
+      n_ref += len(ref)
+      n_hyp += len(hyp)
+      same += ref == hyp
+      lines += 1
+  prec = matched / max(n_hyp, 1)
+  rec = matched / max(n_ref, 1)
+  f1 = 2 * prec * rec / max(prec + rec, 1e-12)
+  return prec, rec, f1, same / max(lines, 1)
+
+def shard_report(full_prefix, shard_prefix, lang, num_shards, elapsed):
+  """Compare the sharded alignments with those of an unsharded run on the same corpus"""
+  lines = [f'shards: {num_shards}, time: {elapsed:.1f}s']
+  for name in ('foralign', 'backalign', 'align'):
+    prec, rec, f1, same = alignment_agreement(f'{full_prefix}.{name}.{lang}-en', f'{shard_prefix}.{name}.{lang}-en')
+    lines.append(f'{name}: precision={prec:.4f} recall={rec:.4f} f1={f1:.4f} identical_sentences={same:.4f}')
+  return '\n'.join(lines)
+
+def corpus_files(lang, sd='wmt2019-system-data'):
+  """The tokenized (f, e) file pairs of the fixed corpus and of the system outputs, in the order that
+  they are concatenated in. System outputs are found from either their raw or tokenized files."""
+  def outputs(pattern):
+    return sorted({x if x.endswith('.tok') else f'{x}.tok' for x in glob.glob(pattern) + glob.glob(f'{pattern}.tok')})
+  mtnt_types = ('trainclean', 'valid', 'test', 'test2019')
+  f_orig = ([f'{sd}/mtnt/mtnt-{t}.{lang}-en.{lang}.tok' for t in mtnt_types]
+           + [f'{sd}/mtnt/mtnt-{t}.en-{lang}.{lang}.tok' for t in mtnt_types]
+           + [f'{sd}/extra/{lang}/trainclean.{lang}.tok'])
+  e_orig = [l.replace(f'{lang}.tok', 'en.tok') for l in f_orig]
+  f_ftrg = outputs(f'{sd}/outputs/en-{lang}/*.{lang}')
+  e_ftrg = [f'{sd}/mtnt/mtnt-test2019.en-{lang}.en.tok' for f in f_ftrg]
+  e_etrg = outputs(f'{sd}/outputs/{lang}-en/*.en')
+  f_etrg = [f'{sd}/mtnt/mtnt-test2019.{lang}-en.{lang}.tok' for f in e_etrg]
+  return f_orig, e_orig, f_ftrg + f_etrg, e_ftrg + e_etrg
+
+def build_corpus(f_all, e_all, manifest_file, f_out=None, e_out=None, fe_out=None):
+  """Read every (f, e) file pair once, replacing empty lines and checking that both sides have
+  the same number of lines. The pairs are written to the separate corpus files f_out/e_out
+  and/or the joint "f ||| e" file fe_out, and the manifest records the first line and number of
+  lines of every pair in the concatenated corpus."""
+  with instrument.tracer.stage('build_corpus', inputs=list(f_all) + list(e_all),
+                               outputs=[x for x in (f_out, e_out, fe_out, manifest_file) if x]):
+    _build_corpus(f_all, e_all, manifest_file, f_out, e_out, fe_out)
+
+def _build_corpus(f_all, e_all, manifest_file, f_out, e_out, fe_out):
+  outs = [open(x, 'w', buffering=1<<20) if x else None for x in (f_out, e_out, fe_out)]
+  f_stream, e_stream, fe_stream = outs
+  start = 0
+  with open(manifest_file, 'w') as manifest:
+    for f, e in zip(f_all, e_all):
+      print(f'build_corpus: adding {f} and {e}')
+      count = 0
+      with open(f, 'r') as fs, open(e, 'r') as es:
+        for fline, eline in itertools.zip_longest(fs, es):
+          if fline is None or eline is None:
+            raise ValueError(f'Number of lines in {f} and {e} do not match')
+          fline = fline.strip() or '__EMPTY__'
+          eline = eline.strip() or '__EMPTY__'
+          if f_stream:
+            f_stream.write(f'{fline}\n')
+          if e_stream:
+            e_stream.write(f'{eline}\n')
+          if fe_stream:
+            fe_stream.write(f'{fline} ||| {eline}\n')
+          count += 1
+      print(f'{start}\t{count}\t{f}\t{e}', file=manifest)
+      start += count
+  for x in outs:
+    if x:
+      x.close()
+
+def align_output(f, e, lang, aligner):
+  """The file that the alignments of the (f, e) pair are written to, and whether the f-e
+  alignments need to be reversed to e-f because English is the source side of the pair."""
+  if f'outputs/{lang}-en/' in e:
+    return e.replace('en.tok', f'{lang}-en-{aligner}align'), False
+  elif f'en-{lang}' in f:
+    return f.replace(f'{lang}.tok', f'en-{lang}-{aligner}align'), True
+  else:
+    return f.replace(f'{lang}.tok', f'{lang}-en-{aligner}align'), False
+
+def align_source(f, e, lang):
+  """The tokenized file of the (f, e) pair that the name of its alignment file is made from, in whose
+  label store the alignments are kept"""
+  return e if f'outputs/{lang}-en/' in e else f
+
+def read_manifest(manifest_file):
+  """Read the (start, count, f, e) entries written by build_corpus"""
+  with open(manifest_file, 'r') as manifest:
+    return [(int(start), int(count), f, e) for start, count, f, e in
+            (line.rstrip('\n').split('\t') for line in manifest)]
+
+def line_offsets(fname, counts):
+  """Byte offsets of the boundaries between consecutive blocks of lines with the given sizes"""
+  offsets = [0]
+  with open(fname, 'rb') as ins:
+    for count in counts:
+      # Skip over the block without handling the lines in python, but keep track of how many there were
+      last = collections.deque(enumerate(itertools.islice(ins, count), 1), maxlen=1)
+      if (last[0][0] if last else 0) != count:
+        raise ValueError(f'{fname} has fewer lines than expected from the manifest')
+      offsets.append(ins.tell())
+    if ins.read(1):
+      raise ValueError(f'{fname} has more lines than expected from the manifest')
+  return offsets
+
+reverse_re = re.compile(rb'(\d+)-(\d+)')
+
+def write_alignments(job):
+  """Copy the byte range [begin, end) of the alignment file to outf in large chunks, optionally
+  reversing every f-e pair into e-f, and add them to the label store of store_file if there is one"""
+  alignfile, begin, end, outf, reverse, store_file = job
+  with open(alignfile, 'rb') as ins, open(outf, 'wb') as outs:
+    ins.seek(begin)
+    left = end - begin
+    while left > 0:
+      chunk = ins.read(min(left, 1<<24))
+      # Always finish the last line so that no pair is split across chunks
+      if not chunk.endswith(b'\n') and len(chunk) < left:
+        chunk += ins.readline()
+      left -= len(chunk)
+      outs.write(reverse_re.sub(rb'\2-\1', chunk) if reverse else chunk)
+  if store_file:
+    LabelStore(store_file).put_alignments(align_name(store_file, outf), outf)
+  return outf
+
+def split_alignments(alignfile, manifest_file, lang, aligner, num_proc, store=True):
+  """Split the alignments of the concatenated corpus into one file for every pair in the manifest, and
+  with store also add them to the label stores of the tokenized files"""
+  entries = read_manifest(manifest_file)
+  offsets = line_offsets(alignfile, [count for _, count, _, _ in entries])
+  jobs = []
+  for (start, count, f, e), begin, end in zip(entries, offsets, offsets[1:]):
+    outf, reverse = align_output(f, e, lang, aligner)
+    if outf in (f, e):
+      raise ValueError(f'Error {outf} would overwrite its input')
+    jobs.append((alignfile, begin, end, outf, reverse, align_source(f, e, lang) if store else None))
+  # The output files do not depend on each other, so they are written in parallel
+  with instrument.tracer.stage('split_alignments', inputs=[alignfile, manifest_file], outputs=[job[3] for job in jobs]):
+    with multiprocessing.Pool(num_proc) as pool:
+      for outf in pool.imap_unordered(write_alignments, jobs):
+        print(f'split_alignments: wrote {outf}')
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Make alignments for wmt robustness task data""")
+  p.add_argument("lang", help="what language to use (fr or ja)", type=str)
+  p.add_argument("--aligner", help="what aligner to use (giza, fa, or ibm2 for the built-in numpy version of fast_align)", type=str, default='giza')
+  p.add_argument("--mdir", help="top directory of Moses installation", type=str, default='/home/gneubig/usr/local/mosesdecoder')
+  p.add_argument("--fadir", help="top directory of FastAlign installation", type=str, default='/home/gneubig/usr/local/fast_align')
+  p.add_argument("--num_proc", help="number of processes to use", type=int, default=4)
+  p.add_argument("--shards", help="with --aligner fa, split the corpus into this many shards that are aligned in parallel and then merged", type=int, default=1)
+  p.add_argument("--shard_report", help="compare the sharded alignments with those of an earlier unsharded run (make_alignments.py LANG --aligner fa)", action='store_true')
+  p.add_argument("--no_store", help="only write the split alignment files, and do not add them to the label stores of the tokenized files", action='store_true')
+  p.add_argument("--trace", help="file to append a JSON record of the time, memory and data of every step to", type=str, default='alignments/trace.jsonl')
+  p.add_argument("--profile", help="directory to write cProfile profiles of the python steps to", type=str, default=None)
+  p.add_argument("--sample_cmd", help="command to run every external command under, e.g. 'py-spy record -o {profile_dir}/{name}.svg --'", type=str, default=None)
+  p.add_argument("--incremental", help="train fast_align on the fixed corpus once, and only force-align system outputs that are new since the last run (delete alignments/LANG/fa/base.* to retrain)", action='store_true')
+  args = p.parse_args()
+  instrument.configure(args.trace, args.profile, args.sample_cmd)
+
+  lang = args.lang
+  if args.incremental and args.aligner != 'fa':
+    raise ValueError('--incremental is only supported with --aligner fa')
+  if args.shards > 1 and (args.aligner != 'fa' or args.incremental):
+    raise ValueError('--shards is only supported with --aligner fa without --incremental')
+
+  f_orig, e_orig, f_new, e_new = corpus_files(lang)
+  f_all = f_orig + f_new
+  e_all = e_orig + e_new
+
+  run_cmd(f'mkdir -p alignments/{lang}')
+
+  if args.aligner == 'giza':
+    manifest = f'alignments/{lang}/all.manifest'
+    build_corpus(f_all, e_all, manifest, f_out=f'alignments/{lang}/all.{lang}', e_out=f'alignments/{lang}/all.en')
+    run_cmd(moses_cmd(args.mdir, lang, args.num_proc))
+    split_alignments(f'alignments/{lang}/moses/model/aligned.grow-diag-final-and', manifest, lang, args.aligner, args.num_proc, store=not args.no_store)
+  elif args.aligner == 'fa' and args.shards > 1:
+    # Kept apart from the unsharded run so that the two can be compared
+    sdir = f'alignments/{lang}/fa/shard{args.shards}'
+    run_cmd(f'mkdir -p {sdir}')
+    manifest = f'{sdir}/all.manifest'
+    build_corpus(f_all, e_all, manifest, fe_out=f'{sdir}/all.{lang}-en')
+    start = time.time()
+    run_sharded_fast_align(args.fadir, f'{sdir}/all.{lang}-en', f'{sdir}/all', lang, args.shards, args.num_proc)
+    elapsed = time.time() - start
+    split_alignments(f'{sdir}/all.align.{lang}-en', manifest, lang, args.aligner, args.num_proc, store=not args.no_store)
+    if args.shard_report:
+      report = shard_report(f'alignments/{lang}/fa/all', f'{sdir}/all', lang, args.shards, elapsed)
+      with open(f'{sdir}/report.txt', 'w') as out:
+        print(report, file=out)
+      print(report)
+  elif args.aligner == 'fa' and not args.incremental:
+    run_cmd(f'mkdir -p alignments/{lang}/fa')
+    manifest = f'alignments/{lang}/fa/all.manifest'
+    build_corpus(f_all, e_all, manifest, fe_out=f'alignments/{lang}/fa/all.{lang}-en')
+    run_fast_align(args.fadir, f'alignments/{lang}/fa/all', lang)
+    split_alignments(f'alignments/{lang}/fa/all.align.{lang}-en', manifest, lang, args.aligner, args.num_proc, store=not args.no_store)
+  elif args.aligner == 'fa':
+    run_cmd(f'mkdir -p alignments/{lang}/fa')
+    # Train the forward and reverse models on the fixed corpus only once
+    base = f'alignments/{lang}/fa/base'
+    if not all(os.path.isfile(f'{base}.{d}.params') for d in ('foralign', 'backalign')):
+      build_corpus(f_orig, e_orig, f'{base}.manifest', fe_out=f'{base}.{lang}-en')
+      run_fast_align(args.fadir, base, lang, save_params=True)
+      split_alignments(f'{base}.align.{lang}-en', f'{base}.manifest', lang, args.aligner, args.num_proc, store=not args.no_store)
+    # Then force-align all of the system outputs that have changed since their alignments were made
+    params = [f'{base}.{d}.params' for d in ('foralign', 'backalign')]
+    new_pairs = [(f, e) for f, e in zip(f_new, e_new)
+                 if is_stale(align_output(f, e, lang, args.aligner)[0], [f, e] + params)]
+    if new_pairs:
+      new = f'alignments/{lang}/fa/new'
+      build_corpus([f for f, _ in new_pairs], [e for _, e in new_pairs], f'{new}.manifest', fe_out=f'{new}.{lang}-en')
+      run_fast_align(args.fadir, new, lang, model=base)
+      split_alignments(f'{new}.align.{lang}-en', f'{new}.manifest', lang, args.aligner, args.num_proc, store=not args.no_store)
     else:
-      assign_alignments(alignstream, f, f.replace(f'{lang}.tok', f'{lang}-en-{args.aligner}align'))
-  for f in f_ftrg:
-    assign_alignments(alignstream, f, f.replace(f'{lang}.tok', f'en-{lang}-{args.aligner}align'), reverse=True)
-  for e in e_etrg:
-    assign_alignments(alignstream, e, e.replace(f'en.tok', f'{lang}-en-{args.aligner}align'))
+      print('no new system outputs to align')
+  elif args.aligner == 'ibm2':
+    run_cmd(f'mkdir -p alignments/{lang}/ibm2')
+    prefix = f'alignments/{lang}/ibm2/all'
+    manifest = f'{prefix}.manifest'
+    build_corpus(f_all, e_all, manifest, fe_out=f'{prefix}.{lang}-en')
+    with instrument.tracer.stage('ibm2', inputs=[f'{prefix}.{lang}-en'], outputs=[f'{prefix}.align.{lang}-en']):
+      ibm2.align_file(f'{prefix}.{lang}-en', f'{prefix}.align.{lang}-en', fwd_file=f'{prefix}.foralign.{lang}-en',
+                      rev_file=f'{prefix}.backalign.{lang}-en', num_proc=args.num_proc, work_dir=f'alignments/{lang}/ibm2')
+    split_alignments(f'{prefix}.align.{lang}-en', manifest, lang, args.aligner, args.num_proc, store=not args.no_store)
+  else:
+    raise ValueError(f'Illegal aligner {args.aligner}')
@@ -0,0 +1,255 @@
+import sys
+import os
+import glob
+import time
+import argparse
+import subprocess
+import multiprocessing
+import ibm2
+import instrument
+from make_alignments import build_corpus, split_alignments, align_output, corpus_files, is_stale, fast_align_cmd, atools_cmd, moses_cmd
+
+# Run the whole alignment pipeline (tokenize, clean, concatenate, align, symmetrize, split) as a graph of steps,
+# for all of the languages and aligners at once. Independent steps run in parallel as long as they fit in the
+# CPU budget, and steps whose outputs are all newer than their inputs are skipped, so after a failure late in the
+# pipeline, running it again only redoes the steps that failed (and the ones that depend on them).
+#
+# $ python pipeline.py --langs fr ja --aligners fa giza --cpus 8 --mdir $MOSES_DIR --fadir $FAST_ALIGN_DIR
+#
+# Use --dry_run to see which steps would be run. The output of every step is written to --log_dir, and the
+# time, memory and data of every step to --trace (see instrument.py).
+
+class Step:
+  """One step of the pipeline, which is either a shell command or a python function to call in a
+  separate process, along with the files that it reads and writes and how many CPUs it uses"""
+
+  def __init__(self, name, inputs, outputs, cmd=None, func=None, args=(), kwargs=None, cpus=1):
+    if (cmd is None) == (func is None):
+      raise ValueError(f'Step {name} needs exactly one of cmd or func')
+    self.name = name
+    self.inputs = list(inputs)
+    self.outputs = list(outputs)
+    self.cmd = cmd
+    self.func = func
+    self.args = args
+    self.kwargs = kwargs or {}
+    self.cpus = cpus
+
+def _call_logged(step, log_file):
+  """Call the function of a step as a traced stage, with both stdout and stderr (including those of its
+  subprocesses) going to log_file"""
+  fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+  os.dup2(fd, 1)
+  os.dup2(fd, 2)
+  try:
+    with instrument.tracer.stage(step.name, inputs=step.inputs, outputs=step.outputs):
+      step.func(*step.args, **step.kwargs)
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+class _Job:
+  """A running step, which can be polled for its exit code in the same way for commands and functions"""
+
+  def __init__(self, step, log_file):
+    self.step = step
+    self.start = time.time()
+    if step.cmd is not None:
+      self.log = open(log_file, 'w')
+      self.proc = instrument.tracer.start_cmd(step.cmd, name=step.name, inputs=step.inputs, outputs=step.outputs,
+                                              stdout=self.log, stderr=subprocess.STDOUT)
+    else:
+      self.log = None
+      self.proc = multiprocessing.Process(target=_call_logged, args=(step, log_file))
+      self.proc.start()
+
+  def poll(self):
+    if self.step.cmd is not None:
+      code = self.proc.poll()
+    else:
+      code = None if self.proc.is_alive() else self.proc.exitcode
+    if code is not None and self.log:
+      self.log.close()
+    return code
+
+  def kill(self):
+    if self.step.cmd is not None:
+      self.proc.kill()
+    else:
+      self.proc.terminate()
+
+def _mark_stale(step):
+  """Make sure that the (possibly partial) outputs of a step that did not finish are redone next time"""
+  for out in step.outputs:
+    if os.path.isfile(out):
+      os.utime(out, (0, 0))
+
+def run_steps(steps, cpus, log_dir, dry_run=False, poll_interval=0.5):
+  """Run the steps in dependency order, as many at once as fit in the CPU budget, skipping those
+  that are up to date. Steps that depend on a failed step are not run. Returns whether all steps
+  succeeded."""
+  producer = {}
+  for step in steps:
+    for out in step.outputs:
+      if out in producer:
+        raise ValueError(f'{out} is written by both {producer[out].name} and {step.name}')
+      producer[out] = step
+  deps = {step.name: {producer[x].name for x in step.inputs if x in producer} for step in steps}
+  state = {step.name: 'waiting' for step in steps}
+  os.makedirs(log_dir, exist_ok=True)
+  running = []
+  try:
+    while True:
+      # Keep going over the waiting steps until nothing else can be started
+      progress = True
+      while progress:
+        progress = False
+        used = sum(job.step.cpus for job in running)
+        for step in steps:
+          if state[step.name] != 'waiting':
+            continue
+          dep_states = {state[d] for d in deps[step.name]}
+          if dep_states & {'failed', 'blocked'}:
+            state[step.name] = 'blocked'
+            print(f'blocked: {step.name}')
+            progress = True
+            continue
+          if not dep_states <= {'done', 'skipped'}:
+            continue
+          missing = [x for x in step.inputs if not os.path.isfile(x) and not (dry_run and x in producer)]
+          if missing:
+            state[step.name] = 'failed'
+            print(f'failed: {step.name} (missing input {missing[0]})')
+            progress = True
+            continue
+          if not dry_run and not any(is_stale(out, step.inputs) for out in step.outputs):
+            state[step.name] = 'skipped'
+            print(f'up to date: {step.name}')
+            progress = True
+            continue
+          # Steps that need more than the whole budget still run, but only on their own
+          if running and used + step.cpus > cpus:
+            continue
+          if dry_run:
+            state[step.name] = 'done'
+            print(f'would run: {step.name}: {step.cmd or step.func.__name__}')
+          else:
+            print(f'running: {step.name}: {step.cmd or step.func.__name__}')
+            running.append(_Job(step, os.path.join(log_dir, f'{step.name}.log')))
+            state[step.name] = 'running'
+            used += step.cpus
+          progress = True
+      if not running:
+        break
+      time.sleep(poll_interval)
+      for job in list(running):
+        code = job.poll()
+        if code is None:
+          continue
+        running.remove(job)
+        elapsed = time.time() - job.start
+        if code == 0:
+          state[job.step.name] = 'done'
+          print(f'finished: {job.step.name} ({elapsed:.1f}s)')
+        else:
+          state[job.step.name] = 'failed'
+          _mark_stale(job.step)
+          print(f'failed: {job.step.name} (exit code {code} after {elapsed:.1f}s, see {log_dir}/{job.step.name}.log)')
+  except KeyboardInterrupt:
+    for job in running:
+      job.kill()
+      _mark_stale(job.step)
+    raise
+  counts = {}
+  for s in state.values():
+    counts[s] = counts.get(s, 0) + 1
+  print('summary: ' + ', '.join(f'{v} {k}' for k, v in sorted(counts.items())))
+  return not (counts.get('failed') or counts.get('blocked'))
+
+def tokenize_steps(langs, sd, num_proc):
+  """Tokenize the raw English, French and Japanese files"""
+  steps = []
+  for l in sorted(set(langs) | {'en'}):
+    raw = sorted(glob.glob(f'{sd}/mtnt/*.{l}') + glob.glob(f'{sd}/extra/*/*.{l}') + glob.glob(f'{sd}/outputs/*/*.{l}'))
+    if not raw:
+      continue
+    if l == 'ja':
+      for i, f in enumerate(raw):
+        steps.append(Step(f'tokenize-ja-{i}', [f], [f'{f}.tok'], cmd=f"cat {f} | sed 's/ /　/g' | kytea -notags > {f}.tok"))
+    else:
+      script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'do_tokenize.py')
+      steps.append(Step(f'tokenize-{l}', raw, [f'{f}.tok' for f in raw],
+                        cmd=f'{sys.executable} {script} {l} --tokenizer_only --n_process {num_proc} --cache tok-cache/{l}.db ' + ' '.join(raw),
+                        cpus=num_proc))
+  return steps
+
+def clean_steps(langs, sd, mdir):
+  """Remove long and empty sentences from the training corpora"""
+  steps = []
+  for l in langs:
+    for raw, clean in ((f'{sd}/mtnt/mtnt-train.{l}-en', f'{sd}/mtnt/mtnt-trainclean.{l}-en'),
+                       (f'{sd}/mtnt/mtnt-train.en-{l}', f'{sd}/mtnt/mtnt-trainclean.en-{l}'),
+                       (f'{sd}/extra/{l}/train', f'{sd}/extra/{l}/trainclean')):
+      steps.append(Step(f'clean-{os.path.basename(raw)}-{l}', [f'{raw}.{l}.tok', f'{raw}.en.tok'], [f'{clean}.{l}.tok', f'{clean}.en.tok'],
+                        cmd=f'{mdir}/scripts/training/clean-corpus-n.perl {raw} {l}.tok en.tok {clean} 1 70'))
+  return steps
+
+def align_steps(lang, aligner, sd, mdir, fadir, num_proc):
+  """Concatenate the corpus, align it, and split the alignments back into one file per input pair"""
+  f_orig, e_orig, f_new, e_new = corpus_files(lang, sd)
+  f_all, e_all = f_orig + f_new, e_orig + e_new
+  split_outs = [align_output(f, e, lang, aligner)[0] for f, e in zip(f_all, e_all)]
+  name = f'{aligner}-{lang}'
+  if aligner == 'giza':
+    os.makedirs(f'alignments/{lang}', exist_ok=True)
+    manifest, alignfile = f'alignments/{lang}/all.manifest', f'alignments/{lang}/moses/model/aligned.grow-diag-final-and'
+    corpus = [f'alignments/{lang}/all.{lang}', f'alignments/{lang}/all.en']
+    steps = [Step(f'concat-{name}', f_all + e_all, corpus + [manifest], func=build_corpus, args=(f_all, e_all, manifest),
+                  kwargs={'f_out': corpus[0], 'e_out': corpus[1]}),
+             Step(f'align-{name}', corpus, [alignfile], cmd=moses_cmd(mdir, lang, num_proc), cpus=num_proc)]
+  else:
+    os.makedirs(f'alignments/{lang}/{aligner}', exist_ok=True)
+    prefix = f'alignments/{lang}/{aligner}/all'
+    manifest, joint, alignfile = f'{prefix}.manifest', f'{prefix}.{lang}-en', f'{prefix}.align.{lang}-en'
+    directions = [f'{prefix}.{d}.{lang}-en' for d in ('foralign', 'backalign')]
+    steps = [Step(f'concat-{name}', f_all + e_all, [joint, manifest], func=build_corpus, args=(f_all, e_all, manifest),
+                  kwargs={'fe_out': joint})]
+    if aligner == 'fa':
+      steps += [Step(f'align-{d}-{name}', [joint], [out], cmd=fast_align_cmd(fadir, prefix, lang, d))
+                for d, out in zip(('foralign', 'backalign'), directions)]
+      steps.append(Step(f'symmetrize-{name}', directions, [alignfile], cmd=atools_cmd(fadir, prefix, lang)))
+    elif aligner == 'ibm2':
+      steps.append(Step(f'align-{name}', [joint], [alignfile] + directions, func=ibm2.align_file, args=(joint, alignfile),
+                        kwargs={'fwd_file': directions[0], 'rev_file': directions[1], 'num_proc': num_proc,
+                                'work_dir': f'alignments/{lang}/{aligner}'}, cpus=num_proc))
+    else:
+      raise ValueError(f'Illegal aligner {aligner}')
+  steps.append(Step(f'split-{name}', [alignfile, manifest], split_outs, func=split_alignments,
+                    args=(alignfile, manifest, lang, aligner, num_proc), cpus=num_proc))
+  return steps
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Run the whole alignment pipeline for the wmt robustness task data""")
+  p.add_argument("--langs", help="what languages to align with English", type=str, nargs='+', default=['fr', 'ja'])
+  p.add_argument("--aligners", help="what aligners to use (giza, fa, ibm2)", type=str, nargs='+', default=['fa', 'giza'])
+  p.add_argument("--sd", help="directory of the wmt2019 system data", type=str, default='wmt2019-system-data')
+  p.add_argument("--mdir", help="top directory of Moses installation", type=str, default='/home/gneubig/usr/local/mosesdecoder')
+  p.add_argument("--fadir", help="top directory of FastAlign installation", type=str, default='/home/gneubig/usr/local/fast_align')
+  p.add_argument("--cpus", help="how many CPUs the steps that run at the same time can use in total", type=int, default=multiprocessing.cpu_count())
+  p.add_argument("--num_proc", help="number of processes to use in each of the steps that can use more than one", type=int, default=4)
+  p.add_argument("--log_dir", help="directory to write the output of each step to", type=str, default='alignments/logs')
+  p.add_argument("--dry_run", help="only print the steps that would be run", action='store_true')
+  p.add_argument("--trace", help="file to append a JSON record of the time, memory and data of every step to (default LOG_DIR/trace.jsonl)", type=str, default=None)
+  p.add_argument("--profile", help="directory to write cProfile profiles of the python steps to", type=str, default=None)
+  p.add_argument("--sample_cmd", help="command to run every command step under, e.g. 'py-spy record -o {profile_dir}/{name}.svg --'", type=str, default=None)
+  args = p.parse_args()
+  if not args.dry_run:
+    instrument.configure(args.trace or os.path.join(args.log_dir, 'trace.jsonl'), args.profile, args.sample_cmd)
+
+  os.makedirs('tok-cache', exist_ok=True)
+  steps = tokenize_steps(args.langs, args.sd, args.num_proc) + clean_steps(args.langs, args.sd, args.mdir)
+  for lang in args.langs:
+    for aligner in args.aligners:
+      steps += align_steps(lang, aligner, args.sd, args.mdir, args.fadir, args.num_proc)
+  if not run_steps(steps, args.cpus, args.log_dir, dry_run=args.dry_run):
+    sys.exit(1)
@@ -10,6 +10,9 @@ DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
 
 MOSES_DIR=$HOME/usr/local/mosesdecoder
 
+# And the number of processes to use for tokenization and alignment
+NUM_PROC=4
+
 # Step 2.
 #   Install spacy and download models
 pip install spacy
@@ -23,45 +26,8 @@ python -m spacy download fr_core_news_sm
 wget http://phontron.com/data/wmt2019-system-data.tar.gz
 tar -xzf wmt2019-system-data.tar.gz
 
-# Tokenize all the files
-for l in en; do
-  for f in wmt2019-system-data/mtnt/*.$l wmt2019-system-data/extra/*/*.$l wmt2019-system-data/outputs/*/*.$l; do
-    echo "python do_tokenize.py en < $f > $f.tok"
-    python do_tokenize.py en < $f > $f.tok &
-  done
-done
-for l in fr; do
-  for f in wmt2019-system-data/mtnt/*.$l wmt2019-system-data/extra/*/*.$l wmt2019-system-data/outputs/*/*.$l; do
-    echo "python do_tokenize.py fr < $f > $f.tok"
-    python do_tokenize.py fr < $f > $f.tok &
-  done
-done
-wait
-for l in ja; do
-  for f in wmt2019-system-data/mtnt/*.$l wmt2019-system-data/extra/*/*.$l wmt2019-system-data/outputs/*/*.$l; do
-    echo "cat $f | sed 's/ /　/g' | kytea -notags > $f.tok"
-    cat $f | sed 's/ /　/g' | kytea -notags > $f.tok &
-  done
-done
-wait
-
-# Clean the big training corpora
-for f in fr ja; do
-  echo "$MOSES_DIR/scripts/training/clean-corpus-n.perl wmt2019-system-data/mtnt/mtnt-train.$f-en $f.tok en.tok wmt2019-system-data/mtnt/mtnt-trainclean.$f-en 1 70 &"
-  $MOSES_DIR/scripts/training/clean-corpus-n.perl wmt2019-system-data/mtnt/mtnt-train.$f-en $f.tok en.tok wmt2019-system-data/mtnt/mtnt-trainclean.$f-en 1 70 &
-  echo "$MOSES_DIR/scripts/training/clean-corpus-n.perl wmt2019-system-data/mtnt/mtnt-train.en-$f $f.tok en.tok wmt2019-system-data/mtnt/mtnt-trainclean.en-$f 1 70 &"
-  $MOSES_DIR/scripts/training/clean-corpus-n.perl wmt2019-system-data/mtnt/mtnt-train.en-$f $f.tok en.tok wmt2019-system-data/mtnt/mtnt-trainclean.en-$f 1 70 &
-  echo "$MOSES_DIR/scripts/training/clean-corpus-n.perl wmt2019-system-data/extra/$f/train $f.tok en.tok wmt2019-system-data/extra/$f/trainclean 1 70 &"
-  $MOSES_DIR/scripts/training/clean-corpus-n.perl wmt2019-system-data/extra/$f/train $f.tok en.tok wmt2019-system-data/extra/$f/trainclean 1 70 &
-done
-wait
-
-mkdir -p alignments
-for f in fr ja; do
-  python $DIR/make_alignments.py $f --aligner fa &> alignments/make-$f.log &
-done
-wait
-for f in fr ja; do
-  python $DIR/make_alignments.py $f --aligner giza &> alignments/make-$f.log &
-done
-wait
+# Tokenize, clean, and align everything
+#   pipeline.py runs the steps in dependency order, as many at once as fit in --cpus,
+#   and skips the ones that are already up to date, so it can simply be rerun after a failure.
+#   The output of each step is written to alignments/logs/STEP.log
+python $DIR/pipeline.py --langs fr ja --aligners fa giza --mdir $MOSES_DIR --num_proc $NUM_PROC
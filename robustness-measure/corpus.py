@@ -0,0 +1,157 @@
+"""Memory-mapped text files and binary arrays for the robustness measure
+
+Text files are memory-mapped and indexed by the byte offset of each line, so
+that their sentences only need to be decoded when they are actually used
+(e.g. to print a few examples), and the number of tokens of every line can
+be computed without decoding them at all. If a tokenized file has a current
+label store (see tagging-scripts/label_store.py), its token counts are read
+from there instead.
+"""
+import os
+import json
+import mmap
+import numpy as np
+
+# The encoded whitespace characters other than ASCII ones (all of them are
+# below U+3001), which str.split() also splits on
+_unicode_spaces = [chr(i).encode("utf-8") for i in range(0x80, 0x3001)
+                   if chr(i).isspace()]
+# ASCII characters that str.split() splits on
+_ascii_spaces = np.zeros(256, dtype=bool)
+_ascii_spaces[[ord(c) for c in map(chr, range(0x80)) if c.isspace()]] = True
+# Files are scanned this many bytes at a time (rounded to whole lines), so
+# that only a block of a file is ever in memory
+_block_size = 1 << 24
+
+
+class LineFile(object):
+    """A text file as a sequence of lines (without trailing whitespace, as
+    they were read by `loadtxt`). Lines end where `open()` ends them, at
+    "\n", "\r\n" or a lone "\r"."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                self.data = b""
+        bytes_ = np.frombuffer(self.data, dtype=np.uint8)
+        # A line ends at the last byte of its newline, which is a "\r" that
+        # is not followed by a "\n" or any "\n" (the "\r" before which is
+        # then stripped like other trailing whitespace)
+        ends = []
+        for start in range(0, len(bytes_), _block_size):
+            block = bytes_[start:start + _block_size]
+            after = bytes_[start + 1:start + _block_size + 1]
+            is_end = block == ord("\r")
+            is_end[:len(after)] &= after != ord("\n")
+            is_end |= block == ord("\n")
+            ends.append(np.flatnonzero(is_end) + start)
+        ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64)
+        # The last line does not need to end with a newline
+        if len(bytes_) and (not len(ends) or ends[-1] != len(bytes_) - 1):
+            ends = np.append(ends, len(bytes_))
+        self.starts = np.r_[0, ends[:-1] + 1].astype(np.int64)
+        self.ends = ends.astype(np.int64)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        line = self.data[self.starts[i]:self.ends[i]]
+        return line.decode("utf-8").rstrip()
+
+    def blocks(self):
+        """Yield (first line, end line, bytes) of blocks of whole lines of
+        about _block_size bytes, which together are the whole file"""
+        bounds = np.searchsorted(
+            self.starts, np.arange(0, len(self.data), _block_size))
+        bounds = np.unique(np.r_[bounds, len(self)])
+        for first, end in zip(bounds[:-1], bounds[1:]):
+            stop = self.starts[end] if end < len(self) else len(self.data)
+            yield first, end, self.data[self.starts[first]:stop]
+
+    def lines(self):
+        """All lines, decoded"""
+        lines = []
+        for first, end, block in self.blocks():
+            text = block.decode("utf-8")
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+            lines += [line.rstrip() for line in text.split("\n")][:end - first]
+        return lines
+
+    def stored_token_counts(self):
+        """The token counts in the label store of the file, or None if it
+        has no (readable) store that was made from its current version"""
+        name = self.filename
+        path = name[:-len(".tok")] if name.endswith(".tok") else name
+        try:
+            with open(path + ".store/source.json", "r") as f:
+                source = json.load(f)
+            st = os.stat(name)
+            if source != {"size": st.st_size, "mtime_ns": st.st_mtime_ns}:
+                return None
+            lengths = np.load(path + ".store/lengths.npy", mmap_mode="r")
+        except (OSError, ValueError):
+            # A missing or damaged store, whose token counts are counted
+            # again instead
+            return None
+        return lengths.astype(np.int64) if len(lengths) == len(self) else None
+
+    def token_counts(self):
+        """Number of whitespace separated tokens of every line (the same as
+        `len(line.split())`)"""
+        stored = self.stored_token_counts()
+        if stored is not None:
+            return stored
+        counts = np.zeros(len(self), dtype=np.int64)
+        for first, end, block in self.blocks():
+            # Unicode whitespace is replaced by (as many) spaces, so that it
+            # can be found byte by byte
+            if not block.isascii():
+                for space in _unicode_spaces:
+                    if space in block:
+                        block = block.replace(space, b" " * len(space))
+            is_space = _ascii_spaces[np.frombuffer(block, dtype=np.uint8)]
+            # A token starts at a non space that follows a space, or at the
+            # start of a line (every line starts after a newline, which is a
+            # space, and so does every block)
+            starts = ~is_space
+            starts[1:] &= is_space[:-1]
+            starts = np.flatnonzero(starts) + self.starts[first]
+            line_of = np.searchsorted(self.ends[first:end], starts)
+            counts[first:end] = np.bincount(line_of, minlength=end - first)
+        return counts
+
+
+class Corpus(object):
+    """Several text files as one sequence of lines"""
+
+    def __init__(self, filenames):
+        self.files = [LineFile(filename) for filename in filenames]
+        self.offsets = np.cumsum([0] + [len(f) for f in self.files])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, i):
+        file_idx = np.searchsorted(self.offsets, i, side="right") - 1
+        return self.files[file_idx][i - self.offsets[file_idx]]
+
+    def origin(self):
+        """Index of the file of every line"""
+        return np.repeat(np.arange(len(self.files)), np.diff(self.offsets))
+
+    def token_counts(self):
+        return np.concatenate([f.token_counts() for f in self.files])
+
+
+def load_floats(filename):
+    """One number per line of a text file (or the array in a .npy file) as a
+    float array"""
+    if filename.endswith(".npy"):
+        return np.load(filename, mmap_mode="r").astype(np.float64)
+    with open(filename, "rb") as f:
+        return np.asarray(f.read().split(), dtype=np.float64)
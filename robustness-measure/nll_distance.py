@@ -0,0 +1,330 @@
+"""Distances of source sentences as their NLL under an n-gram language model
+
+Trains an interpolated Kneser-Ney n-gram language model on the (clean)
+training side, and writes the negative log-likelihood of every line of the
+given files under it, divided by its number of tokens (plus one for the end
+of the sentence), to `FILE.normed_nll.npy` (and `FILE.normed_nll` as text
+with `--text`), which can be given to `plot_score_vs_dist.py` with `--dists`.
+
+```bash
+python nll_distance.py --train train.en --order 3 --num-proc 8 \
+    wmt.valid.en wmt.test.en mtnt.test.en-fr.en
+```
+
+Sentences are split on whitespace, so the training data and the sources
+should be tokenized in the same way. The model is cached in `--lm-cache`
+(by the content of the training data and the order), and the distances of
+every file in `--score-cache` (by the content of the file and of the
+training data), so running this again only computes what has changed.
+"""
+import argparse
+import multiprocessing
+import os.path
+import numpy as np
+from corpus import LineFile
+from score_cache import ScoreCache, content_hash
+
+BOS, UNK, EOS = 0, 1, 2
+SPECIALS = ["<s>", "<unk>", "</s>"]
+# Change this whenever the model or the distances would change
+VERSION = 1
+
+
+def _unique_counts(keys, counts=None):
+    """Unique keys (sorted) and the sums of their counts"""
+    order = np.argsort(keys)
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[len(keys) > 0, keys[1:] != keys[:-1]])
+    if counts is None:
+        sums = np.diff(np.r_[starts, len(keys)])
+    else:
+        sums = np.add.reduceat(counts[order], starts) if len(starts) else \
+            np.zeros(0, dtype=np.int64)
+    return keys[starts], sums
+
+
+def _discount(counts):
+    """Kneser-Ney discount D = n1 / (n1 + 2 n2)"""
+    n1, n2 = (counts == 1).sum(), (counts == 2).sum()
+    return n1 / (n1 + 2 * n2) if n1 + n2 > 0 else 0.5
+
+
+def _ngram_keys(ids, lens, order, vocab_size):
+    """Keys of the n-grams ending at every token (and at the end of every
+    sentence) of sentences padded with `order - 1` <s>
+
+    Returns:
+        The keys of the n-grams of every order (from 1 to `order`), and the
+        sentence of each predicted token
+    """
+    padded_lens = lens + order
+    # Sentences are written one after the other as <s>...<s> tokens </s>
+    tokens = np.full(padded_lens.sum(), BOS, dtype=np.int64)
+    starts = np.cumsum(padded_lens) - padded_lens
+    # Positions of the predicted tokens (the words and </s>)
+    n_predicted = lens + 1
+    sent_of = np.repeat(np.arange(len(lens)), n_predicted)
+    within = np.arange(len(sent_of)) - np.repeat(
+        np.cumsum(n_predicted) - n_predicted, n_predicted)
+    positions = np.repeat(starts + order - 1, n_predicted) + within
+    is_eos = np.zeros(len(sent_of), dtype=bool)
+    is_eos[np.cumsum(n_predicted) - 1] = True
+    tokens[positions[~is_eos]] = ids
+    tokens[positions[is_eos]] = EOS
+    keys = []
+    key = np.zeros(len(positions), dtype=np.int64)
+    for n in range(order):
+        # Extend the (n)-gram keys to the left by one token
+        key = key + tokens[positions - n] * vocab_size ** n
+        keys.append(key.copy())
+    return keys, sent_of
+
+
+class NgramLM(object):
+    """Interpolated Kneser-Ney n-gram language model stored in sorted arrays
+    of integer n-gram keys (each n-gram is the number written by its token
+    IDs in base `vocab_size`)"""
+
+    def __init__(self, vocab, order, tables):
+        self.vocab = vocab
+        self.index = {w: i for i, w in enumerate(vocab)}
+        self.order = order
+        self.tables = tables
+
+    @classmethod
+    def train(cls, filename, order=3, chunk_lines=100000):
+        """Count the n-grams of a (tokenized) file, a chunk of lines at a
+        time, and estimate the model from them"""
+        lines = LineFile(filename)
+        index = {w: i for i, w in enumerate(SPECIALS)}
+        # The keys depend on the size of the vocabulary, so only the token
+        # IDs of every chunk are kept until all of them have been read
+        chunks = []
+        for begin in range(0, len(lines), chunk_lines):
+            end = min(begin + chunk_lines, len(lines))
+            sents = [lines[i].split() for i in range(begin, end)]
+            lens = np.fromiter((len(s) for s in sents), dtype=np.int64,
+                               count=len(sents))
+            ids = np.fromiter((index.setdefault(w, len(index))
+                               for s in sents for w in s),
+                              dtype=np.int64, count=int(lens.sum()))
+            chunks.append((ids, lens))
+        vocab_size = len(index)
+        if float(vocab_size) ** order >= 2 ** 63:
+            raise ValueError(f"The vocabulary is too large for order {order}")
+        # Count the highest order n-grams of every chunk and merge them
+        chunk_keys, chunk_counts = [], []
+        for ids, lens in chunks:
+            keys, _ = _ngram_keys(ids, lens, order, vocab_size)
+            keys, counts = _unique_counts(keys[-1])
+            chunk_keys.append(keys)
+            chunk_counts.append(counts)
+        top_keys, top_counts = _unique_counts(np.concatenate(chunk_keys),
+                                              np.concatenate(chunk_counts))
+        vocab = sorted(index, key=index.get)
+        return cls(vocab, order, cls.estimate(top_keys, top_counts, order,
+                                              vocab_size))
+
+    @staticmethod
+    def estimate(top_keys, top_counts, order, vocab_size):
+        """Arrays of the model from the counts of the highest order n-grams.
+        Every lower order n-gram is the suffix of a highest order one (as
+        sentences start with order - 1 <s>), and its count is its number of
+        distinct left extensions."""
+        tables = {}
+        keys, counts = top_keys, top_counts
+        for n in range(order, 0, -1):
+            table = {"keys": keys, "counts": counts,
+                     "discount": np.float64(_discount(counts))}
+            if n > 1:
+                # Total count and number of distinct next tokens of every
+                # history
+                hist, total = _unique_counts(keys // vocab_size, counts)
+                _, types = _unique_counts(keys // vocab_size)
+                table.update(hist_keys=hist, hist_total=total,
+                             hist_types=types)
+                # Continuation counts of the suffixes
+                keys, counts = _unique_counts(keys % vocab_size ** (n - 1))
+            tables[n] = table
+        return tables
+
+    def save(self, filename):
+        arrays = {"order": np.int64(self.order),
+                  "vocab": np.frombuffer("\n".join(self.vocab)
+                                         .encode("utf-8"), dtype=np.uint8)}
+        for n, table in self.tables.items():
+            for name, array in table.items():
+                arrays[f"{n}_{name}"] = array
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            order = int(data["order"])
+            vocab = data["vocab"].tobytes().decode("utf-8").split("\n")
+            tables = {n: {} for n in range(1, order + 1)}
+            for name in data.files:
+                if name[0].isdigit():
+                    n, key = name.split("_", 1)
+                    tables[int(n)][key] = data[name]
+        return cls(vocab, order, tables)
+
+    def _lookup(self, keys, values, query):
+        """values[i] where keys[i] == query, and 0 where there is none"""
+        if not len(keys):
+            return np.zeros(len(query), dtype=values.dtype)
+        idx = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+        return np.where(keys[idx] == query, values[idx], 0)
+
+    def log_probs(self, ids, lens):
+        """Natural log probabilities of every token and </s> of sentences
+        (given as their token IDs one after the other and their lengths),
+        and the sentence of each of them"""
+        vocab_size = len(self.vocab)
+        keys, sent_of = _ngram_keys(ids, lens, self.order, vocab_size)
+        # Unigrams, interpolated with the uniform distribution
+        uni = self.tables[1]
+        d = uni["discount"]
+        total = max(uni["counts"].sum(), 1)
+        counts = self._lookup(uni["keys"], uni["counts"], keys[0])
+        prob = (np.maximum(counts - d, 0) / total
+                + d * len(uni["keys"]) / total / vocab_size)
+        for n in range(2, self.order + 1):
+            table = self.tables[n]
+            d = table["discount"]
+            hist = keys[n-1] // vocab_size
+            hist_total = self._lookup(table["hist_keys"], table["hist_total"],
+                                      hist)
+            hist_types = self._lookup(table["hist_keys"], table["hist_types"],
+                                      hist)
+            counts = self._lookup(table["keys"], table["counts"], keys[n-1])
+            seen = hist_total > 0
+            denom = np.maximum(hist_total, 1)
+            prob = np.where(
+                seen,
+                np.maximum(counts - d, 0) / denom
+                + d * hist_types / denom * prob,
+                prob,
+            )
+        return np.log(prob), sent_of
+
+    def token_ids(self, lines):
+        tokens = [line.split() for line in lines]
+        lens = np.fromiter((len(t) for t in tokens), dtype=np.int64,
+                           count=len(tokens))
+        ids = np.fromiter((self.index.get(w, UNK) for t in tokens for w in t),
+                          dtype=np.int64, count=int(lens.sum()))
+        return ids, lens
+
+    def normed_nll(self, lines):
+        """NLL of every line divided by its number of tokens plus one"""
+        ids, lens = self.token_ids(lines)
+        log_probs, sent_of = self.log_probs(ids, lens)
+        nll = -np.bincount(sent_of, weights=log_probs, minlength=len(lens))
+        return nll / (lens + 1)
+
+
+# The model and the file that a worker process scores
+_worker = {}
+
+
+def _init_worker(model_file, filename):
+    _worker["lm"] = NgramLM.load(model_file)
+    _worker["lines"] = LineFile(filename)
+
+
+def _score_batch(batch):
+    begin, end = batch
+    lines = _worker["lines"]
+    return begin, _worker["lm"].normed_nll([lines[i]
+                                            for i in range(begin, end)])
+
+
+def train_or_load(train_file, order, lm_cache):
+    """The model trained on `train_file`, from the cache if it is there, and
+    the file it is saved in"""
+    key = f"{content_hash(train_file)}.{order}gram.v{VERSION}"
+    model_file = os.path.join(lm_cache, f"{key}.npz")
+    if os.path.isfile(model_file):
+        print(f"Loading the model from {model_file}")
+        return NgramLM.load(model_file), model_file
+    print(f"Training a {order}-gram model on {train_file}")
+    lm = NgramLM.train(train_file, order)
+    os.makedirs(lm_cache, exist_ok=True)
+    lm.save(model_file)
+    return lm, model_file
+
+
+def file_normed_nll(filename, model_file, batch_lines=50000, num_proc=1):
+    """Normalized NLL of every line of a file, scored in batches of lines by
+    `num_proc` processes"""
+    n_lines = len(LineFile(filename))
+    batches = [(b, min(b + batch_lines, n_lines))
+               for b in range(0, n_lines, batch_lines)]
+    nll = np.zeros(n_lines)
+    if num_proc > 1:
+        with multiprocessing.Pool(num_proc, _init_worker,
+                                  (model_file, filename)) as pool:
+            for begin, values in pool.imap_unordered(_score_batch, batches):
+                nll[begin:begin+len(values)] = values
+    else:
+        _init_worker(model_file, filename)
+        for batch in batches:
+            begin, values = _score_batch(batch)
+            nll[begin:begin+len(values)] = values
+    return nll
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", metavar="FILES", nargs="+",
+                        help="Source sentences to compute the distances of")
+    parser.add_argument("--train", type=str, required=True,
+                        help="Training data of the language model")
+    parser.add_argument("--order", type=int, default=3,
+                        help="Order of the language model")
+    parser.add_argument("--num-proc", type=int, default=1,
+                        help="Number of processes to score with")
+    parser.add_argument("--batch-lines", type=int, default=50000,
+                        help="Number of lines scored at a time")
+    parser.add_argument("--lm-cache", type=str, default="lm-cache",
+                        help="Directory in which trained models are cached")
+    parser.add_argument("--score-cache", type=str, default="score-cache",
+                        help="Directory in which distances are cached, "
+                        "empty to always compute them")
+    parser.add_argument("--text", action="store_true",
+                        help="Also write FILE.normed_nll as text")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    cache = ScoreCache(args.score_cache) if args.score_cache else None
+    settings = {"version": VERSION, "order": args.order}
+    model_file = None
+    for filename in args.files:
+        nll = None
+        if cache is not None:
+            # The distances of a file depend on it and on the training data
+            key = cache.key(filename, args.train, "normed_nll", settings)
+            nll = cache.get(key, len(LineFile(filename)))
+        if nll is None:
+            # The model is only needed once a file is not in the cache
+            if model_file is None:
+                _, model_file = train_or_load(args.train, args.order,
+                                              args.lm_cache)
+            nll = file_normed_nll(filename, model_file, args.batch_lines,
+                                  args.num_proc)
+            if cache is not None:
+                cache.put(key, nll)
+        np.save(f"{filename}.normed_nll.npy", nll)
+        if args.text:
+            np.savetxt(f"{filename}.normed_nll", nll)
+        print(f"{filename}: mean normalized NLL {nll.mean():.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,28 @@
 from scipy.stats import pearsonr
 import argparse
+import json
+import multiprocessing
 import os.path
-from sacrebleu import sentence_bleu, sentence_chrf
 import numpy as np
+from sentence_scores import multi_system_scores, check_parity
+from sentence_scores import batch_score_funcs, score_settings
+from score_cache import ScoreCache
+from corpus import LineFile, Corpus, load_floats
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt  # noqa
 
 
-def loadtxt(filename):
-    """Load text file"""
-    txt = []
-    with open(filename) as f:
-        for line in f:
-            txt.append(line.rstrip())
-    return np.asarray(txt)
+def parse_bs_resampling(bs_resampling):
+    """Parse "[N_samples]x[sample_size]" """
+    n_samples, sample_size = bs_resampling.split("x")
+    return int(n_samples), int(sample_size)
 
 
 def rescale(x):
     return (x - x.min())/(x.max() - x.min())
 
 
-def flatten_lists(list_of_lists):
-    return [element for l in list_of_lists for element in l]
-
-
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--refs", metavar="REFS", nargs="+",
@@ -46,11 +44,53 @@ def get_args():
     parser.add_argument("--bs-resampling", type=str, default=None,
                         help="[N_samples]x[sample_size] for bootstrap "
                         "resampling within each bin")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed for bootstrap resampling")
     parser.add_argument("--min-len", type=int, default=1,
                         help="Minimum sentence length")
+    parser.add_argument("--num-proc", type=int, default=1,
+                        help="Number of processes to compute the scores of "
+                        "very large files with")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="Check a sample of the computed scores against "
+                        "sacrebleu")
+    parser.add_argument("--score-cache", type=str, default="score-cache",
+                        help="Directory in which computed scores are cached "
+                        "(by the content of the output and reference files), "
+                        "empty to always compute them")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="JSON file with a list of experiments to plot "
+                        "(instead of the files given on the command line), "
+                        "see the README")
+    parser.add_argument("--preview", action="store_true",
+                        help="Render quick, low resolution figures")
+    parser.add_argument("--system", metavar=("NAME", "OUTS"), nargs="+",
+                        action="append", dest="systems",
+                        help="Name and outputs (one per reference file) of a "
+                        "system to compare, instead of --outs (can be given "
+                        "many times)")
+    parser.add_argument("--bs-significance", type=int, default=1000,
+                        help="Number of samples for the paired bootstrap "
+                        "comparison of systems")
     # Parse
     args = parser.parse_args()
+    if args.bs_resampling is not None:
+        args.bs_resampling = parse_bs_resampling(args.bs_resampling)
+    if args.manifest is not None:
+        return args
     # Check number of files
+    if args.refs is None or args.srcs is None or args.dists is None or \
+            (args.outs is None and args.systems is None):
+        parser.error("Specify --srcs, --refs, --outs (or --system) and "
+                     "--dists, or --manifest")
+    if args.systems is not None:
+        if args.scores is not None:
+            parser.error("--scores can not be given with --system, whose "
+                         "scores are always computed (or cached)")
+        if any(len(outs) != len(args.refs) + 1 for outs in args.systems):
+            raise ValueError("Specify one output file per reference file for "
+                             "every system")
+        args.outs = args.systems[0][1:]
     N = len(args.refs)
     if N != len(args.outs) or N != len(args.outs) or N != len(args.dists):
         raise ValueError("Specify the same number of input files of each type")
@@ -60,56 +100,89 @@ def get_args():
     return args
 
 
-def sentbleu(y_hat, y):
-    return sentence_bleu(y_hat, y, smooth_method="add-n", smooth_value=1.0)
-
+def grouped_percentiles(values, lengths, percents):
+    """Percentiles of consecutive groups of values at once
 
-def sentchrf(y_hat, y):
-    return sentence_chrf(y_hat, y)*100
+    Args:
+        values: Values of all groups, sorted within each group
+        lengths: Number of values in each group (none of them empty)
+        percents: Percentiles to compute
 
+    Returns:
+        Array of shape (number of groups, number of percents), the same as
+        `np.percentile` (with linear interpolation) of each group
+    """
+    starts = np.cumsum(lengths) - lengths
+    # Position of each percentile within its group
+    pos = np.asarray(percents)[None, :] / 100 * (lengths[:, None] - 1)
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, lengths[:, None] - 1)
+    t = pos - lower
+    a = values[starts[:, None] + lower]
+    b = values[starts[:, None] + upper]
+    # Same interpolation as numpy, which is more accurate from the closer end
+    return np.where(t >= 0.5, b - (b - a) * (1 - t), a + (b - a) * t)
 
-score_funcs = {"sentbleu": sentbleu, "chrf": sentchrf}
 
+def bin_percentiles(x, y, n_bins, percents, bs_resampling=None, seed=None):
+    """Cut the x axis into `n_bins` bins and compute the percentiles of the y
+    values in each (non empty) bin, or of the means of `n` bootstrap samples
+    of `k` of them if `bs_resampling=(n, k)`
 
-def percentiles_plot(x, y, n_bins, percent_increment=10, bs_resampling=None):
-    # All percentiles in increments of 10 by default
-    percents = list(range(0, 101, percent_increment))
-    if not 50 % percent_increment == 0:
-        percents = sorted(list(set(percents) + {50}))
-    # cut the x axis into n_bins bins
-    N = len(x)
+    Returns:
+        The indices of the non empty bins, their sizes, the average x of each
+        and the percentiles (of shape (number of bins, number of percents))
+    """
     # Threshold for the bins (uniformly partintioning the x axis)
     bin_thesholds = np.linspace(0, x.max(), n_bins+1)
     # Assign each point to a bin
     bin_assignments = np.digitize(x, bin_thesholds)
-    # Bins as a list of indices mapping each bin to the indices it contains
-    idxs = np.arange(N)
-    bins = [idxs[bin_assignments == bin_idx]
-            for bin_idx in range(n_bins) if (bin_assignments == bin_idx).any()]
-    # Size of bins and their widths
-    bin_sizes = np.asarray([len(bin_) for bin_ in bins])
-    # y values of each bin
-    binned_y = [y[bin_] for bin_ in bins]
-    # Do BS resampling if needed
-    if bs_resampling is not None:
+    # Group the points by bin (keeping their order within bins)
+    order = np.argsort(bin_assignments, kind="stable")
+    counts = np.bincount(bin_assignments, minlength=n_bins+2)
+    bin_idxs = np.flatnonzero(counts[:n_bins])
+    # Size of bins, and the points of each of them in `order`
+    bin_sizes = counts[bin_idxs]
+    bin_starts = np.cumsum(counts)[bin_idxs] - bin_sizes
+    bin_of = np.repeat(np.arange(len(bin_idxs)), bin_sizes)
+    # (the bins in range(n_bins) come first)
+    in_bins = order[:bin_sizes.sum()]
+    # Avg x value of each bin
+    avg_x = np.bincount(bin_of, weights=x[in_bins]) / bin_sizes
+    if bs_resampling is None:
+        # Sort the y values of each bin
+        binned_y = y[in_bins]
+        binned_y = binned_y[np.lexsort((binned_y, bin_of))]
+        lengths = bin_sizes
+    else:
+        # Means of n samples of size k of each bin (or n times the mean of
+        # the bin if it is smaller than k)
         n, k = bs_resampling
-        for i, bin_y in enumerate(binned_y):
-            if k > len(bin_y):
-                binned_y[i] = [bin_y.mean() for _ in range(n)]
+        rng = np.random.default_rng(seed)
+        binned_y = np.empty((len(bin_idxs), n))
+        for i, (start, size) in enumerate(zip(bin_starts, bin_sizes)):
+            bin_y = y[order[start:start+size]]
+            if k > size:
+                binned_y[i] = bin_y.mean()
             else:
-                binned_y[i] = [np.random.choice(bin_y, size=k).mean()
-                               for _ in range(n)]
-    # Avg x value of each bin
-    avg_x = np.stack([x[bin_].mean() for bin_ in bins])
-    # Compute percentiles
-    all_percentiles = np.asarray([
-        [np.percentile(bleu, percent) for percent in percents]
-        for bleu in binned_y
-    ])
+                binned_y[i] = bin_y[rng.integers(size, size=(n, k))].mean(1)
+        binned_y = np.sort(binned_y, axis=1).ravel()
+        lengths = np.full(len(bin_idxs), n)
+    all_percentiles = grouped_percentiles(binned_y, lengths, percents)
+    return bin_idxs, bin_sizes, avg_x, all_percentiles
+
+
+def percentiles_plot(x, y, n_bins, percent_increment=10, bs_resampling=None,
+                     seed=None):
+    # All percentiles in increments of 10 by default
+    percents = list(range(0, 101, percent_increment))
+    if not 50 % percent_increment == 0:
+        percents = sorted(set(percents) | {50})
+    bin_idxs, bin_sizes, avg_x, all_percentiles = bin_percentiles(
+        x, y, n_bins, percents, bs_resampling, seed)
     # Find the best position to print the label of each percentile
     # (by min-maxing the distance between each consecutive percentile)
-    best_pos = np.argmax([np.min(percentiles[1:] - percentiles[:-1]).mean()
-                          for percentiles in all_percentiles])
+    best_pos = np.argmax(np.diff(all_percentiles, axis=1).min(axis=1))
     # Map percent value to percentiles
     all_percentiles = {percent: all_percentiles[:, i]
                        for i, percent in enumerate(percents)}
@@ -139,10 +212,8 @@ def percentiles_plot(x, y, n_bins, percent_increment=10, bs_resampling=None):
     # (*9 is there for scale)
     bin_distrib = bin_sizes/bin_sizes.max()*9
     # Position and width of the bars
-    bin_centers = [
-        (bin_thesholds[bin_idx+1] + bin_thesholds[bin_idx])/2
-        for bin_idx in range(n_bins) if (bin_assignments == bin_idx).any()
-    ]
+    bin_thesholds = np.linspace(0, x.max(), n_bins+1)
+    bin_centers = (bin_thesholds[bin_idxs+1] + bin_thesholds[bin_idxs])/2
     bar_width = bin_thesholds[1] - bin_thesholds[0]
     # Vertical position
     bar_y = int(min(min(v) for v in all_percentiles.values())/10) * 10
@@ -152,93 +223,150 @@ def percentiles_plot(x, y, n_bins, percent_increment=10, bs_resampling=None):
     plt.legend()
 
 
-def main():
-    args = get_args()
-    # Load files
-    refs = [loadtxt(filename) for filename in args.refs]
-    outs = [loadtxt(filename) for filename in args.outs]
-    srcs = [loadtxt(filename) for filename in args.srcs]
+def compute_system_scores(systems, refs, score_type, cache=None, num_proc=1,
+                          check=False, save_text=False):
+    """Scores of every sentence of the output files of several systems (one
+    list of files per system, with one file per reference file) against the
+    reference files, of shape (number of systems, number of sentences).
+    Scores are taken from the cache if they are there, and the systems that
+    are not are scored together, so that each reference file is only
+    tokenized once. With `save_text`, scores that are computed (and not
+    taken from the cache) are also saved as text to REF.SCORE_TYPE, to be
+    given with `--scores` (which only makes sense for a single system)."""
+    if score_type not in batch_score_funcs:
+        raise ValueError(
+            f"On-the-fly {score_type} computation is not supported, "
+            "please precompute the scores yourself and provide them with "
+            "`--scores [FILES]`"
+        )
+    settings = score_settings[score_type]
+    scores = []
+    for i, ref_file in enumerate(refs):
+        ref = LineFile(ref_file)
+        file_scores = np.zeros((len(systems), len(ref)))
+        todo, keys = [], {}
+        for j, outs in enumerate(systems):
+            if cache is not None:
+                keys[j] = cache.key(outs[i], ref_file, score_type, settings)
+                score = cache.get(keys[j], len(ref))
+                if score is not None:
+                    print(f"Loaded {score_type} of {outs[i]} from "
+                          f"{cache.path(keys[j])}")
+                    file_scores[j] = score
+                    continue
+            todo.append(j)
+        if todo:
+            ref = ref.lines()
+            outs = [LineFile(systems[j][i]).lines() for j in todo]
+            file_scores[todo] = multi_system_scores(outs, ref, score_type,
+                                                    num_proc)
+            for j, out in zip(todo, outs):
+                if check:
+                    check_parity(out, ref, score_type, file_scores[j])
+                if cache is not None:
+                    cache.put(keys[j], file_scores[j])
+                if save_text:
+                    save_scores(f"{ref_file}.{score_type}", file_scores[j])
+        scores.append(file_scores)
+    return np.concatenate(scores, axis=1)
+
+
+def save_scores(fname, scores):
+    """Save the scores of the sentences of one file as text"""
+    if os.path.isfile(fname):
+        print(f"WARNING: {fname} already exists, overwriting")
+    np.savetxt(fname, scores)
+
+
+def compute_scores(outs, refs, score_type, cache=None, num_proc=1,
+                   check=False):
+    """Scores of every sentence of the output files against the reference
+    files, taken from the cache if they are there (and saved as text if they
+    are not)"""
+    return compute_system_scores([outs], refs, score_type, cache, num_proc,
+                                 check, save_text=True)[0]
+
+
+def load_experiment(srcs, refs, outs, dists, score_types, scores=None,
+                    min_len=1, cache=None, num_proc=1, check=False):
+    """Load (or compute) the distances and the scores of every type for one
+    set of files, keeping only the sentences with at least `min_len` tokens
+
+    Returns:
+        The sources, the indices of the sentences that are kept, the file of
+        each of them, their distances, and their scores by score type
+    """
+    # Load files (the sentences are only decoded when they are needed)
+    srcs = Corpus(srcs)
     # Keep track of sentence origin
-    origin = np.asarray([i for i, ref in enumerate(refs) for sent in ref])
-    # Flatten
-    refs = np.asarray(flatten_lists(refs))
-    outs = np.asarray(flatten_lists(outs))
-    srcs = np.asarray(flatten_lists(srcs))
-    dists = np.concatenate([np.loadtxt(fname) for fname in args.dists])
-    # Load or compute scores
-    if args.scores is not None:
-        scores = np.concatenate([np.loadtxt(fname) for fname in args.scores])
-    else:
-        if args.score_type not in score_funcs:
-            raise ValueError(
-                f"On-the-fly {args.score_type} computation is not supported, "
-                "please precompute the scores yourself and provide them with "
-                "`--scores [FILES]`"
-            )
-        # Compute scores on the fly for those that are supported
-        score_func = score_funcs[args.score_type]
-        scores = [
-            np.asarray([score_func(y_hat, y) for y_hat, y in zip(out, ref)])
-            for out, ref in zip(outs, refs)
-        ]
-        # Save precomputed scores
-        for score, ref_file in zip(scores, args.refs):
-            if os.path.isfile(f"{ref_file}.{args.score_type}"):
-                print(
-                    f"WARNING: {ref_file}.{args.score_type} already exists, "
-                    "not overwriting"
-                )
-            np.savetxt(f"{ref_file}.{args.score_type}", score)
-        scores = np.concatenate(scores)
-    # Parse BS resampling argument
-    if args.bs_resampling is not None:
-        n_samples, sample_size = args.bs_resampling.split("x")
-        args.bs_resampling = (int(n_samples), int(sample_size))
+    origin = srcs.origin()
+    dists = np.concatenate([load_floats(fname) for fname in dists])
+    # Load or compute scores (precomputed scores are given by score type)
+    scores = dict(scores or {})
+    all_scores = {}
+    for score_type in score_types:
+        if score_type in scores:
+            all_scores[score_type] = np.concatenate(
+                [load_floats(fname) for fname in scores[score_type]])
+        else:
+            all_scores[score_type] = compute_scores(outs, refs, score_type,
+                                                    cache, num_proc, check)
     # Filter by minimum length
-    long_enough = [len(sent.split()) >= args.min_len for sent in srcs]
-    srcs = srcs[long_enough]
-    refs = refs[long_enough]
-    outs = outs[long_enough]
-    dists = dists[long_enough]
-    scores = scores[long_enough]
-    origin = origin[long_enough]
+    long_enough = np.flatnonzero(srcs.token_counts() >= min_len)
+    return (
+        srcs,
+        long_enough,
+        origin[long_enough],
+        dists[long_enough],
+        {k: v[long_enough] for k, v in all_scores.items()},
+    )
+
+
+def render_figure(job):
+    """Plot scores against distances and save the figure"""
+    (dists, scores, origin, names, score_type, filename, bs_resampling, seed,
+     preview) = job
     # Figure
     plt.figure(figsize=(7, 8))
     # Pearson correclation as titles
     corr_, p_val = pearsonr(scores, dists)
     plt.suptitle(
-        f"{args.score_type} vs NLL\n"
+        f"{score_type} vs NLL\n"
         f"Pearson r: {corr_:.3f} ($p\\approx{p_val:.3f}$))"
     )
     # Scatter plot of the test samples (by datasets)
-    plt.subplot("211")
+    plt.subplot(211)
     # Colors for plotting
-    color_spectrum = np.linspace(0.1, 0.9, len(args.refs))
+    color_spectrum = np.linspace(0.1, 0.9, len(names))
+    # (rasterized in previews, which is much faster with many points)
     plt.scatter(dists, scores, s=0.5, c=color_spectrum[origin],
-                marker="+", alpha=0.9, cmap="jet")
+                marker="+", alpha=0.9, cmap="jet", rasterized=preview)
     # Make a good legend
     cmap = plt.get_cmap("jet")
-    print([color_spectrum[i] for i in set(origin)])
     legend_elements = [
         matplotlib.lines.Line2D([0], [0], marker='+', markersize=10,
                                 color=cmap(color_spectrum[i]), linewidth=0)
         for i in set(origin)
     ]
-    plt.legend(legend_elements, args.srcs)
+    plt.legend(legend_elements, names)
     plt.xlabel("NLL")
-    plt.ylabel(args.score_type)
+    plt.ylabel(score_type)
     # Binned percentiles
-    plt.subplot("212")
+    plt.subplot(212)
     # Plot binned percentages
     percentiles_plot(dists, scores, 20, percent_increment=10,
-                     bs_resampling=args.bs_resampling)
+                     bs_resampling=bs_resampling, seed=seed)
     # Axes labels
     plt.xlabel("NLL")
-    plt.ylabel(args.score_type)
+    plt.ylabel(score_type)
     # Save figure
-    score_name = (args.score_type).replace(" ", "_")
-    plt.savefig(f"{score_name}_vs_nll.png", bbox_inches="tight", dpi=300)
-    # Print extremal elements
+    plt.savefig(filename, bbox_inches="tight", dpi=72 if preview else 300)
+    plt.close()
+    return filename
+
+
+def print_extremes(srcs, long_enough, dists, scores):
+    """Print the source sentences in the corners of the plot"""
     # We take the max/min of the sum/difference of the rescaled scores and
     # distances
     sum_ = rescale(dists) + rescale(scores)
@@ -249,19 +377,150 @@ def main():
     # Lower left
     print("==== Lowest BLEU, lowest distance ====")
     for i in sum_order[:n_examples]:
-        print(srcs[i])
+        print(srcs[long_enough[i]])
     # Upper left
     print("==== Highest BLEU, lowest distance ====")
     for i in diff_order[:n_examples]:
-        print(srcs[i])
+        print(srcs[long_enough[i]])
     # Lower right
     print("==== Lowest BLEU, highest distance ====")
     for i in diff_order[-n_examples:]:
-        print(srcs[i])
+        print(srcs[long_enough[i]])
     # Upper right
     print("==== Highest BLEU, highest distance ====")
     for i in sum_order[-n_examples:]:
-        print(srcs[i])
+        print(srcs[long_enough[i]])
+
+
+def paired_bootstrap(scores, n_samples=1000, seed=None, batch_size=100):
+    """Paired bootstrap resampling of the mean scores of several systems (of
+    shape (number of systems, number of sentences)), with the same samples of
+    sentences for all systems
+
+    Returns:
+        The fraction of samples in which the mean score of system i is higher
+        than that of system j, for every pair (i, j)
+    """
+    n_systems, n_sents = scores.shape
+    rng = np.random.default_rng(seed)
+    means = np.empty((n_systems, n_samples))
+    for begin in range(0, n_samples, batch_size):
+        end = min(begin + batch_size, n_samples)
+        # How many times each sentence is drawn in each sample
+        weights = rng.multinomial(n_sents, np.full(n_sents, 1 / n_sents),
+                                  size=end - begin)
+        means[:, begin:end] = scores @ weights.T / n_sents
+    return (means[:, None, :] > means[None, :, :]).mean(axis=2)
+
+
+def render_systems_figure(job):
+    """Plot the binned median (and quartiles) of the scores of several
+    systems against the distances, in one figure"""
+    (dists, scores, names, score_type, filename, bs_resampling, seed,
+     preview) = job
+    plt.figure(figsize=(7, 5))
+    cmap = plt.get_cmap("jet")
+    colors = np.linspace(0.1, 0.9, len(names))
+    percents = [25, 50, 75]
+    for name, system_scores, color in zip(names, scores, colors):
+        corr_, _ = pearsonr(system_scores, dists)
+        _, _, avg_x, percentiles = bin_percentiles(
+            dists, system_scores, 20, percents, bs_resampling, seed)
+        plt.fill_between(avg_x, percentiles[:, 0], percentiles[:, 2],
+                         color=cmap(color), alpha=0.15, linewidth=0)
+        plt.plot(avg_x, percentiles[:, 1], color=cmap(color),
+                 label=f"{name} (Pearson r: {corr_:.3f})")
+    plt.title(f"{score_type} vs NLL (median and quartiles)")
+    plt.xlabel("NLL")
+    plt.ylabel(score_type)
+    plt.legend()
+    plt.savefig(filename, bbox_inches="tight", dpi=72 if preview else 300)
+    plt.close()
+    return filename
+
+
+def compare_systems(args):
+    """Score all systems against the same references, plot their curves in
+    one figure and print their paired bootstrap comparison"""
+    cache = ScoreCache(args.score_cache) if args.score_cache else None
+    names = [system[0] for system in args.systems]
+    srcs = Corpus(args.srcs)
+    dists = np.concatenate([load_floats(fname) for fname in args.dists])
+    scores = compute_system_scores([system[1:] for system in args.systems],
+                                   args.refs, args.score_type, cache,
+                                   args.num_proc, args.check_parity)
+    # Filter by minimum length
+    long_enough = np.flatnonzero(srcs.token_counts() >= args.min_len)
+    dists, scores = dists[long_enough], scores[:, long_enough]
+    filename = (f"{args.img_prefix}"
+                f"{figure_name(args.score_type)[:-len('.png')]}.systems.png")
+    render_systems_figure((dists, scores, names, args.score_type, filename,
+                           args.bs_resampling, args.seed, args.preview))
+    print(f"Saved {filename}")
+    wins = paired_bootstrap(scores, args.bs_significance, args.seed)
+    width = max([6] + [len(name) for name in names])
+    print(f"{'system':{width}s}  {args.score_type:>8s}  pearson_r")
+    for name, system_scores in zip(names, scores):
+        corr_, _ = pearsonr(system_scores, dists)
+        print(f"{name:{width}s}  {system_scores.mean():8.3f}  {corr_:9.3f}")
+    print(f"==== Paired bootstrap ({args.bs_significance} samples): "
+          "fraction of samples in which the row system is better ====")
+    print(" " * width + "".join(f"  {name:>{width}s}" for name in names))
+    for name, row in zip(names, wins):
+        print(f"{name:{width}s}" +
+              "".join(f"  {win:{width}.3f}" for win in row))
+
+
+def figure_name(score_type):
+    return f"{score_type.replace(' ', '_')}_vs_nll.png"
+
+
+def run_manifest(args):
+    """Load and score every experiment of the manifest once, and render all
+    of their figures in parallel"""
+    with open(args.manifest) as f:
+        experiments = json.load(f)
+    cache = ScoreCache(args.score_cache) if args.score_cache else None
+    jobs = []
+    for exp in experiments:
+        score_types = exp.get("score_types") or [args.score_type]
+        bs_resampling = exp.get("bs_resampling", args.bs_resampling)
+        if isinstance(bs_resampling, str):
+            bs_resampling = parse_bs_resampling(bs_resampling)
+        _, _, origin, dists, scores = load_experiment(
+            exp["srcs"], exp["refs"], exp["outs"], exp["dists"], score_types,
+            exp.get("scores"), exp.get("min_len", args.min_len), cache,
+            args.num_proc, args.check_parity)
+        names = exp.get("names", exp["srcs"])
+        for score_type in score_types:
+            filename = (f"{args.img_prefix}{exp['name']}."
+                        f"{figure_name(score_type)}")
+            jobs.append((dists, scores[score_type], origin, names, score_type,
+                         filename, bs_resampling, args.seed, args.preview))
+    with multiprocessing.Pool(args.num_proc) as pool:
+        for filename in pool.imap_unordered(render_figure, jobs):
+            print(f"Saved {filename}")
+
+
+def main():
+    args = get_args()
+    if args.manifest is not None:
+        run_manifest(args)
+        return
+    if args.systems is not None:
+        compare_systems(args)
+        return
+    cache = ScoreCache(args.score_cache) if args.score_cache else None
+    scores = {args.score_type: args.scores} if args.scores else None
+    srcs, long_enough, origin, dists, scores = load_experiment(
+        args.srcs, args.refs, args.outs, args.dists, [args.score_type],
+        scores, args.min_len, cache, args.num_proc, args.check_parity)
+    scores = scores[args.score_type]
+    render_figure((dists, scores, origin, args.srcs, args.score_type,
+                   f"{args.img_prefix}{figure_name(args.score_type)}",
+                   args.bs_resampling, args.seed, args.preview))
+    # Print extremal elements
+    print_extremes(srcs, long_enough, dists, scores)
 
 
 if __name__ == "__main__":
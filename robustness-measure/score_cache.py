@@ -0,0 +1,59 @@
+"""Content-addressed cache of sentence scores
+
+The scores of an output file are stored as a `.npy` array under a key made
+from the hashes of the contents of the output and reference files, the score
+type and its settings (e.g. the smoothing of BLEU). They are therefore
+reused whenever the same outputs are scored against the same references in
+the same way again, and never once either file has changed.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def content_hash(filename, chunk_size=1 << 20):
+    """Hash of the content of a file"""
+    h = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ScoreCache(object):
+    """Directory of score arrays, stored under the key of what they were
+    computed from"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, out_file, ref_file, score_type, settings):
+        desc = json.dumps([content_hash(out_file), content_hash(ref_file),
+                           score_type, settings], sort_keys=True)
+        h = hashlib.blake2b(desc.encode("utf-8"), digest_size=20)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def get(self, key, n_lines=None):
+        """The cached scores for `key`, or None if there are none (or if they
+        are not `n_lines` long)"""
+        try:
+            scores = np.load(self.path(key))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if n_lines is not None and len(scores) != n_lines:
+            return None
+        return scores
+
+    def put(self, key, scores):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Only make the file appear once it is complete, in case other runs
+        # are using the same cache
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(scores, dtype=np.float64))
+        os.replace(tmp, path)
@@ -0,0 +1,373 @@
+"""Batched sentence-level BLEU and chrF
+
+Computes the same scores as calling sacrebleu's `sentence_bleu` and
+`sentence_chrf` on every pair of sentences, but for all of the pairs at once:
+every token (or character) is mapped to an integer ID once, n-grams are
+turned into integer IDs one order at a time, and the clipped n-gram matches
+and the scores themselves are computed with NumPy array operations.
+
+Example (also checks the scores of a random sample against sacrebleu):
+
+```bash
+python sentence_scores.py --hyps out.fr --refs ref.fr \
+    --score-type sentbleu --check-parity
+```
+"""
+import argparse
+import multiprocessing
+import re
+import numpy as np
+from sacrebleu import sentence_bleu, sentence_chrf
+
+# Same as in sacrebleu 1.x (2.x scores sentences differently and has another
+# API, see requirements.txt)
+NGRAM_ORDER = 4
+CHRF_ORDER = 6
+CHRF_BETA = 2
+# sacrebleu's log(0)
+LOG_ZERO = -9999999999
+
+# Settings of sentence BLEU in plot_score_vs_dist.py. Note that sacrebleu
+# does not know "add-n" (only "add-k"), so it does no smoothing at all with
+# it, and neither do we.
+BLEU_SMOOTH_METHOD = "add-n"
+BLEU_SMOOTH_VALUE = 1.0
+
+
+def sentbleu(y_hat, y):
+    """Reference implementation of one sentence BLEU score"""
+    return sentence_bleu(y_hat, y, smooth_method=BLEU_SMOOTH_METHOD,
+                         smooth_value=BLEU_SMOOTH_VALUE)
+
+
+def sentchrf(y_hat, y):
+    """Reference implementation of one sentence chrF score"""
+    return sentence_chrf(y_hat, y)*100
+
+
+# The first rule of tokenize_13a puts spaces around the characters of
+# r"[\{-\~\[-\` -\&\(-\+\:-\@\/]", which is much faster as a translation
+_punct_table = str.maketrans({
+    c: f" {c} " for c in " !\"#$%&()*+/:;<=>?@[\\]^_`{|}~"
+})
+_13a_rules = [
+    (re.compile(r"([^0-9])([\.,])"), "\\1 \\2 "),
+    (re.compile(r"([\.,])([^0-9])"), " \\1 \\2"),
+    (re.compile(r"([0-9])(-)"), "\\1 \\2 "),
+]
+
+
+def tokenize_13a_batch(lines):
+    """The same as `[tokenize_13a(line) for line in lines]`, but with every
+    regex applied once to all lines. Lines are joined by " \\n " so that each
+    of them is padded with spaces exactly as tokenize_13a does, and none of
+    the substitutions can match across lines."""
+    if not lines:
+        return []
+    text = " \n ".join(lines)
+    text = text.replace("<skipped>", "")
+    text = text.replace("&quot;", '"')
+    text = text.replace("&amp;", "&")
+    text = text.replace("&lt;", "<")
+    text = text.replace("&gt;", ">")
+    text = f" {text} "
+    text = text.translate(_punct_table)
+    for pattern, repl in _13a_rules:
+        text = pattern.sub(repl, text)
+    return [" ".join(line.split()) for line in text.split("\n")]
+
+
+def _intern(keys):
+    """Map every value of `keys` to a dense integer ID (sorting based, as it
+    is faster than np.unique for this)"""
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    new = np.empty(len(keys), dtype=bool)
+    new[:1] = True
+    new[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    ids = np.empty(len(keys), dtype=np.int64)
+    ids[order] = np.cumsum(new) - 1
+    return ids
+
+
+def _count(keys):
+    """Unique values of `keys` and their counts"""
+    keys = np.sort(keys)
+    starts = np.flatnonzero(np.r_[len(keys) > 0, keys[1:] != keys[:-1]])
+    return keys[starts], np.diff(np.r_[starts, len(keys)])
+
+
+def ngram_stats(hyp_ids, hyp_lens, ref_ids, ref_lens, max_order,
+                hyp_refs=None):
+    """Numbers of n-grams in each hypothesis and reference, and of clipped
+    matches between them, for every order up to `max_order`
+
+    Args:
+        hyp_ids: IDs of the tokens of all hypotheses, one after the other
+        hyp_lens: Number of tokens in each hypothesis
+        ref_ids: IDs of the tokens of all references
+        ref_lens: Number of tokens in each reference
+        hyp_refs: Index of the reference of each hypothesis (by default the
+            i-th hypothesis is compared with the i-th reference), so that
+            the hypotheses of several systems can be compared with the same
+            references, whose n-grams are only counted once
+
+    Returns:
+        Three arrays of shape (number of hypotheses, max_order): the counts
+        of n-grams in the hypotheses, in their references, and of matches
+    """
+    n_hyps, n_refs = len(hyp_lens), len(ref_lens)
+    if hyp_refs is None:
+        hyp_refs = np.arange(n_hyps)
+    n_hyp_tokens = len(hyp_ids)
+    # Both sides are handled together, so that n-grams get the same IDs
+    ids = np.concatenate([hyp_ids, ref_ids]).astype(np.int64)
+    sents = np.concatenate([
+        np.repeat(np.arange(n_hyps), hyp_lens),
+        np.repeat(np.arange(n_hyps, n_hyps + n_refs), ref_lens),
+    ])
+    tokens = _intern(ids)
+    n_tokens = tokens.max() + 1 if len(tokens) else 1
+    hyp_counts = np.zeros((n_hyps, max_order), dtype=np.int64)
+    ref_counts = np.zeros((n_refs, max_order), dtype=np.int64)
+    matches = np.zeros((n_hyps, max_order), dtype=np.int64)
+    grams = tokens
+    for n in range(1, max_order + 1):
+        if n > 1:
+            # The n-gram starting at i is the (n-1)-gram starting at i
+            # followed by token i+n-1
+            if len(grams) < 2:
+                break
+            grams = _intern(grams[:-1] * n_tokens + tokens[n-1:])
+        starts = np.arange(len(grams))
+        # Only n-grams that do not cross a sentence boundary
+        valid = sents[starts] == sents[starts + n - 1]
+        is_hyp = valid & (starts < n_hyp_tokens)
+        is_ref = valid & (starts >= n_hyp_tokens)
+        n_grams = grams.max() + 1 if len(grams) else 1
+        hyp_sents = sents[starts[is_hyp]]
+        ref_sents = sents[starts[is_ref]] - n_hyps
+        hyp_counts[:, n-1] = np.bincount(hyp_sents, minlength=n_hyps)
+        ref_counts[:, n-1] = np.bincount(ref_sents, minlength=n_refs)
+        # Clipped matches: the smaller of the counts of each n-gram of each
+        # hypothesis and of its reference
+        hyp_keys, hyp_c = _count(hyp_sents * n_grams + grams[is_hyp])
+        ref_keys, ref_c = _count(ref_sents * n_grams + grams[is_ref])
+        hyp_of = hyp_keys // n_grams
+        in_ref = hyp_refs[hyp_of] * n_grams + hyp_keys % n_grams
+        idx = np.searchsorted(ref_keys, in_ref)
+        idx[idx == len(ref_keys)] = 0
+        found = (ref_keys[idx] == in_ref) if len(ref_keys) else \
+            np.zeros(len(in_ref), dtype=bool)
+        matches[:, n-1] = np.bincount(
+            hyp_of[found],
+            weights=np.minimum(hyp_c[found], ref_c[idx[found]]),
+            minlength=n_hyps,
+        ).astype(np.int64)
+    return hyp_counts, ref_counts[hyp_refs], matches
+
+
+def bleu_from_stats(correct, total, sys_len, ref_len,
+                    smooth_method=BLEU_SMOOTH_METHOD,
+                    smooth_value=BLEU_SMOOTH_VALUE):
+    """Vectorized version of sacrebleu's `compute_bleu` with
+    `use_effective_order=True`, for one sentence per row"""
+    correct = correct.astype(np.float64)
+    total = total.astype(np.float64)
+    n_sents = len(sys_len)
+    precisions = np.zeros((n_sents, NGRAM_ORDER))
+    effective_order = np.full(n_sents, NGRAM_ORDER)
+    smooth_mteval = np.ones(n_sents)
+    # Once an order has no n-grams, the higher ones are not looked at
+    active = np.ones(n_sents, dtype=bool)
+    for n in range(NGRAM_ORDER):
+        if smooth_method == "add-k" and n > 1:
+            correct[:, n] += smooth_value
+            total[:, n] += smooth_value
+        active &= total[:, n] != 0
+        effective_order[active] = n + 1
+        c, t = correct[active, n], total[active, n]
+        p = np.zeros(len(c))
+        zero = c == 0
+        if smooth_method == "exp":
+            smooth_mteval[active & (correct[:, n] == 0)] *= 2
+            p[zero] = 100. / (smooth_mteval[active][zero] * t[zero])
+        elif smooth_method == "floor":
+            p[zero] = 100. * smooth_value / t[zero]
+        p[~zero] = 100. * c[~zero] / t[~zero]
+        precisions[active, n] = p
+    with np.errstate(divide="ignore"):
+        logs = np.where(precisions == 0, LOG_ZERO, np.log(precisions))
+    in_order = np.arange(NGRAM_ORDER)[None, :] < effective_order[:, None]
+    log_mean = (logs * in_order).sum(axis=1) / effective_order
+    bp = np.ones(n_sents)
+    short = sys_len < ref_len
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bp[short] = np.where(sys_len[short] > 0,
+                             np.exp(1 - ref_len[short] / sys_len[short]), 0.0)
+    return bp * np.exp(log_mean)
+
+
+def chrf_from_stats(hyp_counts, ref_counts, matches, beta=CHRF_BETA):
+    """Vectorized version of sacrebleu's sentence chrF from its statistics"""
+    ok = (hyp_counts > 0) & (ref_counts > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prec = np.where(ok, matches / np.maximum(hyp_counts, 1), 0.0)
+        rec = np.where(ok, matches / np.maximum(ref_counts, 1), 0.0)
+        order = ok.sum(axis=1)
+        avg_prec = prec.sum(axis=1) / np.maximum(order, 1)
+        avg_rec = rec.sum(axis=1) / np.maximum(order, 1)
+        beta2 = beta ** 2
+        score = ((1 + beta2) * avg_prec * avg_rec
+                 / (beta2 * avg_prec + avg_rec))
+    return np.where((order > 0) & (avg_prec + avg_rec > 0), score, 0.0)
+
+
+def _word_ids(lines, vocab):
+    """Token IDs (from a shared vocabulary) and lengths of tokenized lines"""
+    tokens = [line.split() for line in lines]
+    lens = np.fromiter((len(t) for t in tokens), dtype=np.int64,
+                       count=len(tokens))
+    ids = np.fromiter((vocab.setdefault(w, len(vocab))
+                       for t in tokens for w in t),
+                      dtype=np.int64, count=int(lens.sum()))
+    return ids, lens
+
+
+def _char_ids(lines):
+    """Code points and lengths of lines with all whitespace removed"""
+    lines = ["".join(line.split()) for line in lines]
+    lens = np.fromiter((len(line) for line in lines), dtype=np.int64,
+                       count=len(lines))
+    ids = np.frombuffer("".join(lines).encode("utf-32-le"), dtype=np.uint32)
+    return ids.astype(np.int64), lens
+
+
+def batch_sentbleu(hyps, refs, hyp_refs=None):
+    """Sentence BLEU of every (hypothesis, reference) pair (or of every
+    hypothesis and reference `hyp_refs[i]`)"""
+    hyps = tokenize_13a_batch([h.rstrip() for h in hyps])
+    refs = tokenize_13a_batch([r.rstrip() for r in refs])
+    vocab = {}
+    hyp_ids, hyp_lens = _word_ids(hyps, vocab)
+    ref_ids, ref_lens = _word_ids(refs, vocab)
+    if hyp_refs is None:
+        hyp_refs = np.arange(len(hyps))
+    total, _, correct = ngram_stats(hyp_ids, hyp_lens, ref_ids, ref_lens,
+                                    NGRAM_ORDER, hyp_refs)
+    return bleu_from_stats(correct, total, hyp_lens.astype(np.float64),
+                           ref_lens[hyp_refs].astype(np.float64))
+
+
+def batch_sentchrf(hyps, refs, hyp_refs=None):
+    """Sentence chrF (times 100) of every (hypothesis, reference) pair (or of
+    every hypothesis and reference `hyp_refs[i]`)"""
+    hyp_ids, hyp_lens = _char_ids(hyps)
+    ref_ids, ref_lens = _char_ids(refs)
+    stats = ngram_stats(hyp_ids, hyp_lens, ref_ids, ref_lens, CHRF_ORDER,
+                        hyp_refs)
+    return chrf_from_stats(*stats) * 100
+
+
+batch_score_funcs = {"sentbleu": batch_sentbleu, "chrf": batch_sentchrf}
+score_funcs = {"sentbleu": sentbleu, "chrf": sentchrf}
+# Everything that the scores depend on apart from the sentences (this must
+# change whenever a score would change, as scores are cached by it)
+score_settings = {
+    "sentbleu": {"version": 1, "tokenize": "13a", "order": NGRAM_ORDER,
+                 "smooth_method": BLEU_SMOOTH_METHOD,
+                 "smooth_value": BLEU_SMOOTH_VALUE},
+    "chrf": {"version": 1, "order": CHRF_ORDER, "beta": CHRF_BETA},
+}
+
+
+def _score_chunk(job):
+    score_type, systems, refs = job
+    # The hypotheses of all systems are scored against the same references
+    hyps = [hyp for system in systems for hyp in system]
+    hyp_refs = np.tile(np.arange(len(refs)), len(systems))
+    scores = batch_score_funcs[score_type](hyps, refs, hyp_refs)
+    return scores.reshape(len(systems), len(refs))
+
+
+def multi_system_scores(systems, refs, score_type, num_proc=1,
+                        chunk_size=200000):
+    """Scores of the outputs of several systems (a list of lists of
+    hypotheses) against the same references, of shape (number of systems,
+    number of references). The references are tokenized and their n-grams
+    counted only once for all systems. Very large sets are split into chunks
+    (of about `chunk_size` hypotheses), which are scored by `num_proc`
+    processes, to bound memory use."""
+    systems = [list(system) for system in systems]
+    refs = list(refs)
+    if any(len(system) != len(refs) for system in systems):
+        raise ValueError("Different numbers of hypotheses and references")
+    step = max(1, chunk_size // max(len(systems), 1))
+    jobs = [(score_type, [system[i:i+step] for system in systems],
+             refs[i:i+step])
+            for i in range(0, len(refs), step)] or \
+        [(score_type, systems, refs)]
+    if num_proc > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(num_proc) as pool:
+            return np.concatenate(pool.map(_score_chunk, jobs), axis=1)
+    return np.concatenate([_score_chunk(job) for job in jobs], axis=1)
+
+
+def sentence_scores(hyps, refs, score_type, num_proc=1, chunk_size=200000):
+    """Score every (hypothesis, reference) pair with `score_type` ("sentbleu"
+    or "chrf"). Very large sets are split into chunks, which are scored by
+    `num_proc` processes, to bound memory use."""
+    return multi_system_scores([hyps], refs, score_type, num_proc,
+                               chunk_size)[0]
+
+
+def check_parity(hyps, refs, score_type, scores=None, n_samples=500,
+                 tol=1e-6, seed=0):
+    """Compare the batched scores of a random sample of pairs with those of
+    sacrebleu, and raise an error if any of them differ by more than `tol`.
+    Returns the largest difference."""
+    if scores is None:
+        scores = sentence_scores(hyps, refs, score_type)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(hyps), size=min(n_samples, len(hyps)),
+                        replace=False)
+    score_func = score_funcs[score_type]
+    expected = np.asarray([score_func(hyps[i], refs[i]) for i in sample])
+    diff = np.abs(expected - scores[sample])
+    if len(diff) and diff.max() > tol:
+        i = sample[diff.argmax()]
+        raise ValueError(
+            f"{score_type} of line {i} is {scores[i]} but sacrebleu gives "
+            f"{expected[diff.argmax()]}:\n  hyp: {hyps[i]}\n  ref: {refs[i]}"
+        )
+    return diff.max() if len(diff) else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hyps", type=str, required=True,
+                        help="Model output")
+    parser.add_argument("--refs", type=str, required=True,
+                        help="Reference translations")
+    parser.add_argument("--score-type", type=str, default="sentbleu",
+                        choices=sorted(batch_score_funcs),
+                        help="Name of the scoring function")
+    parser.add_argument("--num-proc", type=int, default=1,
+                        help="Number of processes for very large sets")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="Compare a sample of scores with sacrebleu")
+    args = parser.parse_args()
+    with open(args.hyps) as f:
+        hyps = [line.rstrip() for line in f]
+    with open(args.refs) as f:
+        refs = [line.rstrip() for line in f]
+    scores = sentence_scores(hyps, refs, args.score_type, args.num_proc)
+    if args.check_parity:
+        diff = check_parity(hyps, refs, args.score_type, scores)
+        print(f"parity with sacrebleu: max difference {diff:.2e}")
+    for score in scores:
+        print(score)
+
+
+if __name__ == "__main__":
+    main()
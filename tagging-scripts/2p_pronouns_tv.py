@@ -1,115 +1,171 @@
 #!/usr/bin/env python3
 
-import re, argparse, datetime, os
-from collections import Counter, defaultdict
+import re, argparse, datetime, os, io
+import multiprocessing
 
-word_pattern = re.compile(r'\w+')
+from pronouns import SecondPersonCounter
 
-lexicons = {
-	"english": {"neutral": {"you"}}, 
-	"french": {"T": {"tu", "te", "toi"}, "V" : {"vous"}}
-	}
-
-
-
-def identify_2p_pronouns(tokenised_input, lexicon):
-	counts = Counter(tokenised_input)
-
-	pronouns_dict = defaultdict(dict)
-	
-	for k in lexicon:
-		for pronoun in lexicon[k]:
-			if counts[pronoun]:
-				pronouns_dict[k][pronoun] = counts[pronoun]
-
-	return(pronouns_dict)
-
-
-
-def process_dataset(input_filepath, output_directory, source_lang, target_lang):
+# The lexicons are in pronouns.py
+lang_codes = {"english": "en", "french": "fr"}
+
+# Lines with more tokens than this in the source are skipped
+max_source_tokens = 200
+
+# The TSV is read in chunks of about this many bytes (split at line boundaries), which are processed by a
+# pool of processes and written out in order. Only the pronouns are looked for in each line (with one regex
+# per language), and the summary tables are counted along the way.
+chunk_size = 1 << 22
+
+
+
+def format_pronouns(pronoun_dict):
+	if not pronoun_dict:
+		return '0'
+	return ' '.join('{}:{}'.format(p, v) for k in pronoun_dict for (p, v) in pronoun_dict[k].items())
+
+
+def tv_form(pronoun_dict):
+	if 'T' in pronoun_dict and 'V' in pronoun_dict:
+		return 'Both'
+	elif 'T' in pronoun_dict:
+		return 'T'
+	elif 'V' in pronoun_dict:
+		return 'V'
+	return '0'
+
+
+# Matches the start of a line with more than max_source_tokens tokens
+too_long_pattern = re.compile(r'\W*(?:\w+\W+){%d}\w' % max_source_tokens)
+
+
+def too_long(source):
+	# n tokens take at least 2n-1 characters, so only long lines need to be looked at
+	return len(source) > 2 * max_source_tokens and too_long_pattern.match(source) is not None
+
+
+def new_stats():
+	return {'lines': 0, 'malformed': 0, 'too_long': 0, 'with_pronouns': 0,
+	        'most': {'0': 0, 'S': 0, 'T': 0}, 'T_V': {'T': 0, 'V': 0, 'Both': 0, '0': 0},
+	        'source_pronouns': {}, 'target_pronouns': {}}
+
+
+def merge_stats(total, stats):
+	for k, v in stats.items():
+		if isinstance(v, dict):
+			for kk, vv in v.items():
+				total[k][kk] = total[k].get(kk, 0) + vv
+		else:
+			total[k] += v
+
+
+def process_chunk(job):
+	"""The output lines, malformed lines and statistics of the lines in a byte range of the input"""
+	input_filepath, begin, end, source_lang, target_lang = job
+	source_counter = SecondPersonCounter(lang_codes[source_lang.lower()])
+	target_counter = SecondPersonCounter(lang_codes[target_lang.lower()])
+	# The T/V form is the one of the language that is not English
+	tv_of_target = source_lang == 'english'
+	with open(input_filepath, 'rb') as infile:
+		infile.seek(begin)
+		text = infile.read(end - begin).decode('utf-8')
+	out, malformed, stats = [], [], new_stats()
+	# (read as the text file was, with universal newlines)
+	for line in io.StringIO(text, newline=None):
+		stats['lines'] += 1
+		line = line.strip().lower()
+		try:
+			(example_id, source, target) = line.split('\t')
+		except ValueError:
+			malformed.append(line)
+			stats['malformed'] += 1
+			continue
+
+		if too_long(source):
+			stats['too_long'] += 1
+			continue
+
+		source_pronoun_dict = source_counter.count_text(source)
+		target_pronoun_dict = target_counter.count_text(target)
+
+		if source_pronoun_dict or target_pronoun_dict:
+			n_source = sum(v for k in source_pronoun_dict for v in source_pronoun_dict[k].values())
+			n_target = sum(v for k in target_pronoun_dict for v in target_pronoun_dict[k].values())
+
+			if n_source == n_target:
+				most = '0'
+			elif n_source > n_target:
+				most = 'S'
+			else:
+				most = 'T'
+
+			T_V = tv_form(target_pronoun_dict if tv_of_target else source_pronoun_dict)
+
+			# id, source, target, col for source pronouns, col for target pronouns, indicator for whether number of pronouns in target matches source, indicator for whether non-English lang uses T or V form (or both)
+			out.append('\t'.join([example_id, source, target, format_pronouns(source_pronoun_dict),
+			                      format_pronouns(target_pronoun_dict), most, T_V]) + '\n')
+
+			stats['with_pronouns'] += 1
+			stats['most'][most] += 1
+			stats['T_V'][T_V] += 1
+			for side, pronoun_dict in (('source_pronouns', source_pronoun_dict), ('target_pronouns', target_pronoun_dict)):
+				for k in pronoun_dict:
+					for (p, v) in pronoun_dict[k].items():
+						stats[side][p] = stats[side].get(p, 0) + v
+	return ''.join(out), malformed, stats
+
+
+def split_points(input_filepath, num_chunks):
+	"""Byte offsets that split a file into num_chunks ranges at line boundaries"""
+	size = os.path.getsize(input_filepath)
+	points = [0]
+	with open(input_filepath, 'rb') as infile:
+		for i in range(1, num_chunks):
+			infile.seek(max(size * i // num_chunks, points[-1]))
+			if infile.tell() > 0:
+				infile.seek(infile.tell() - 1)
+				infile.readline()
+			points.append(min(infile.tell(), size))
+	points.append(size)
+	return points
+
+
+def summary_tables(stats):
+	"""The corpus-level tables of T/V forms and of which side has more pronouns"""
+	n = max(stats['with_pronouns'], 1)
+	rows = ['lines\t{}'.format(stats['lines']),
+	        'malformed\t{}'.format(stats['malformed']),
+	        'too_long\t{}'.format(stats['too_long']),
+	        'with_pronouns\t{}'.format(stats['with_pronouns']),
+	        '',
+	        'T_V\tcount\tpercent']
+	rows += ['{}\t{}\t{:.2f}'.format(k, v, 100.0 * v / n) for k, v in stats['T_V'].items()]
+	rows += ['', 'most\tcount\tpercent']
+	rows += ['{}\t{}\t{:.2f}'.format(k, v, 100.0 * v / n) for k, v in stats['most'].items()]
+	for side in ('source_pronouns', 'target_pronouns'):
+		rows += ['', '{}\tcount'.format(side)]
+		rows += ['{}\t{}'.format(p, v) for p, v in stats[side].items()]
+	return '\n'.join(rows) + '\n'
+
+
+def process_dataset(input_filepath, output_directory, source_lang, target_lang, num_proc=1):
 	os.makedirs(output_directory, exist_ok=True)
-	with open(input_filepath, 'r') as infile:
-		with open('{}/{}'.format(output_directory, os.path.split(input_filepath)[1]), 'w') as outfile:
-			for line in infile:
-				line = line.strip().lower()
-				try:
-					(example_id, source, target) = line.split('\t')
-				except ValueError:
+	output_filepath = '{}/{}'.format(output_directory, os.path.split(input_filepath)[1])
+	num_chunks = max(1, os.path.getsize(input_filepath) // chunk_size + 1)
+	points = split_points(input_filepath, num_chunks)
+	jobs = [(input_filepath, begin, end, source_lang, target_lang) for begin, end in zip(points, points[1:])]
+	stats = new_stats()
+	with open(output_filepath, 'w', buffering=1 << 20) as outfile:
+		with multiprocessing.Pool(num_proc) as pool:
+			# imap keeps the order of the chunks
+			for out, malformed, chunk_stats in pool.imap(process_chunk, jobs):
+				for line in malformed:
 					print(line)
-					continue
-			
-				tokenised_source = word_pattern.findall(source)
-
-				if len(tokenised_source) > 200: 
-					continue
-
-				tokenised_target = word_pattern.findall(target)
-
-				source_pronoun_dict = identify_2p_pronouns(tokenised_source, lexicons[source_lang.lower()])
-				target_pronoun_dict = identify_2p_pronouns(tokenised_target, lexicons[target_lang.lower()])
-				
-
-				if source_pronoun_dict or target_pronoun_dict:
-
-					line_out = '\t'.join([example_id, source, target]) + '\t'
-					
-
-					if source_pronoun_dict:
-						source_pronouns = []
-						for k in source_pronoun_dict:
-							for (p,v) in source_pronoun_dict[k].items():
-								source_pronouns.append('{}:{}'.format(p,(str(v))))
-						source_pronouns = ' '.join(source_pronouns)
-					else:
-						source_pronouns = '0'
-
-
-					if target_pronoun_dict:
-						target_pronouns = []
-						for k in target_pronoun_dict:
-							for (p,v) in target_pronoun_dict[k].items():
-								target_pronouns.append('{}:{}'.format(p,(str(v))))
-						target_pronouns = ' '.join(target_pronouns)
-					else:
-						target_pronouns = '0'
-
-
-					n_source = sum( (sum(source_pronoun_dict[k].values()) for k in source_pronoun_dict))
-					n_target = sum( (sum(target_pronoun_dict[k].values()) for k in target_pronoun_dict))
-
-					if n_source == n_target:
-						most = '0'
-					elif n_source > n_target:
-						most = 'S'
-					else:
-						most = 'T'
-
-			
-
-					if source_lang == 'english':
-						if 'T' in target_pronoun_dict and 'V' in target_pronoun_dict:
-							T_V = 'Both'
-						elif 'T' in target_pronoun_dict:
-							T_V = 'T'
-						elif 'V' in target_pronoun_dict:
-							T_V = 'V'
-						else:
-							T_V = '0'
-					else:
-						if 'T' in source_pronoun_dict and 'V' in source_pronoun_dict:
-							T_V = 'Both'
-						elif 'T' in source_pronoun_dict:
-							T_V = 'T'
-						elif 'V' in source_pronoun_dict:
-							T_V = 'V'
-						else:
-							T_V = '0'
-
-					line_out += '\t'.join([source_pronouns, target_pronouns, most, T_V]) + '\n'
-
-					outfile.write(line_out)
-
-					# id, source, target, col for source pronouns, col for target pronouns, indicator for whether number of pronouns in target matches source, indicator for whether non-English lang uses T or V form (or both)
+				outfile.write(out)
+				merge_stats(stats, chunk_stats)
+	summary = summary_tables(stats)
+	with open(output_filepath + '.summary', 'w') as summary_file:
+		summary_file.write(summary)
+	print(summary)
 
 
 
@@ -119,13 +175,11 @@ if __name__ == "__main__":
 	parser.add_argument("-o", "--output_directory", type=str, help="directory where output file should be written", default = '/Users/pippa/jsalt_workshop/datasets/probing/2p_pronouns/MTNT/train/')
 	parser.add_argument("-s", "--source_lang", type=str, help="name of source language", default = 'english')
 	parser.add_argument("-t", "--target_lang", type=str, help="name of target language", default = 'french')
+	parser.add_argument("-n", "--num_proc", type=int, help="number of processes", default = multiprocessing.cpu_count())
 
 	print("starting at {}".format(datetime.datetime.now()))
 
 	
 	options = parser.parse_args()
-	process_dataset(options.input_filepath, options.output_directory, options.source_lang, options.target_lang)
+	process_dataset(options.input_filepath, options.output_directory, options.source_lang, options.target_lang, options.num_proc)
 	print("finished at: {}".format(datetime.datetime.now()))
-
-
-			
\ No newline at end of file
@@ -0,0 +1,69 @@
+import re
+import emoji
+
+# Emoji tagging shared by tag_emojis.py and anything else that needs to find emoji in tokenized text.
+# The emoji inventory of the emoji package is compiled once into a table of codepoints, so that a whole
+# line can be checked in one pass, and words only have to be looked at one by one in the few lines that
+# have emoji in them:
+#
+#  tagger = EmojiTagger()
+#  for tags in tagger.tag_lines(open('out.fr.tok')):
+#    print(tags)
+
+# Codepoints that only occur as part of a longer emoji sequence: skin tone modifiers, regional indicators
+# (two of which make up a flag), the keycap combining mark, and the tag characters of subdivision flags
+component_ranges = [(0x1F3FB, 0x1F3FF), (0x1F1E6, 0x1F1FF), (0x20E3, 0x20E3), (0xE0020, 0xE007F)]
+
+# The zero width joiner and the emoji variation selector, which glue sequences together but are not emoji
+# on their own. A tokenizer that splits a sequence can leave words that only consist of these.
+joiners = '\u200d\ufe0f'
+
+def emoji_inventory():
+  """All emoji (including multi-codepoint sequences) known to the installed version of the emoji package"""
+  if hasattr(emoji, 'EMOJI_DATA'):
+    return set(emoji.EMOJI_DATA)
+  inventory = emoji.UNICODE_EMOJI
+  # Versions 1.x keep a separate dict for every language
+  if isinstance(inventory.get('en'), dict):
+    inventory = inventory['en']
+  return set(inventory)
+
+def compile_inventory(inventory):
+  """The set of codepoints whose presence marks a word as containing an emoji, and a regex for the rest of
+  the inventory (or None). Multi-codepoint sequences (ZWJ sequences, skin tones, flags, keycaps) almost
+  always contain a single-codepoint emoji or a component, in which case that codepoint is enough to find
+  them; the few that do not are matched as whole sequences."""
+  codepoints = {e for e in inventory if len(e) == 1}
+  for a, b in component_ranges:
+    codepoints.update(chr(c) for c in range(a, b + 1))
+  sequences = [e for e in inventory if len(e) > 1 and codepoints.isdisjoint(e)]
+  sequence_re = re.compile('|'.join(re.escape(e) for e in sorted(sequences, key=len, reverse=True))) if sequences else None
+  return frozenset(codepoints), sequence_re
+
+class EmojiTagger:
+  """Replaces every word of a tokenized line by 'emoji' if it contains an emoji, and 'other' otherwise"""
+
+  def __init__(self, inventory=None):
+    self.codepoints, self.sequence_re = compile_inventory(inventory or emoji_inventory())
+    # Also look at the words of lines that only have joiners in them
+    self.line_codepoints = self.codepoints | set(joiners)
+
+  def is_emoji(self, word):
+    if not self.codepoints.isdisjoint(word):
+      return True
+    if self.sequence_re and self.sequence_re.search(word):
+      return True
+    return bool(word) and not word.strip(joiners)
+
+  def tag_line(self, line):
+    words = line.strip().split(' ')
+    # Most lines have no emoji at all (and all emoji are outside of ASCII), so check the whole line
+    # before looking at the words
+    if line.isascii() or (self.line_codepoints.isdisjoint(line) and not (self.sequence_re and self.sequence_re.search(line))):
+      return ' '.join(['other'] * len(words))
+    is_emoji = self.is_emoji
+    return ' '.join(['emoji' if is_emoji(w) else 'other' for w in words])
+
+  def tag_lines(self, lines):
+    for line in lines:
+      yield self.tag_line(line)
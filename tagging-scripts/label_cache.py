@@ -0,0 +1,89 @@
+import os
+import json
+import shutil
+import hashlib
+
+# A cache of label files that can be shared between runs (e.g. of run_compare_mt.py for different language
+# pairs). A label file is found by the hash of the content of the file that it labels, together with the
+# name, version and options of the tagger, so a label file is reused whenever the same text has been tagged
+# in the same way before, and never after the tokenization or the tagger have changed. When the cache grows
+# beyond its maximum size, the files that were least recently used are removed.
+
+def content_hash(fname, chunk_size=1<<20):
+  """The hash of the content of a file"""
+  h = hashlib.blake2b(digest_size=20)
+  with open(fname, 'rb') as ins:
+    for chunk in iter(lambda: ins.read(chunk_size), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+class LabelCache:
+  """Directory of label files, stored under the key of what they were made from"""
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    self.hits, self.misses = 0, 0
+
+  def key(self, input_hash, label, version, lang, options):
+    desc = json.dumps([input_hash, label, version, lang, options], sort_keys=True)
+    return hashlib.blake2b(desc.encode('utf-8'), digest_size=20).hexdigest()
+
+  def path(self, key, label):
+    return os.path.join(self.cache_dir, key[:2], f'{key}.{label}')
+
+  def get(self, key, label, fout):
+    """Copy the cached file for key to fout if there is one, and return whether there was"""
+    cached = self.path(key, label)
+    try:
+      shutil.copyfile(cached, fout)
+    except FileNotFoundError:
+      self.misses += 1
+      return False
+    # The modification time is used as the time of last use for eviction (and the copy is still good if
+    # another process has evicted the file since)
+    try:
+      os.utime(cached)
+    except FileNotFoundError:
+      pass
+    self.hits += 1
+    return True
+
+  def put(self, key, label, fin):
+    """Store a copy of fin as the cached file for key"""
+    cached = self.path(key, label)
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    # Other processes may be reading or writing the same file, so it only appears once it is complete
+    tmp = f'{cached}.{os.getpid()}.tmp'
+    shutil.copyfile(fin, tmp)
+    os.replace(tmp, cached)
+
+  def evict(self, max_bytes):
+    """Remove the least recently used files until the cache takes up at most max_bytes, and return how
+    many files were removed"""
+    entries = []
+    for root, _, files in os.walk(self.cache_dir):
+      for f in files:
+        if f.endswith('.tmp'):
+          continue
+        try:
+          st = os.stat(os.path.join(root, f))
+        except FileNotFoundError:
+          # Evicted by another process in the meantime
+          continue
+        entries.append((st.st_mtime, st.st_size, os.path.join(root, f)))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+      if total <= max_bytes:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total -= size
+      removed += 1
+    return removed
+
+  def report(self):
+    total = max(self.hits + self.misses, 1)
+    return f'label cache: {self.hits} hits, {self.misses} misses ({100.0*self.hits/total:.1f}% hit rate)'
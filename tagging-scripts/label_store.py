@@ -0,0 +1,267 @@
+import os
+import json
+import fcntl
+import shutil
+import contextlib
+import argparse
+import numpy as np
+
+# A columnar store of everything that is known about the tokens of one tokenized file, instead of a text
+# sidecar file for every kind of label or alignment. FILE.tok has its store in the directory FILE.store/:
+#
+#  source.json            size and modification time of FILE.tok when the store was made
+#  tokens.npy             int64 offsets of the first token of every line (and one past the last token),
+#                         with the tokens as the taggers split them (line.strip().split(' '), so an empty line
+#                         has one empty token)
+#  lengths.npy            int32 number of whitespace separated words of every line (len(line.split()))
+#  LABEL.npy              uint8 code of the label of every token, e.g. emoji.npy or prn.npy
+#  LABEL.json             the labels of the codes, and what the labels were made with
+#  NAME.align.npy         (f, e) token index pairs of the alignments of all lines, e.g. fr-en-faalign.align.npy,
+#                         as uint8 when the sentences are short enough (and uint16 or int32 otherwise)
+#  NAME.align_lines.npy   int64 offsets of the first pair of every line
+#
+# All arrays are .npy files that are memory-mapped when they are read, so looking up the labels or the
+# alignments of a few lines neither parses nor reads the rest of them. compare-mt reads text files, which
+# are exported from the store (and are the same as the label and alignment files written by the taggers and
+# the aligners):
+# $ python label_store.py export a.fr.tok --labels emoji prn --align fr-en-faalign
+#
+# A store is only used for the version of the file that it was made from. Once the file has changed, the
+# store is emptied the next time something is written to it. Writers hold a lock on FILE.store.lock, so that
+# processes that add columns to the same store at once (e.g. the alignments of two aligners) do not empty
+# it under each other.
+
+def store_dir(fname):
+  """The directory of the store of fname"""
+  return fname[:-len('.tok')] + '.store' if fname.endswith('.tok') else f'{fname}.store'
+
+def label_file(fname, label):
+  """The file that the labels of fname are written to"""
+  return fname[:-len('.tok')] + f'.{label}' if fname.endswith('.tok') else f'{fname}.{label}'
+
+def align_file(fname, name):
+  """The file that the aligner wrote the alignments called name to, e.g. a.fr-en.fr.tok and fr-en-faalign
+  are in a.fr-en.fr-en-faalign"""
+  return f"{fname.rsplit('.', 2)[0]}.{name}"
+
+def align_name(fname, align_fname):
+  """The name of the alignments in align_fname in the store of fname (the inverse of align_file)"""
+  return align_fname[len(fname.rsplit('.', 2)[0]) + 1:]
+
+def text_offsets(data, sep=b' '):
+  """The number of sep separated items on every line of the bytes data, as an offset array"""
+  bytes_ = np.frombuffer(data, dtype=np.uint8)
+  ends = np.flatnonzero(bytes_ == ord('\n'))
+  if len(bytes_) and (not len(ends) or ends[-1] != len(bytes_) - 1):
+    ends = np.append(ends, len(bytes_))
+  seps = np.flatnonzero(bytes_ == ord(sep))
+  counts = np.bincount(np.searchsorted(ends, seps), minlength=len(ends)) + 1
+  return np.r_[0, np.cumsum(counts)].astype(np.int64)
+
+class LabelStore:
+  """The store of one tokenized file"""
+
+  def __init__(self, fname):
+    self.fname = fname
+    self.path = store_dir(fname)
+
+  def file(self, name):
+    return os.path.join(self.path, name)
+
+  def source(self):
+    st = os.stat(self.fname)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+  def is_fresh(self):
+    """Whether the store was made from the current version of the file"""
+    try:
+      with open(self.file('source.json'), 'r') as f:
+        return json.load(f) == self.source()
+    except FileNotFoundError:
+      return False
+
+  def _save(self, name, obj):
+    # Other processes may be reading the same column, so it only appears once it is complete
+    tmp = f'{self.file(name)}.{os.getpid()}.tmp'
+    if name.endswith('.npy'):
+      with open(tmp, 'wb') as f:
+        np.save(f, obj)
+    else:
+      with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, self.file(name))
+
+  def _load(self, name):
+    return np.load(self.file(name), mmap_mode='r')
+
+  @contextlib.contextmanager
+  def _writing(self):
+    """Hold the lock of the store while columns are written to it, with the store made from the current
+    version of the file"""
+    with open(f'{self.path}.lock', 'a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        self._open_for_writing()
+        yield
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+  def _open_for_writing(self):
+    """Empty the store if it belongs to an earlier version of the file, and start it again with the token
+    offsets of the lines (only with the lock held)"""
+    if self.is_fresh():
+      return
+    shutil.rmtree(self.path, ignore_errors=True)
+    os.makedirs(self.path, exist_ok=True)
+    source = self.source()
+    tokens, lengths = [], []
+    # Read in the same way as the taggers read the file (with universal newlines), so that there is one label
+    # for every token even on lines that end in a lone \r
+    with open(self.fname, 'r') as ins:
+      for line in ins:
+        line = line.strip()
+        tokens.append(line.count(' ') + 1)
+        lengths.append(len(line.split()))
+    self._save('tokens.npy', np.r_[0, np.cumsum(tokens, dtype=np.int64)])
+    self._save('lengths.npy', np.array(lengths, dtype=np.int32))
+    # Written last, as the store only counts as made from this version of the file once it is complete
+    self._save('source.json', source)
+
+  def tokens(self):
+    """The offsets of the tokens of every line"""
+    return self._load('tokens.npy')
+
+  def lengths(self):
+    """The number of whitespace separated words of every line"""
+    return self._load('lengths.npy')
+
+  def labels(self):
+    return sorted(f[:-len('.json')] for f in os.listdir(self.path) if f.endswith('.json') and f != 'source.json') \
+      if self.is_fresh() else []
+
+  def label_info(self, label):
+    """The labels of the codes of a column and what they were made with, or None if there is no such
+    (current) column"""
+    if not self.is_fresh():
+      return None
+    try:
+      with open(self.file(f'{label}.json'), 'r') as f:
+        return json.load(f)
+    except FileNotFoundError:
+      return None
+
+  def put_labels(self, label, label_fname, made_with=None):
+    """Add the labels of a text label file as a column. made_with describes the tagger (e.g. its version
+    and options), so that readers can tell whether the column is still what they want."""
+    with open(label_fname, 'rb') as f:
+      data = f.read()
+    offsets = text_offsets(data)
+    names, codes = np.unique(np.array(data.split(), dtype=bytes), return_inverse=True)
+    if len(codes) != offsets[-1]:
+      raise ValueError(f'{label_fname} has empty labels')
+    if len(names) > 256:
+      raise ValueError(f'{label_fname} has more than 256 different labels')
+    with self._writing():
+      if not np.array_equal(offsets, self.tokens()):
+        raise ValueError(f'{label_fname} does not have one label for every token of {self.fname}')
+      self._save(f'{label}.npy', codes.astype(np.uint8))
+      self._save(f'{label}.json', {'names': [x.decode('utf-8') for x in names], 'made_with': made_with})
+
+  def get_labels(self, label):
+    """(names, codes) of the labels of all tokens, where names[codes[i]] is the label of token i"""
+    info = self.label_info(label)
+    if info is None:
+      raise KeyError(f'{self.fname} has no {label} labels in its store')
+    return info['names'], self._load(f'{label}.npy')
+
+  def line_labels(self, label, i):
+    """The labels of the tokens of line i"""
+    names, codes = self.get_labels(label)
+    tokens = self.tokens()
+    return [names[c] for c in codes[tokens[i]:tokens[i+1]]]
+
+  def export_labels(self, label, fout):
+    """Write a column as a text label file"""
+    names, codes = self.get_labels(label)
+    names = np.array(names, dtype=object)
+    tokens = self.tokens()
+    with open(fout, 'w', buffering=1<<20) as out:
+      # Lines are joined a block at a time, so that the whole column never has to be in memory as strings
+      block = 1<<16
+      for start in range(0, len(tokens) - 1, block):
+        end = min(start + block, len(tokens) - 1)
+        words = names[codes[tokens[start]:tokens[end]]]
+        lines = np.split(words, tokens[start+1:end] - tokens[start])
+        out.write(''.join(' '.join(line) + '\n' for line in lines))
+
+  def put_alignments(self, name, align_fname):
+    """Add the alignments of a text alignment file ("i-j" pairs, one line per line of the file)"""
+    with open(align_fname, 'rb') as f:
+      data = f.read()
+    # Every pair has one dash, and empty lines have no pairs
+    offsets = text_offsets(data, b'-')
+    offsets -= np.arange(len(offsets))
+    pairs = np.array(data.replace(b'-', b' ').split(), dtype=np.int32).reshape(-1, 2)
+    # Nearly all sentences have fewer than 256 tokens
+    top = pairs.max(initial=0)
+    pairs = pairs.astype(np.uint8 if top < 1<<8 else np.uint16 if top < 1<<16 else np.int32)
+    if len(pairs) != offsets[-1]:
+      raise ValueError(f'{align_fname} is not an alignment file')
+    with self._writing():
+      if len(offsets) != len(self.tokens()):
+        raise ValueError(f'{align_fname} does not have the same number of lines as {self.fname}')
+      self._save(f'{name}.align.npy', pairs)
+      self._save(f'{name}.align_lines.npy', offsets)
+
+  def alignments(self):
+    return sorted(f[:-len('.align.npy')] for f in os.listdir(self.path) if f.endswith('.align.npy')) \
+      if self.is_fresh() else []
+
+  def get_alignments(self, name):
+    """(pairs, line offsets) of an alignment, where pairs[offsets[i]:offsets[i+1]] are the pairs of line i"""
+    if name not in self.alignments():
+      raise KeyError(f'{self.fname} has no {name} alignments in its store')
+    return self._load(f'{name}.align.npy'), self._load(f'{name}.align_lines.npy')
+
+  def export_alignments(self, name, fout):
+    """Write an alignment as a text alignment file"""
+    pairs, offsets = self.get_alignments(name)
+    with open(fout, 'w', buffering=1<<20) as out:
+      block = 1<<16
+      for start in range(0, len(offsets) - 1, block):
+        end = min(start + block, len(offsets) - 1)
+        words = [f'{i}-{j}' for i, j in pairs[offsets[start]:offsets[end]].tolist()]
+        bounds = (offsets[start:end+1] - offsets[start]).tolist()
+        out.write(''.join(' '.join(words[b:e]) + '\n' for b, e in zip(bounds, bounds[1:])))
+
+  def size(self):
+    """The number of bytes that the store takes up"""
+    return sum(os.path.getsize(self.file(f)) for f in os.listdir(self.path)) if os.path.isdir(self.path) else 0
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Export the columns of label stores to text files, or list them""")
+  p.add_argument("command", help="what to do", type=str, choices=['export', 'list'])
+  p.add_argument("files", help="tokenized files whose stores to use", type=str, nargs='+')
+  p.add_argument("--labels", help="label columns to export to FILE.LABEL", type=str, nargs='*', default=[])
+  p.add_argument("--align", help="alignments to export (to the file that the aligner wrote them to)", type=str, nargs='*', default=[])
+  args = p.parse_intermixed_args()
+
+  for fname in args.files:
+    store = LabelStore(fname)
+    if args.command == 'list':
+      if not store.is_fresh():
+        print(f'{fname}: no store (or one of an older version of the file)')
+        continue
+      print(f'{fname}: {len(store.lengths())} lines, {store.lengths().sum()} words, {store.size()} bytes')
+      for label in store.labels():
+        print(f'  labels {label}: {" ".join(store.label_info(label)["names"])}')
+      for name in store.alignments():
+        print(f'  alignments {name}: {len(store.get_alignments(name)[0])} pairs')
+      continue
+    for label in args.labels:
+      store.export_labels(label, label_file(fname, label))
+      print(f'exported {label_file(fname, label)}')
+    for name in args.align:
+      fout = align_file(fname, name)
+      store.export_alignments(name, fout)
+      print(f'exported {fout}')
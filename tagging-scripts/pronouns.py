@@ -0,0 +1,194 @@
+import re
+from collections import Counter
+
+# Pronoun lexicons and the taggers built on them, shared by tag_pronouns.py, identify_japanese_pronouns.py
+# and 2p_pronouns_tv.py. The taggers work on one line at a time, so they can be used on a stream of lines:
+#
+#  tagger = PronounTagger('fr', do_formal=True)
+#  for tags in tagger.tag_lines(open('out.fr.tok')):
+#    print(tags)
+#
+# Everything that only depends on a word (like the tag string to write for it) is worked out once when
+# the tagger is created, so tagging a line is a single dictionary lookup per token.
+
+# Each pronoun maps to (person, formality, plurality), where None means that it is not marked
+lexicons = {}
+
+lexicons['ja'] = {
+  # "Standard" first person
+  '私': (1, 'fml', 'sing'),
+  'わたし': (1, 'fml', 'sing'),
+  'わたくし': (1, 'fml', 'sing'),
+  '僕': (1, 'infml', 'sing'),
+  'ぼく': (1, 'infml', 'sing'),
+  '俺': (1, 'infml', 'sing'),
+  'おれ': (1, 'infml', 'sing'),
+  '我々': (1, 'infml', 'plrl'), # (1, 'fml', 'sing')st person plural
+  # Less standard first person
+  'あたし': (1, 'infml', 'sing'),
+  'あたくし': (1, 'infml', 'sing'),
+  'わし': (1, 'infml', 'sing'),
+  'わて': (1, 'infml', 'sing'),
+  'わい': (1, 'infml', 'sing'),
+  'うち': (1, 'infml', 'sing'),
+  'おいら': (1, 'infml', 'sing'),
+  'おい': (1, 'infml', 'sing'),
+  '我輩': (1, 'fml', 'sing'),
+  '吾輩': (1, 'fml', 'sing'),
+  '我が輩': (1, 'fml', 'sing'),
+  '吾が輩': (1, 'fml', 'sing'),
+  # "Standard" second person
+  'あなた': (2, 'fml', 'sing'),
+  'あんた': (2, 'infml', 'sing'),
+  'お前': (2, 'infml', 'sing'),
+  '君': (2, 'infml', 'sing'),
+  # Less standard second person
+  '貴方': (2, 'fml', 'sing'),
+  'アナタ': (2, 'infml', 'sing'),
+  'おまえ': (2, 'infml', 'sing'),
+  'きみ': (2, 'infml', 'sing'),
+  'キミ': (2, 'infml', 'sing'),
+  # "Standard" third person
+  '彼': (3, 'fml', 'sing'), # can also mean "boyfriend"
+  'かれ': (3, 'fml', 'sing'), # can also mean "boyfriend"
+  '彼女': (3, 'fml', 'sing'), # can also mean "girlfriend"
+  'かのじょ': (3, 'fml', 'sing'), # can also mean "girlfriend"
+  'あいつ': (3, 'infml', 'sing'),
+}
+
+lexicons['en'] = {
+  'i': (1, None, 'sing'),
+  'me': (1, None, 'sing'),
+  'you': (2, None, None),
+  'he': (3, None, 'sing'),
+  'him': (3, None, 'sing'),
+  'she': (3, None, 'sing'),
+  'they': (3, None, 'plrl'),
+  'them': (3, None, 'plrl'),
+  'we': (1, None, 'plrl'),
+  'us': (1, None, 'plrl'),
+}
+
+lexicons['fr'] = {
+  # I (subject)
+  'je': (1, None, 'sing'),
+  # Me (object)
+  'moi': (1, None, 'sing'),
+  # You (subject)
+  'tu': (2, 'infml', 'sing'),
+  # You (object)
+  'toi': (2, 'infml', 'sing'),
+  # He (subject)
+  'il': (3, None, 'sing'),
+  # Him (object)
+  'lui': (3, None, 'sing'),
+  # She/her (object and subject)
+  'elle': (3, None, 'sing'),
+  # this is a weird one. It can be translated as "one" in english (eg "one does not do this") but is also used a lot as an informal way of saying "we" (very relevant here)
+  # I would say that it is informal. Also it refers to multiple or an indefinite amount of people but still conjugates as a singular (yes...)
+  'on': (1, 'infml', 'sing'),
+  # We/us
+  'nous': (1, None, 'plrl'),
+  # You: This is either (plural AND neither formal or informal) OR (singular AND formal).
+  'vous': (2, None, None),
+  # They (subject, masculine)
+  'ils': (3, None, 'plrl'),
+  # They (object, masculine)
+  'eux': (3, None, 'plrl'),
+  # They (subject/object, feminine)
+  'elles': (3, None, 'plrl'),
+}
+
+# Second person pronouns, grouped by the form of address that they use
+second_person_lexicons = {
+  'en': {'neutral': ('you',)},
+  'fr': {'T': ('tu', 'te', 'toi'), 'V': ('vous',)},
+}
+
+def tag_string(person, formality, plurality, do_formal=False, do_plural=False):
+  """The tag of a pronoun, e.g. 2_infml_sing"""
+  tag = str(person)
+  if do_formal and formality:
+    tag += f'_{formality}'
+  if do_plural and plurality:
+    tag += f'_{plurality}'
+  return tag
+
+class PronounTagger:
+  """Replaces every word of a tokenized line by the tag of the pronoun, or 'other' if it is not one"""
+
+  def __init__(self, lang, do_formal=False, do_plural=False):
+    self.tags = {w: tag_string(*info, do_formal=do_formal, do_plural=do_plural) for w, info in lexicons[lang].items()}
+
+  def tag_line(self, line):
+    get = self.tags.get
+    return ' '.join([get(w, 'other') for w in line.strip().lower().split(' ')])
+
+  def tag_lines(self, lines):
+    for line in lines:
+      yield self.tag_line(line)
+
+class JapanesePronounMarker:
+  """Removes the tags from KyTea output (word/POS/reading), and surrounds every pronoun X by
+  <<<X>>>_{1,2,3} indicating its person. Pronouns that are not in the lexicon are counted in missed."""
+
+  def __init__(self):
+    self.marked = {w: f'<<<{w}>>>_{person}' for w, (person, _, _) in lexicons['ja'].items()}
+    self.missed = Counter()
+    self.malformed = []
+
+  def mark_line(self, line):
+    line = line.replace('\\ ', '　') # remove space tokens
+    marked = self.marked
+    out = []
+    for w in line.strip().split(' '):
+      t = w.split('/')
+      if len(t) != 3:
+        self.malformed.append(w)
+        out.append(w)
+      elif t[1] == '代名詞':
+        if t[0] in marked:
+          out.append(marked[t[0]])
+        else:
+          self.missed[t[0]] += 1
+          out.append(t[0])
+      else:
+        out.append(t[0])
+    return ' '.join(out)
+
+  def mark_lines(self, lines):
+    for line in lines:
+      yield self.mark_line(line)
+
+class SecondPersonCounter:
+  """Counts the second person pronouns in a list of tokens"""
+
+  def __init__(self, lang):
+    self.lexicon = second_person_lexicons[lang]
+    self.pronouns = {p for ps in self.lexicon.values() for p in ps}
+    # A pronoun that is a whole \w+ token (longest first, so that no pronoun only matches part of another)
+    alternation = '|'.join(re.escape(p) for p in sorted(self.pronouns, key=len, reverse=True))
+    self.pattern = re.compile(rf'(?<!\w)(?:{alternation})(?!\w)')
+
+  def count(self, tokens):
+    """A dict from each form of address that occurs in the tokens to the count of each of its pronouns,
+    both in the order of the lexicon"""
+    counts = Counter([t for t in tokens if t in self.pronouns])
+    found = {}
+    if counts:
+      for k, ps in self.lexicon.items():
+        in_k = {p: counts[p] for p in ps if counts[p]}
+        if in_k:
+          found[k] = in_k
+    return found
+
+  def count_text(self, text):
+    r"""The same as count(re.findall(r'\w+', text)), but only finding the pronouns instead of all tokens"""
+    matches = self.pattern.findall(text)
+    found = {}
+    if matches:
+      for k, ps in self.lexicon.items():
+        in_k = {p: matches.count(p) for p in ps if p in matches}
+        if in_k:
+          found[k] = in_k
+    return found
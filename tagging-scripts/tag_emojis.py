@@ -1,7 +1,35 @@
 import sys
-import emoji
+import argparse
+import multiprocessing
+from emojis import EmojiTagger
 
-for line in sys.stdin:
-  words = line.strip().split(' ')
-  print(' '.join(['emoji' if any([c in emoji.UNICODE_EMOJI for c in w]) else 'other' for w in words]))
+# Tag every word of tokenized text as 'emoji' or 'other':
+# $ python tag_emojis.py < in.tok > in.emoji
+#
+# Many files can also be tagged in one call, in which case FILE.tok is written to FILE.emoji
+# (and any other FILE to FILE.emoji):
+# $ python tag_emojis.py --num_proc 4 a.tok b.tok c.tok
 
+def output_file(fname):
+  return fname[:-len('.tok')] + '.emoji' if fname.endswith('.tok') else fname + '.emoji'
+
+def tag_file(fname):
+  tagger = EmojiTagger()
+  with open(fname, 'r') as ins, open(output_file(fname), 'w') as outs:
+    for tags in tagger.tag_lines(ins):
+      outs.write(tags + '\n')
+  return output_file(fname)
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Convert tokenized words into a file of tags indicating emoji""")
+  p.add_argument("files", help="files to tag, each written to FILE.emoji (read stdin if none are given)", type=str, nargs='*')
+  p.add_argument("--num_proc", help="number of files to tag at the same time", type=int, default=1)
+  args = p.parse_args()
+
+  if not args.files:
+    for tags in EmojiTagger().tag_lines(sys.stdin):
+      print(tags)
+  else:
+    with multiprocessing.Pool(args.num_proc) as pool:
+      for fout in pool.imap_unordered(tag_file, args.files):
+        print(f'wrote {fout}', file=sys.stderr)
@@ -0,0 +1,159 @@
+import sys
+import argparse
+import hashlib
+import multiprocessing
+import emoji
+from emojis import EmojiTagger
+from pronouns import PronounTagger, lexicons
+from label_cache import LabelCache, content_hash
+from label_store import LabelStore, label_file
+
+# Write all of the label files of tokenized files in a single pass over each of them, with the files spread
+# over a pool of processes. FILE.tok is written to FILE.emoji, FILE.prn, etc. (and any other FILE to
+# FILE.emoji, FILE.prn, etc.):
+# $ python tag_files.py fr --labels emoji prn --num_proc 4 a.fr.tok b.fr.tok
+#
+# With --cache, label files are kept in a cache directory that can be shared between runs, and are copied
+# from there instead of being made again whenever the same content was tagged in the same way before:
+# $ python tag_files.py fr --cache tag-cache a.fr.tok b.fr.tok
+#
+# With --store, the labels are also added as columns to the label store of each file (see label_store.py),
+# where they can be read without parsing and exported to text again:
+# $ python tag_files.py fr --store a.fr.tok b.fr.tok
+#
+# This can also be used from python, which is what run_compare_mt.py does:
+#  tag_files([('a.fr.tok', 'fr', ['emoji', 'prn'])], num_proc=4, cache_dir='tag-cache', store=True)
+
+class TaggerSpec:
+  """How to create a tagger for a language, and everything other than the input that its labels depend on.
+  The version has to change whenever the tagger starts to write different labels."""
+
+  def __init__(self, make_tagger, version, options=None):
+    self.make_tagger = make_tagger
+    self.version = version
+    self.options = options or {}
+
+  def merged_options(self, options=None):
+    merged = dict(self.options)
+    for k, v in (options or {}).items():
+      if k not in merged:
+        raise ValueError(f'Unknown tagger option {k}')
+      merged[k] = v
+    return merged
+
+  def create(self, lang, options=None):
+    return self.make_tagger(lang, **self.merged_options(options))
+
+# The taggers that can be used, by the extension of the label files that they write. Every tagger is
+# created from the language of the file and its options, and has a tag_line() method that returns the
+# labels of a line.
+taggers = {}
+
+def register_tagger(label, make_tagger, version, options=None):
+  """Make a tagger available under a label, e.g. register_tagger('prn', PronounTagger, '1', {'do_formal': False})"""
+  if label in taggers:
+    raise ValueError(f'Tagger {label} is already registered')
+  taggers[label] = TaggerSpec(make_tagger, version, options)
+
+def lexicon_digest(lexicon):
+  """A short hash of a lexicon, so that the version of a tagger changes along with its lexicon"""
+  return hashlib.blake2b(repr(sorted(lexicon.items(), key=repr)).encode('utf-8'), digest_size=8).hexdigest()
+
+register_tagger('emoji', lambda lang: EmojiTagger(), f'1-emoji{emoji.__version__}')
+register_tagger('prn', PronounTagger, f'1-{lexicon_digest(lexicons)}', {'do_formal': False, 'do_plural': False})
+
+def made_with(label, lang, options=None):
+  """What the labels of a tagger depend on other than the input, as recorded in the label store"""
+  spec = taggers[label]
+  return {'version': spec.version, 'lang': lang, 'options': spec.merged_options(options)}
+
+def stored_labels(fname, lang, labels, options=None):
+  """The labels of fname that are in its label store and were made by the current taggers"""
+  options = options or {}
+  store = LabelStore(fname)
+  found = []
+  for label in labels:
+    info = store.label_info(label)
+    if info and info['made_with'] == made_with(label, lang, options.get(label)):
+      found.append(label)
+  return found
+
+def tag_file(job):
+  """Write the given label files of a file. Those that are in the cache are copied from there, and the rest
+  are made in a single pass over the file with all of their taggers at once (and then added to the cache).
+  With store, all of them are then added to the label store of the file."""
+  fname, lang, labels, options, cache_dir, store = job
+  options = options or {}
+  cache = LabelCache(cache_dir) if cache_dir else None
+  keys = {}
+  all_labels = labels
+  if cache:
+    input_hash = content_hash(fname)
+    for label in labels:
+      spec = taggers[label]
+      keys[label] = cache.key(input_hash, label, spec.version, lang, spec.merged_options(options.get(label)))
+    labels = [label for label in labels if not cache.get(keys[label], label, label_file(fname, label))]
+  line_taggers = [taggers[label].create(lang, options.get(label)) for label in labels]
+  outs = []
+  try:
+    for label in labels:
+      fout = label_file(fname, label)
+      if fout == fname:
+        raise ValueError(f'Error {fout} would overwrite its input')
+      outs.append(open(fout, 'w', buffering=1<<20))
+    if outs:
+      with open(fname, 'r') as ins:
+        for line in ins:
+          for tagger, out in zip(line_taggers, outs):
+            out.write(tagger.tag_line(line) + '\n')
+  finally:
+    for out in outs:
+      out.close()
+  if cache:
+    for label in labels:
+      cache.put(keys[label], label, label_file(fname, label))
+  if store:
+    label_store = LabelStore(fname)
+    for label in all_labels:
+      try:
+        label_store.put_labels(label, label_file(fname, label), made_with(label, lang, options.get(label)))
+      except ValueError as e:
+        # The text label file is still there, so one file that cannot be stored does not stop the others
+        print(f'not stored: {e}', file=sys.stderr)
+  return fname, labels, (cache.hits, cache.misses) if cache else (0, 0)
+
+def tag_files(jobs, num_proc=1, options=None, cache_dir=None, cache_size=None, store=False):
+  """Run tag_file() on every (file, language, labels) job, num_proc files at a time. options gives the
+  options of the taggers by label, cache_size is the maximum size of the cache in bytes, and with store the
+  labels are added to the label stores of the files."""
+  hits, misses = 0, 0
+  with multiprocessing.Pool(num_proc) as pool:
+    for fname, tagged, (h, m) in pool.imap_unordered(tag_file, [(f, lang, labels, options, cache_dir, store) for f, lang, labels in jobs]):
+      print(f'tagged {fname}: {" ".join(tagged) if tagged else "(all from cache)"}')
+      hits += h
+      misses += m
+  if cache_dir:
+    cache = LabelCache(cache_dir)
+    cache.hits, cache.misses = hits, misses
+    print(cache.report())
+    if cache_size is not None:
+      removed = cache.evict(cache_size)
+      if removed:
+        print(f'label cache: removed {removed} least recently used files')
+
+if __name__ == '__main__':
+  p = argparse.ArgumentParser(description="""Write the label files of tokenized files""")
+  p.add_argument("lang", help="what language the files are in (en/fr/ja)", type=str)
+  p.add_argument("files", help="files to tag", type=str, nargs='+')
+  p.add_argument("--labels", help="what label files to write", type=str, nargs='+', choices=sorted(taggers), default=sorted(taggers))
+  p.add_argument("--do_formal", help="Whether to distinguish formality in the pronoun labels", action='store_true')
+  p.add_argument("--do_plural", help="Whether to distinguish plural in the pronoun labels", action='store_true')
+  p.add_argument("--num_proc", help="number of files to tag at the same time", type=int, default=1)
+  p.add_argument("--cache", help="directory to cache label files in", type=str, default=None)
+  p.add_argument("--cache_size", help="maximum size of the cache in MB", type=int, default=2000)
+  p.add_argument("--store", help="Whether to also add the labels to the label stores of the files", action='store_true')
+  args = p.parse_intermixed_args()
+
+  options = {'prn': {'do_formal': args.do_formal, 'do_plural': args.do_plural}}
+  tag_files([(f, args.lang, args.labels) for f in args.files], args.num_proc, options=options,
+            cache_dir=args.cache, cache_size=args.cache_size << 20, store=args.store)